@@ -0,0 +1,130 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Token-bucket admission control for the PacketIn path of the oracles.
+
+Each bucket is stored as a single float, the time at which it would be
+completely refilled (the "theoretical arrival time" of GCRA). Refill is thus
+computed lazily when a requester shows up, and a requester whose bucket is
+already full can be forgotten without losing any state.
+"""
+
+import time
+
+
+class TokenBucket:
+    """A family of token buckets sharing the same rate and burst size, indexed
+    by key (e.g. the IP address of the requester)."""
+
+    def __init__ (self, rate, burst = None, max_entries = 10000, clock = time.time):
+        if rate <= 0:
+            raise ValueError("token bucket rate must be positive")
+        if burst is None:
+            burst = max(1, int(rate))
+        if burst < 1:
+            raise ValueError("token bucket burst must be at least 1")
+        self.interval = 1.0 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.max_entries = max_entries
+        self.clock = clock
+        self.tat = {}
+        self._sweep_at = max_entries
+
+    def available (self, key = None):
+        """returns True if the bucket of key has a token, without taking it"""
+        tat = self.tat.get(key)
+        return tat is None or tat - self.clock() <= self.tolerance
+
+    def consume (self, key = None):
+        """takes a token from the bucket of key. Returns True if one was
+        available, False if the key is over its rate"""
+        now = self.clock()
+        tat = self.tat.get(key, now)
+        if tat < now:
+            tat = now
+        elif tat - now > self.tolerance:
+            return False
+        self.tat[key] = tat + self.interval
+        if len(self.tat) > self._sweep_at:
+            self.sweep(now)
+        return True
+
+    def sweep (self, now = None):
+        """forgets all the keys whose bucket is full again"""
+        if now is None:
+            now = self.clock()
+        for key in [k for k, tat in self.tat.iteritems() if tat <= now]:
+            del self.tat[key]
+        # don't sweep again before the table has grown a bit, otherwise a
+        # large set of active requesters would make every call O(n)
+        self._sweep_at = max(self.max_entries, 2 * len(self.tat))
+
+    def __len__ (self):
+        return len(self.tat)
+
+
+class AdmissionControl:
+    """Combines a per-requester and a global token bucket. Either can be
+    disabled by passing None as its rate."""
+
+    def __init__ (self, rate = None, burst = None, global_rate = None,
+                  global_burst = None, drop_time = None, clock = time.time):
+        self.perSource = None
+        self.overall = None
+        if rate is not None:
+            self.perSource = TokenBucket(rate, burst, clock = clock)
+        if global_rate is not None:
+            self.overall = TokenBucket(global_rate, global_burst, clock = clock)
+        if drop_time is not None and drop_time <= 0:
+            # a flow without timeouts would drop the requester for good
+            raise ValueError("drop_time must be positive")
+        # idle/hard timeout of the drop flow installed for rejected requesters,
+        # None to only drop the offending packet
+        self.drop_time = drop_time
+        self.admitted = 0
+        self.rejected = 0
+
+    def admit (self, requester):
+        """returns True if a request from requester should be processed. a
+        token is taken from both buckets, or (if either is empty) none"""
+        if ((self.perSource is not None and
+             not self.perSource.available(requester)) or
+                (self.overall is not None and not self.overall.available())):
+            self.rejected += 1
+            return False
+        if self.perSource is not None:
+            self.perSource.consume(requester)
+        if self.overall is not None:
+            self.overall.consume()
+        self.admitted += 1
+        return True
+
+
+def build (rate = None, burst = None, global_rate = None, global_burst = None,
+           drop_time = None):
+    """Creates an AdmissionControl from (string) launch() arguments, or
+    returns None if no rate was specified"""
+    if rate is None and global_rate is None:
+        return None
+    def num (value, kind):
+        if value is None:
+            return None
+        return kind(str(value))
+    try:
+        return AdmissionControl(num(rate, float), num(burst, int),
+                                num(global_rate, float), num(global_burst, int),
+                                num(drop_time, int))
+    except ValueError as e:
+        raise RuntimeError("Invalid admission control parameters: %s" % (e,))
@@ -0,0 +1,104 @@
+"""Unit test for admission.py"""
+import unittest
+from admission import TokenBucket, AdmissionControl, build
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class Consume(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(2, 3, clock = self.clock)
+
+    def testBurst(self):
+        """consume should succeed burst times in a row, then fail"""
+        for i in range(3):
+            self.assertTrue(self.bucket.consume('10.0.0.1'))
+        self.assertFalse(self.bucket.consume('10.0.0.1'))
+
+    def testRefill(self):
+        """tokens should come back at the configured rate"""
+        for i in range(3):
+            self.bucket.consume('10.0.0.1')
+        self.clock.now += 0.5
+        self.assertTrue(self.bucket.consume('10.0.0.1'))
+        self.assertFalse(self.bucket.consume('10.0.0.1'))
+
+    def testIndependentKeys(self):
+        """each key should have its own bucket"""
+        for i in range(3):
+            self.bucket.consume('10.0.0.1')
+        self.assertTrue(self.bucket.consume('10.0.0.2'))
+
+class Sweep(unittest.TestCase):
+    def testSweepFullBuckets(self):
+        """sweep should forget the keys whose bucket has refilled"""
+        clock = FakeClock()
+        bucket = TokenBucket(1, 1, clock = clock)
+        bucket.consume('10.0.0.1')
+        clock.now += 0.5
+        bucket.consume('10.0.0.2')
+        clock.now += 0.5
+        bucket.sweep()
+        self.assertEqual(len(bucket), 1)
+
+    def testBoundedSize(self):
+        """the table should not grow past max_entries with idle keys"""
+        clock = FakeClock()
+        bucket = TokenBucket(10, 1, max_entries = 5, clock = clock)
+        for i in range(50):
+            bucket.consume(i)
+            clock.now += 1
+        self.assertTrue(len(bucket) <= 6)
+
+class Admit(unittest.TestCase):
+    def testGlobalLimit(self):
+        """the global bucket should limit requesters that are within their rate"""
+        clock = FakeClock()
+        ac = AdmissionControl(rate = 10, burst = 10, global_rate = 1,
+                              global_burst = 2, clock = clock)
+        self.assertTrue(ac.admit('10.0.0.1'))
+        self.assertTrue(ac.admit('10.0.0.2'))
+        self.assertFalse(ac.admit('10.0.0.3'))
+        self.assertEqual(ac.rejected, 1)
+
+    def testRejectedByGlobal(self):
+        """a request rejected by the global bucket should not use a token of its requester"""
+        clock = FakeClock()
+        ac = AdmissionControl(rate = 1, burst = 1, global_rate = 10,
+                              global_burst = 1, clock = clock)
+        self.assertTrue(ac.admit('10.0.0.1'))
+        self.assertFalse(ac.admit('10.0.0.2'))
+        clock.now += 0.1
+        self.assertTrue(ac.admit('10.0.0.2'))
+
+    def testRejectedBySource(self):
+        """a request rejected by its requester's bucket should not use a global token"""
+        clock = FakeClock()
+        ac = AdmissionControl(rate = 1, burst = 1, global_rate = 1,
+                              global_burst = 2, clock = clock)
+        self.assertTrue(ac.admit('10.0.0.1'))
+        self.assertFalse(ac.admit('10.0.0.1'))
+        self.assertTrue(ac.admit('10.0.0.2'))
+
+    def testDropTime(self):
+        """a drop_time of zero or less should be refused"""
+        self.assertRaises(RuntimeError, build, rate = '5', drop_time = '0')
+        self.assertRaises(RuntimeError, build, rate = '5', drop_time = '-1')
+
+    def testBuildDisabled(self):
+        """build should return None when no rate is given"""
+        self.assertEqual(build(), None)
+
+    def testBuildFromStrings(self):
+        """build should accept the strings passed by launch()"""
+        ac = build(rate = '5', burst = '2', drop_time = '10')
+        self.assertEqual(ac.drop_time, 10)
+        self.assertEqual(ac.overall, None)
+
+if __name__ == '__main__':
+    unittest.main()
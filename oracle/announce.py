@@ -0,0 +1,214 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Lets VoD servers register the contents they hold directly with the oracle.
+
+Servers (see vodServer/ContentAnnouncer.py) send JSON datagrams over UDP:
+
+  {"port": 9002, "seq": 7, "interval": 5, "add": [...], "remove": [...]}
+      a delta: contents added/removed since the message with seq 6
+  {"port": 9002, "seq": 7, "interval": 5}
+      a heartbeat (neither "add" nor "remove"): nothing changed since seq 7,
+      so a seq other than that of the last message applied means a loss
+  {"port": 9002, "seq": 8, "interval": 5, "full": true, "part": 0,
+   "parts": 3, "add": [...]}
+      one of the parts of a full snapshot of the holdings
+
+Any of them can also carry "chunks": {"content": "1f", ...}, the chunks held
+of the contents being downloaded, as a hex bitmap (bit i set if chunk i is
+held). They replace the ones announced before, whatever the seq, and are
+ignored unless the OracleDB is chunk-aware. ContentAnnouncer sends them for
+the files being downloaded by the peer (given the oracle's chunk_size), a
+"0" bitmap for those no longer in progress.
+
+The peer is identified by the source IP of the datagram, plus the announced
+port for the TCP oracle. Datagrams are received on a background thread and
+applied in bulk on the POX event loop. When a delta shows that some message
+was lost, the deltas of that peer are ignored until its next full snapshot.
+A peer that misses three heartbeats in a row is expired and removed from all
+the contents it announced.
+"""
+
+from pox.core import core
+from pox.lib.recoco import Timer
+import socket
+import threading
+import json
+import time
+import os
+
+log = core.getLogger()
+
+# a peer expires after this many missed heartbeats
+MISSED_HEARTBEATS = 3
+
+
+class Peer (object):
+    def __init__ (self):
+        self.contents = set()
+        # the contents of which some chunks were announced
+        self.chunks = set()
+        self.seq = None
+        self.interval = 5
+        self.lastSeen = 0
+        # full snapshot being received: seq, parts, parts received, contents
+        self.snapshot = None
+
+
+class AnnounceListener (object):
+    def __init__ (self, db, port, address = '', with_port = True,
+                  strip_ext = False):
+        # the OracleDB to register the sources in
+        self.db = db
+        # TCPOracle sources are ip:port, DNSOracle sources just ip
+        self.with_port = with_port
+        # DNSOracle contents have no extension
+        self.strip_ext = strip_ext
+        self.peers = {}
+        self.closed = False
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((address, int(port)))
+        self.thread = threading.Thread(target = self._receive)
+        self.thread.daemon = True
+        self.thread.start()
+        self.timer = Timer(1, self._expire, recurring = True)
+        log.info("Listening for content announcements on port %s", port)
+
+    def close (self):
+        """stops listening, e.g. at the end of a test"""
+        self.timer.cancel()
+        self.closed = True
+        # wake the receiving thread up
+        wake = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        wake.sendto('', ('127.0.0.1', self.sock.getsockname()[1]))
+        wake.close()
+        self.thread.join(1)
+        self.sock.close()
+
+    def _receive (self):
+        while True:
+            data, addr = self.sock.recvfrom(65535)
+            if self.closed:
+                return
+            try:
+                msg = json.loads(data)
+                port = int(msg.get('port', 0))
+                seq = int(msg['seq'])
+                # checked here, as they would raise on the POX event loop
+                interval = float(msg.get('interval', 1))
+                parts = int(msg.get('parts', 1))
+                part = int(msg.get('part', 0))
+                if not interval > 0 or not 0 <= part < parts:
+                    raise ValueError()
+                for field in 'add', 'remove':
+                    if not isinstance(msg.get(field, []), list):
+                        raise TypeError()
+                if not isinstance(msg.get('chunks', {}), dict):
+                    raise TypeError()
+            except (ValueError, KeyError, TypeError, AttributeError):
+                log.debug("Malformed announcement from %s", addr[0])
+                continue
+            source = addr[0]
+            if self.with_port:
+                source = "%s:%d" % (source, port)
+            core.callLater(self._apply, source, seq, msg)
+
+    def _name (self, content):
+        if isinstance(content, unicode):
+            # json gives unicode strings, the contents are UTF-8 paths
+            content = content.encode('utf-8')
+        else:
+            content = str(content)
+        if self.strip_ext:
+            content = os.path.splitext(content)[0]
+        return content
+
+    def _apply (self, source, seq, msg):
+        peer = self.peers.get(source)
+        if peer is None:
+            peer = self.peers[source] = Peer()
+            log.info("New announcing peer %s", source)
+        peer.lastSeen = time.time()
+        peer.interval = float(msg.get('interval', peer.interval))
+        if msg.get('chunks') and self.db.chunkSize:
+            self._chunks(source, peer, msg['chunks'])
+        if msg.get('full'):
+            if peer.snapshot is None or peer.snapshot[0] != seq:
+                peer.snapshot = (seq, int(msg.get('parts', 1)), set(), set())
+            _, parts, received, contents = peer.snapshot
+            received.add(int(msg.get('part', 0)))
+            contents.update(self._name(c) for c in msg.get('add', ()))
+            if len(received) == parts:
+                peer.snapshot = None
+                self._replace(source, peer, contents)
+                peer.seq = seq
+            return
+        if peer.seq is None:
+            # waiting for a snapshot
+            return
+        heartbeat = 'add' not in msg and 'remove' not in msg
+        if seq != (peer.seq if heartbeat else peer.seq + 1):
+            log.debug("Lost announcements from %s, waiting for a snapshot",
+                      source)
+            peer.seq = None
+            return
+        if heartbeat:
+            return
+        peer.seq = seq
+        added = set(self._name(c) for c in msg.get('add', ()))
+        removed = set(self._name(c) for c in msg.get('remove', ()))
+        self._update(source, peer, added - peer.contents,
+                     removed & peer.contents)
+
+    def _chunks (self, source, peer, chunks):
+        for content, bitmap in chunks.items():
+            try:
+                bitmap = int(bitmap, 16)
+            except (ValueError, TypeError):
+                log.debug("Malformed chunks of %s from %s", content, source)
+                continue
+            content = self._name(content)
+            self.db.setChunks(content, source, bitmap)
+            if self.db.hasSource(content, source):
+                # complete: from now on a regular source of the content
+                peer.chunks.discard(content)
+            else:
+                peer.chunks.add(content)
+
+    def _replace (self, source, peer, contents):
+        self._update(source, peer, contents - peer.contents,
+                     peer.contents - contents)
+
+    def _update (self, source, peer, added, removed):
+        if added:
+            self.db.addSources(added, source)
+            peer.contents |= added
+        if removed:
+            self.db.removeSources(removed, source)
+            peer.contents -= removed
+        if added or removed:
+            log.debug("%s announced %d new and %d removed contents", source,
+                      len(added), len(removed))
+
+    def _expire (self):
+        now = time.time()
+        for source, peer in self.peers.items():
+            if now - peer.lastSeen > MISSED_HEARTBEATS * peer.interval:
+                log.info("Peer %s stopped announcing, removing its %d contents",
+                         source, len(peer.contents))
+                self.db.removeSources(peer.contents, source)
+                for content in peer.chunks:
+                    self.db.removeChunks(content, source)
+                del self.peers[source]
@@ -0,0 +1,117 @@
+"""Unit test for announce.py. Needs POX, found on the path or in the POX
+environment variable (e.g. POX=~/pox)"""
+import json
+import socket
+import time
+import unittest
+import replay
+from oracleDB import OracleDB
+
+core = replay.trySetup()
+if core is not None:
+    from announce import AnnounceListener
+
+SOURCE = '10.0.0.5:9002'
+
+@unittest.skipIf(core is None, "POX can't be imported")
+class Apply(unittest.TestCase):
+    def setUp(self):
+        self.db = OracleDB()
+        self.listener = AnnounceListener(self.db, 0, '127.0.0.1')
+
+    def tearDown(self):
+        self.listener.close()
+
+    def apply(self, seq, **msg):
+        msg.update(port = 9002, seq = seq, interval = 5)
+        self.listener._apply(SOURCE, seq, msg)
+
+    def held(self):
+        return set(c for c in ('a', 'b', 'c', 'd')
+                   if self.db.hasSource(c, SOURCE))
+
+    def testDeltas(self):
+        """deltas following a snapshot in order should be applied"""
+        self.apply(1, full = True, part = 0, parts = 1, add = ['a', 'b'])
+        self.apply(2, add = ['c'])
+        self.apply(3, remove = ['a'])
+        self.assertEqual(self.held(), set(['b', 'c']))
+        self.assertEqual(self.listener.peers[SOURCE].seq, 3)
+
+    def testLoss(self):
+        """after a gap in the seqs, deltas should be ignored until a snapshot"""
+        self.apply(1, full = True, part = 0, parts = 1, add = ['a'])
+        self.apply(3, add = ['c'])
+        self.apply(4, add = ['d'])
+        self.assertEqual(self.held(), set(['a']))
+        self.apply(5, full = True, part = 0, parts = 1, add = ['b', 'c', 'd'])
+        self.assertEqual(self.held(), set(['b', 'c', 'd']))
+
+    def testHeartbeat(self):
+        """a heartbeat with the last seq should change nothing"""
+        self.apply(1, full = True, part = 0, parts = 1, add = ['a'])
+        self.apply(2, add = ['b'])
+        self.apply(2)
+        self.apply(3, remove = ['b'])
+        self.assertEqual(self.held(), set(['a']))
+        self.assertEqual(self.listener.peers[SOURCE].seq, 3)
+
+    def testHeartbeatAfterLoss(self):
+        """a heartbeat with a later seq should reveal a lost delta"""
+        self.apply(1, full = True, part = 0, parts = 1, add = ['a'])
+        # the delta with seq 2 is lost
+        self.apply(2)
+        self.assertEqual(self.listener.peers[SOURCE].seq, None)
+        self.apply(3, add = ['c'])
+        self.assertEqual(self.held(), set(['a']))
+
+    def testSnapshotParts(self):
+        """a snapshot should replace the contents once all its parts arrived"""
+        self.apply(1, full = True, part = 0, parts = 1, add = ['a', 'b'])
+        self.apply(2, full = True, part = 1, parts = 2, add = ['d'])
+        self.assertEqual(self.held(), set(['a', 'b']))
+        self.apply(2, full = True, part = 0, parts = 2, add = ['c'])
+        self.assertEqual(self.held(), set(['c', 'd']))
+        self.assertEqual(self.listener.peers[SOURCE].seq, 2)
+
+    def testExpire(self):
+        """a peer missing its heartbeats should be removed from its contents"""
+        self.apply(1, full = True, part = 0, parts = 1, add = ['a'])
+        self.listener.peers[SOURCE].lastSeen -= 16
+        self.listener._expire()
+        self.assertEqual(self.held(), set())
+        self.assertEqual(self.listener.peers, {})
+
+@unittest.skipIf(core is None, "POX can't be imported")
+class Receive(unittest.TestCase):
+    def setUp(self):
+        self.listener = AnnounceListener(OracleDB(), 0, '127.0.0.1')
+        self.applied = []
+        self.listener._apply = lambda *args: self.applied.append(args)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def tearDown(self):
+        self.listener.close()
+        self.sock.close()
+
+    def send(self, data):
+        self.sock.sendto(data, self.listener.sock.getsockname())
+
+    def testMalformed(self):
+        """announcements that would fail on the event loop should be dropped"""
+        for msg in ({'port': 9002}, {'seq': 1, 'interval': 'soon'},
+                    {'seq': 1, 'interval': 0}, {'seq': 1, 'full': True,
+                    'part': 2, 'parts': 2}, {'seq': 1, 'parts': 'two'},
+                    {'seq': 1, 'add': 'a'}, {'seq': 1, 'chunks': ['a']}, [1]):
+            self.send(json.dumps(msg))
+        self.send('{"seq":')
+        self.send(json.dumps({'port': 9002, 'seq': 7, 'interval': 5}))
+        for i in range(50):
+            if self.applied:
+                break
+            time.sleep(0.05)
+        self.assertEqual([args[:2] for args in self.applied],
+                         [('127.0.0.1:9002', 7)])
+
+if __name__ == '__main__':
+    unittest.main()
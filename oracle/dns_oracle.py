@@ -28,7 +28,19 @@ import pox.lib.packet.ipv4 as pkt_ip
 import pox.lib.packet.ethernet as pkt_eth
 from pox.lib.addresses import IPAddr
 from pox.lib.revent import *
+from pox.lib.recoco import Timer
 from oracleDB import OracleDB
+import admission
+from metrics import Metrics, NullMetrics
+import metrics as oracle_metrics
+import profiling as oracle_profiling
+import selection
+import ttl as dns_ttl
+import eventlog
+import flow_table
+from flow_learner import FlowStatsLearner, loadCatalog
+from announce import AnnounceListener
+from redirect import RedirectTracker, MissCache
 
 log = core.getLogger()
 
@@ -56,14 +68,35 @@ class DNSLookup (Event):
 class DNSOracle (EventMixin):
     _eventMixin_events = set([ DNSUpdate, DNSLookup ])
     
-    def __init__ (self, install_flow = True):
+    def __init__ (self, install_flow = True, admission = None, metrics = None,
+                  events = None):
         self._install_flow = install_flow
+        # optional AdmissionControl limiting the rate of VoD requests
+        self.admission = admission
+        if metrics is None:
+            metrics = NullMetrics()
+        self.metrics = metrics
+        # EventLog for the messages on the redirect path
+        if events is None:
+            events = eventlog.EventLog(log)
+        self.events = events
         self.ip_to_name = {}
         self.name_to_ip = {}
         self.cname = {}
         self.oracle = OracleDB()
-        self.tcpFlowsMap = {}
+        self.redirects = RedirectTracker(self.oracle)
+        self.tcpFlowsMap = self.redirects.flows
+        # optional FlowStatsLearner, AnnounceListener, DeferredSelector and
+        # AdaptiveTTL, set by launch()
+        self.learner = None
+        self.announcer = None
+        self.selector = None
+        self.ttl = None
+        # optional MissCache of the contents without source
+        self.misses = None
         self.domain = "bogusdomain.com"
+        self.metrics.gauge('flows', lambda: len(self.tcpFlowsMap))
+        self.metrics.gauge('contents', lambda: len(self.oracle.contentMap))
         # hardcoded sources to test functionality
         if not self.oracle.addSource("first", "10.0.0.2"):
             raise Exception("Failed to initialize oracle in dns_oracle.py")
@@ -79,7 +112,7 @@ class DNSOracle (EventMixin):
             msg.match.nw_proto = pkt.ipv4.UDP_PROTOCOL
             msg.match.tp_src = 53
             msg.actions.append(of.ofp_action_output(port = of.OFPP_CONTROLLER))
-            event.connection.send(msg)
+            flow_table.send(event.connection, msg, flow_table.ORACLE)
             
     def lookup (self, something):
         if something in self.name_to_ip:
@@ -112,21 +145,97 @@ class DNSOracle (EventMixin):
             modified = True
         return modified
 
+    def _flowKey (self, match):
+        """returns the tcpFlowsMap key of the redirected transfer matched by
+        match, or None if it's not a flow we are tracking"""
+        if match.nw_proto != pkt_ip.TCP_PROTOCOL:
+            return None
+        source = match.nw_src
+        dest = match.nw_dst
+        if source is None or dest is None:
+            return None
+        if (source, dest) in self.tcpFlowsMap:
+            return (source, dest)
+        return None
+
+    def _learnSource (self, key):
+        """the transfer tracked under key has completed: add its destination
+        as a new source for the content and stop tracking it"""
+        dest = key[1].toStr()
+        content, added = self.redirects.learn(key, dest)
+        if added:
+            self.metrics.count('learned')
+            self.events.info('learn', "Added source %s for content %s",
+                             dest, content)
+            log.debug("Sources: %s", self.oracle.listSources(content))
+
     def _handle_FlowRemoved(self, event):
-        if event.idleTimeout and event.ofp.match.nw_proto is pkt_ip.TCP_PROTOCOL:
-            source = event.ofp.match.nw_src
-            dest = event.ofp.match.nw_dst
-            if source is None or dest is None:
-            	return
-            elif (source,dest) in self.tcpFlowsMap.keys():
+        if event.idleTimeout:
+            key = self._flowKey(event.ofp.match)
+            if key is not None:
                 # completed P2P flow, add new source
-                content = self.tcpFlowsMap[(source,dest)]
-                if self.oracle.addSource(content,dest.toStr()):
-                    log.info("Added source " + dest.toStr() + " for content " + content)
-                    log.info("Sources: " + str(self.oracle.listSources(content)))
-                del self.tcpFlowsMap[(source, dest)]
-            	
+                t = self.metrics.timer('FlowRemoved')
+                self._learnSource(key)
+                t.stop()
             
+    def _answer (self, event, q, content, source, t = None):
+        """answers the DNS query q for content in the PacketIn event with the
+        address of source, and tracks the transfer"""
+        p = event.parsed.find('dns')
+        ip_query = event.parsed.find('ipv4')
+        # return the IP address of the source as DNS response
+        if len(p.answers) > 0:
+            raise Exception("DNS request for bogusdomain has answers")
+            p.answers = []
+        dns_res = pkt_dns()
+        dns_res.qr = 1 # response
+        dns_res.id = p.id
+        dns_res.questions.append(q)
+        # without AdaptiveTTL the TTL is 0 (no caching); 4 is the number of
+        # octets of the response (single IP address)
+        ttl = 0
+        if self.ttl is not None:
+            ttl = self.ttl.ttl(content)
+            if ttl:
+                self.metrics.count('cacheable')
+        a = pkt_dns.rr(q.name, q.qtype, q.qclass, ttl, 4, IPAddr(source))
+        dns_res.answers.append(a)
+        udp_query = event.parsed.find('udp')
+        udp_res = pkt_udp()
+        udp_res.srcport = udp_query.dstport
+        udp_res.dstport = udp_query.srcport
+        # FIXME: how do I calculate the dns_res real length?
+        udp_res.len = pkt_udp.MIN_LEN + pkt_dns.MIN_LEN
+        udp_res.set_payload(dns_res)
+        ip_res = pkt_ip()
+        ip_res.iplen = pkt_ip.MIN_LEN + udp_res.len
+        ip_res.protocol = pkt_ip.UDP_PROTOCOL
+        ip_res.dstip = ip_query.srcip
+        ip_res.srcip = ip_query.dstip
+        ip_res.set_payload(udp_res)
+        eth_res = pkt_eth()
+        eth_res.type = pkt_eth.IP_TYPE
+        eth_query = event.parsed.find('ethernet')
+        eth_res.src = eth_query.dst
+        eth_res.dst = eth_query.src
+        eth_res.set_payload(ip_res)
+        msg = of.ofp_packet_out(data = eth_res.pack())
+        msg.actions.append(of.ofp_action_output(port = event.port))
+        if t is not None:
+            t.lap('build')
+        event.connection.send(msg)
+        if t is not None:
+            t.lap('send')
+        self.metrics.count('redirects')
+        self.events.info('redirect', "DNS response with source %s for content %s sent",
+                         source, content)
+        # record the flow - content association to monitor it
+        # FIXME: we should record the pair IP:PORT for source and dest, but there's no way of knowing it
+        self.redirects.track((IPAddr(source), ip_res.dstip), content)
+        # tell the OF switch to drop the dns request - NOT REQUIRED
+        # (Would return a buffer_empty error)
+        # drop()
+
     def _handle_PacketIn (self, event):
         def drop (duration = None):
             """
@@ -137,18 +246,19 @@ class DNSOracle (EventMixin):
                 if not isinstance(duration, tuple):
                     duration = (duration,duration)
                 msg = of.ofp_flow_mod()
-                msg.match = of.ofp_match.from_packet(p)
+                msg.match = of.ofp_match.from_packet(event.parsed, event.port)
                 msg.idle_timeout = duration[0]
                 msg.hard_timeout = duration[1]
                 msg.buffer_id = event.ofp.buffer_id
-                event.connection.send(msg)
+                flow_table.send(event.connection, msg, flow_table.TEMP)
             elif event.ofp.buffer_id is not None:
                 msg = of.ofp_packet_out()
                 msg.buffer_id = event.ofp.buffer_id
                 msg.in_port = event.port
                 event.connection.send(msg)
-            log.info("Dropped packet.")
+            self.events.info('drop', "Dropped packet.")
 
+        t = self.metrics.timer('PacketIn')
         # Check if it's a DNS packet
         p = event.parsed.find('dns')
         if p is not None and p.parsed:
@@ -156,62 +266,48 @@ class DNSOracle (EventMixin):
             for q in p.questions:
                 if q.qclass != 1: continue # Internet only
                 if p.qr == 0 and q.qtype == 1 and q.name.endswith(self.domain): # vod request
+                    ip_query = event.parsed.find('ipv4')
+                    if self.admission is not None and not self.admission.admit(ip_query.srcip):
+                        log.debug("Over the request rate, dropping query from %s", ip_query.srcip)
+                        self.metrics.count('rejected')
+                        drop(self.admission.drop_time)
+                        event.halt = True
+                        return
                     index = q.name.rfind(self.domain)
                     content = q.name[:index-1]
-                    source = self.oracle.getSource(content)
-                    # make sure we're not telling the requester to contact itself (just for the demo)
-                    n = len(self.oracle.listSources(content))
-                    ip_query = event.parsed.find('ipv4')
-                    while n>1 and source == ip_query.srcip.toStr():
-                    	source = self.oracle.getSource(content)
+                    t.lap('parse')
+                    requester = ip_query.srcip.toStr()
+                    if self.misses is not None and self.misses.missed(content):
+                        # no source a moment ago: leave it to the nameserver
+                        # without looking it up again
+                        self.metrics.count('miss_cached')
+                        t.stop()
+                        continue
+                    if self.selector is not None:
+                        if self.selector.select(content, requester,
+                                lambda source: self._answer(event, q, content, source)):
+                            # answered once the policy decides (or gives up)
+                            t.lap('defer')
+                            t.stop()
+                            return
+                        source = None
+                    else:
+                        # never tell the requester to contact itself
+                        source = self.redirects.select(content, requester)
+                    t.lap('lookup')
                     if source is not None:
-                        # return the IP address of the source as DNS response
-                        if len(p.answers) > 0:
-                            raise Exception("DNS request for bogusdomain has answers")
-                            p.answers = []
-                        dns_res = pkt_dns()
-                        dns_res.qr = 1 # response
-                        dns_res.id = p.id
-                        dns_res.questions.append(q)                         
-                        # 0 is the TTL (no caching), 4 is the number of octets of the 
-                        # response (single IP address)                        
-                        a = pkt_dns.rr(q.name, q.qtype, q.qclass, 0, 4, IPAddr(source))
-                        dns_res.answers.append(a)
-                        udp_query = event.parsed.find('udp')
-                        udp_res = pkt_udp()
-                        udp_res.srcport = udp_query.dstport
-                        udp_res.dstport = udp_query.srcport
-                        # FIXME: how do I calculate the dns_res real length?
-                        udp_res.len = pkt_udp.MIN_LEN + pkt_dns.MIN_LEN
-                        udp_res.set_payload(dns_res)
-                        ip_res = pkt_ip()
-                        ip_res.iplen = pkt_ip.MIN_LEN + udp_res.len
-                        ip_res.protocol = pkt_ip.UDP_PROTOCOL
-                        ip_res.dstip = ip_query.srcip
-                        ip_res.srcip = ip_query.dstip
-                        ip_res.set_payload(udp_res)
-                        eth_res = pkt_eth()
-                        eth_res.type = pkt_eth.IP_TYPE
-                        eth_query = event.parsed.find('ethernet')
-                        eth_res.src = eth_query.dst
-                        eth_res.dst = eth_query.src
-                        eth_res.set_payload(ip_res)                        
-                        msg = of.ofp_packet_out(data = eth_res.pack())
-                        msg.actions.append(of.ofp_action_output(port = event.port))
-                        event.connection.send(msg)
-                        log.info ("DNS response with source %s for content %s sent" % (source, content))
-                        # record the flow - content association to monitor it
-                        # FIXME: we should record the pair IP:PORT for source and dest, but there's no way of knowing it
-                        self.tcpFlowsMap[(IPAddr(source), ip_res.dstip)] = content
-                        # tell the OF switch to drop the dns request - NOT REQUIRED
-                        # (Would return a buffer_empty error)
-                        # drop()
+                        self._answer(event, q, content, source, t)
                         # FIXME: I'm assuming there's no other question ( I know there's
                         # no answer as I checked above)
+                        t.stop()
                         return
                     else:
                         # no source has been found - send request to nameserver    
+                        self.metrics.count('misses')
+                        if self.misses is not None:
+                            self.misses.add(content)
                         self.raiseEvent(DNSLookup, q)
+                        t.stop()
                 else: # non VoD request
                     self.raiseEvent(DNSLookup, q)
                         
@@ -222,16 +318,78 @@ class DNSOracle (EventMixin):
                 if entry.qtype == pkt.dns.rr.CNAME_TYPE:
                     if self._record_cname(entry.name, entry.rddata):
                         self.raiseEvent(DNSUpdate, entry.name)
-                        log.info("add cname entry: %s %s" % (entry.rddata, entry.name))
+                        log.info("add cname entry: %s %s", entry.rddata, entry.name)
                 elif entry.qtype == pkt.dns.rr.A_TYPE:
                     if self._record(entry.rddata, entry.name):
                         self.raiseEvent(DNSUpdate, entry.name)
-                        log.info("add dns entry: %s %s" % (entry.rddata, entry.name))
+                        log.info("add dns entry: %s %s", entry.rddata, entry.name)
                             
             for answer in p.answers:
                 process_q(answer)
             for addition in p.additional:
                 process_q(addition)
                 
-def launch (no_flow = False):
-    core.registerNew(DNSOracle, not no_flow)
+def launch (no_flow = False, rate = None, burst = None, global_rate = None,
+            global_burst = None, drop_time = None, metrics = False,
+            metrics_port = None, log_sample = None, log_rate = None,
+            log_burst = None, log_queue = None, catalog = None,
+            poll_interval = 2, announce_port = None, profiling = False,
+            policy = None, policy_workers = 4, policy_processes = False,
+            policy_deadline = 0.05, ttl = None, ttl_sources = 3,
+            ttl_stable = 60, ttl_hot = 1.0, miss_ttl = None):
+    """
+    rate/burst limit the VoD queries of each requester, global_rate/global_burst
+    those of all requesters together; drop_time installs a drop flow for that
+    many seconds when a requester goes over its rate.
+    metrics enables latency histograms and counters, shown by metrics() in the
+    console and, if metrics_port is given, served on localhost over HTTP.
+    log_sample logs one message out of that many for each kind of event,
+    log_rate/log_burst cap the messages per second of each kind, and log_queue
+    hands them to a background writer through a queue of that size.
+    catalog is a file listing the size of each content: when given, transfers
+    are polled every poll_interval seconds and their destination is learned as
+    soon as the whole content went through, instead of when the flow expires.
+    announce_port is the UDP port on which VoD servers announce their contents.
+    profiling adds profile(), profile_stop() and profile_status() to the
+    console, to profile the handlers for a while (see profiling.py).
+    policy picks the sources with one of redirect.POLICIES, off the event
+    loop, on policy_workers threads (or processes, with policy_processes);
+    if it takes more than policy_deadline seconds, a random source is picked.
+    ttl lets the answers be cached for up to that many seconds, for the
+    contents with ttl_sources sources or more, unchanged for ttl_stable
+    seconds, the longest for those queried ttl_hot times a second or more
+    (see ttl.py).
+    miss_ttl remembers for that many seconds that a content has no source, so
+    that its queries go to the nameserver without being looked up (nor raising
+    DNSLookup) again.
+    """
+    ac = admission.build(rate, burst, global_rate, global_burst, drop_time)
+    events = eventlog.build(log, log_sample, log_rate, log_burst, log_queue)
+    stats = None
+    if metrics or metrics_port is not None:
+        stats = Metrics("dns_oracle")
+        core.Interactive.variables['metrics'] = oracle_metrics.show
+        if metrics_port is not None:
+            oracle_metrics.serve(metrics_port)
+    if profiling:
+        oracle_profiling.install()
+    oracle = core.registerNew(DNSOracle, not no_flow, ac, stats, events)
+    oracle.selector = selection.build(oracle.redirects, policy, policy_workers,
+                                      policy_processes, policy_deadline, stats)
+    oracle.ttl = dns_ttl.build(oracle.oracle, ttl, ttl_sources, ttl_stable,
+                               ttl_hot)
+    if oracle.ttl is not None:
+        Timer(60, oracle.ttl.expire, recurring = True)
+    if miss_ttl is not None:
+        try:
+            oracle.misses = MissCache(oracle.oracle, float(str(miss_ttl)))
+        except ValueError as e:
+            raise RuntimeError("Invalid miss_ttl: %s" % (e,))
+        Timer(oracle.misses.ttl, oracle.misses.expire, recurring = True)
+    if catalog is not None:
+        oracle.learner = FlowStatsLearner(oracle, loadCatalog(catalog),
+                                          float(poll_interval))
+    if announce_port is not None:
+        oracle.announcer = AnnounceListener(oracle.oracle, announce_port,
+                                            with_port = False,
+                                            strip_ext = True)
@@ -0,0 +1,55 @@
+"""Unit test for dns_oracle.py, through the harness of replay.py. Needs POX,
+found on the path or in the POX environment variable (e.g. POX=~/pox)"""
+import unittest
+import replay
+from admission import AdmissionControl
+
+core = replay.trySetup()
+if core is not None:
+    import pox.openflow
+    import dns_oracle
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@unittest.skipIf(core is None, "POX can't be imported")
+class Admission(unittest.TestCase):
+    def setUp(self):
+        self.connection = replay.ReplayConnection()
+        self.admission = AdmissionControl(1, 1, drop_time = 5,
+                                          clock = FakeClock())
+        self.oracle = dns_oracle.DNSOracle(False, self.admission)
+        self.requests = replay.Synthetic('dns', contents = 1, sources = 1,
+                                         hosts = 1, seed = 1)
+        self.requests.seed(self.oracle)
+
+    def tearDown(self):
+        core.openflow.clearHandlers()
+
+    def packetIn(self, n):
+        frame = self.requests.request(n)[0]
+        msg = replay.of.ofp_packet_in(in_port = 1, data = frame,
+                                      total_len = len(frame), buffer_id = None,
+                                      reason = replay.of.OFPR_NO_MATCH)
+        return core.openflow.raiseEvent(pox.openflow.PacketIn,
+                                        self.connection, msg)
+
+    def testRejectHalts(self):
+        """a rejected query should be dropped, not left to the other components"""
+        self.packetIn(0)
+        self.assertEqual(self.admission.admitted, 1)
+        self.connection.take()
+        event = self.packetIn(1)
+        self.assertEqual(self.admission.rejected, 1)
+        self.assertTrue(event.halt)
+        sent = self.connection.take()
+        self.assertEqual([type(m) for m in sent], [replay.of.ofp_flow_mod])
+        self.assertEqual(sent[0].idle_timeout, 5)
+        self.assertEqual(sent[0].actions, [])
+
+if __name__ == '__main__':
+    unittest.main()
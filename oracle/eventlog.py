@@ -0,0 +1,127 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Logging for the redirect path of the oracles.
+
+Messages are tagged with an event kind (e.g. 'request', 'redirect', 'learn')
+and formatted only if they are actually emitted. Each kind can be sampled (one
+message out of N) and rate capped, and records can be handed to a background
+writer thread through a bounded queue, so that the event loop never waits on
+the log handlers. When the queue is full records are dropped and counted.
+"""
+
+import time
+import logging
+import threading
+import Queue
+from admission import TokenBucket
+
+_monthname = [None, 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+              'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+class Stamp (object):
+    """Captures the current time, and formats it with millisecond precision
+    only when converted to a string"""
+
+    __slots__ = ('now',)
+
+    def __init__ (self):
+        self.now = time.time()
+
+    def __str__ (self):
+        tt = time.localtime(self.now)
+        ms = int((self.now - int(self.now)) * 1000)
+        return "[%02d/%3s/%04d %02d:%02d:%02d:%04d]" % (
+                tt[2], _monthname[tt[1]], tt[0], tt[3], tt[4], tt[5], ms)
+
+
+class EventLog:
+    """Wraps a logger with per-kind sampling, rate caps and asynchronous
+    writing. With the default parameters it simply defers formatting."""
+
+    def __init__ (self, logger, sample = 1, rate = None, burst = None,
+                  queue_size = 0, clock = time.time):
+        self.logger = logger
+        # log one message out of every `sample` for each kind
+        self.sample = max(1, sample)
+        self.caps = None
+        if rate is not None:
+            self.caps = TokenBucket(rate, burst, clock = clock)
+        self.seen = {}
+        self.suppressed = 0
+        self.dropped = 0
+        self.queue = None
+        if queue_size > 0:
+            self.queue = Queue.Queue(queue_size)
+            self.thread = threading.Thread(target = self._writer)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def debug (self, kind, msg, *args):
+        self.log(logging.DEBUG, kind, msg, args)
+
+    def info (self, kind, msg, *args):
+        self.log(logging.INFO, kind, msg, args)
+
+    def warning (self, kind, msg, *args):
+        self.log(logging.WARNING, kind, msg, args)
+
+    def log (self, level, kind, msg, args):
+        if not self.logger.isEnabledFor(level):
+            return
+        if self.sample > 1:
+            n = self.seen.get(kind, 0)
+            self.seen[kind] = n + 1
+            if n % self.sample != 0:
+                self.suppressed += 1
+                return
+        if self.caps is not None and not self.caps.consume(kind):
+            self.suppressed += 1
+            return
+        if self.queue is None:
+            self.logger.log(level, msg, *args)
+            return
+        try:
+            self.queue.put_nowait((level, time.time(), msg, args))
+        except Queue.Full:
+            self.dropped += 1
+
+    def _writer (self):
+        while True:
+            level, created, msg, args = self.queue.get()
+            try:
+                record = self.logger.makeRecord(self.logger.name, level,
+                                                "(eventlog)", 0, msg, args, None)
+                # keep the time of the event rather than the time of writing
+                record.created = created
+                record.msecs = (created - int(created)) * 1000
+                self.logger.handle(record)
+            except Exception:
+                pass
+
+
+def build (logger, log_sample = None, log_rate = None, log_burst = None,
+           log_queue = None):
+    """Creates an EventLog from (string) launch() arguments"""
+    def num (value, kind, default = None):
+        if value is None:
+            return default
+        return kind(str(value))
+    try:
+        return EventLog(logger, num(log_sample, int, 1), num(log_rate, float),
+                        num(log_burst, int), num(log_queue, int, 0))
+    except ValueError as e:
+        raise RuntimeError("Invalid logging parameters: %s" % (e,))
@@ -0,0 +1,113 @@
+"""Unit test for eventlog.py"""
+import time
+import logging
+import threading
+import unittest
+from eventlog import EventLog, build
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class Collector(logging.Handler):
+    """keeps the messages handled, optionally blocking until released"""
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+        self.entered = threading.Event()
+        self.released = threading.Event()
+        self.released.set()
+
+    def emit(self, record):
+        self.entered.set()
+        self.released.wait(5)
+        self.messages.append(record.getMessage())
+
+class Base(unittest.TestCase):
+    def setUp(self):
+        self.handler = Collector()
+        self.logger = logging.getLogger('eventlogtest')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+class Sampling(Base):
+    def testPerKind(self):
+        """one message out of sample should be logged, counting each kind apart"""
+        events = EventLog(self.logger, sample = 3)
+        for i in range(6):
+            events.info('request', "request %d", i)
+            if i < 2:
+                events.info('redirect', "redirect %d", i)
+        self.assertEqual(self.handler.messages,
+                         ['request 0', 'redirect 0', 'request 3'])
+        self.assertEqual(events.suppressed, 5)
+
+    def testDisabled(self):
+        """messages below the level of the logger should not even be counted"""
+        self.logger.setLevel(logging.INFO)
+        events = EventLog(self.logger, sample = 2)
+        events.debug('request', "request")
+        self.assertEqual((events.seen, events.suppressed), ({}, 0))
+
+class Caps(Base):
+    def testPerKind(self):
+        """each kind should be capped to its own rate"""
+        clock = FakeClock()
+        events = EventLog(self.logger, rate = 1, burst = 2, clock = clock)
+        for i in range(3):
+            events.info('request', "request %d", i)
+        events.info('learn', "learn")
+        self.assertEqual(self.handler.messages,
+                         ['request 0', 'request 1', 'learn'])
+        self.assertEqual(events.suppressed, 1)
+        clock.now += 1
+        events.info('request', "request 3")
+        events.info('request', "request 4")
+        self.assertEqual(self.handler.messages[-1], 'request 3')
+        self.assertEqual(events.suppressed, 2)
+
+class Async(Base):
+    def testQueueFull(self):
+        """records should be dropped and counted while the queue is full"""
+        self.handler.released.clear()
+        events = EventLog(self.logger, queue_size = 2)
+        events.info('request', "request 0")
+        # the writer is busy with the first one
+        self.assertTrue(self.handler.entered.wait(5))
+        for i in range(1, 6):
+            events.info('request', "request %d", i)
+        self.assertEqual(events.dropped, 3)
+        self.handler.released.set()
+        for i in range(50):
+            if len(self.handler.messages) == 3:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.handler.messages,
+                         ['request 0', 'request 1', 'request 2'])
+
+    def testEventTime(self):
+        """the records should keep the time of the event, not of writing"""
+        times = []
+        self.handler.emit = lambda record: times.append(record.created)
+        events = EventLog(self.logger, queue_size = 10)
+        before = time.time()
+        events.info('request', "request")
+        time.sleep(0.2)
+        self.assertEqual(len(times), 1)
+        self.assertTrue(before <= times[0] < before + 0.1)
+
+class Build(unittest.TestCase):
+    def testInvalid(self):
+        """invalid launch() arguments should raise RuntimeError"""
+        self.assertRaises(RuntimeError, build, logging.getLogger('eventlogtest'),
+                          log_sample = 'often')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Learns new sources from flow statistics rather than from FlowRemoved.
+
+Without this, an oracle adds the destination of a redirected transfer as a
+source only when the transfer flow expires, i.e. at least one idle timeout
+after the last byte, and it does so even if the transfer was aborted. The
+FlowStatsLearner periodically asks every switch for the statistics of its TCP
+flows (one request per switch for all the tracked transfers) and promotes a
+destination as soon as the payload bytes of its flow reach the size of the
+content, as listed in a catalog. Transfers whose byte count stops growing for a few
+polls are dropped from the oracle's tcpFlowsMap, so that they are not learned
+when their flow eventually expires.
+
+If the oracle's OracleDB is chunk-aware, the chunks a destination received
+so far are recorded as the transfer goes on, so that it can serve them before
+it completes.
+
+The oracle must provide tcpFlowsMap, _flowKey(match) and _learnSource(key).
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+import pox.lib.packet as pkt
+from pox.lib.recoco import Timer
+import json
+import urllib2
+
+log = core.getLogger()
+
+# share of the bytes of a flow that are payload, for full-sized frames
+# (1514 bytes, with 66 of Ethernet, IP and TCP headers with timestamps)
+PAYLOAD_RATIO = 1448.0 / 1514
+
+
+def _sizes (catalog):
+    """content -> size, from the JSON object catalog (the contents are UTF-8
+    paths)"""
+    sizes = {}
+    for content, size in catalog.items():
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        sizes[str(content)] = int(size)
+    return sizes
+
+
+def loadCatalog (path):
+    """Reads content sizes from path, either a JSON object mapping content to
+    size in bytes or a text file with one 'content size' pair per line. path
+    can also be the http:// URL of the /_catalog of an MsHTTPServer"""
+    if path.startswith('http://'):
+        f = urllib2.urlopen(path)
+        try:
+            return _sizes(json.load(f))
+        finally:
+            f.close()
+    with open(path) as f:
+        if path.endswith('.json'):
+            return _sizes(json.load(f))
+        catalog = {}
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            content, size = line.rsplit(None, 1)
+            catalog[content] = int(size)
+        return catalog
+
+
+class FlowStatsLearner (object):
+    def __init__ (self, owner, catalog, interval = 2, stall_polls = 3):
+        # the oracle whose transfers we are tracking
+        self.owner = owner
+        # content -> size in bytes
+        self.catalog = catalog
+        self.stall_polls = stall_polls
+        self.round = 0
+        # flow key -> [highest byte count seen, round of the last increase]
+        self.progress = {}
+        db = owner.oracle
+        if db.chunkSize:
+            for content, size in catalog.items():
+                db.setSize(content, size)
+        core.openflow.addListenerByName("FlowStatsReceived",
+                                        self._handle_FlowStatsReceived)
+        self.timer = Timer(interval, self._poll, recurring = True)
+
+    def _poll (self):
+        self.round += 1
+        flows = self.owner.tcpFlowsMap
+        for key in self.progress.keys():
+            if key not in flows:
+                # learned through FlowRemoved in the meantime
+                del self.progress[key]
+            elif self.round - self.progress[key][1] > self.stall_polls:
+                log.info("Transfer %s -> %s stalled, not learning it", key[0],
+                         key[1])
+                del self.progress[key]
+                del flows[key]
+        if not flows:
+            return
+        msg = of.ofp_stats_request(body = of.ofp_flow_stats_request())
+        msg.body.match.dl_type = pkt.ethernet.IP_TYPE
+        msg.body.match.nw_proto = pkt.ipv4.TCP_PROTOCOL
+        for connection in core.openflow.connections:
+            connection.send(msg)
+
+    def _handle_FlowStatsReceived (self, event):
+        flows = self.owner.tcpFlowsMap
+        for stat in event.stats:
+            key = self.owner._flowKey(stat.match)
+            if key is None:
+                continue
+            size = self.catalog.get(flows[key])
+            if size is None:
+                continue
+            p = self.progress.get(key)
+            if p is None:
+                p = self.progress[key] = [0, self.round]
+            grew = stat.byte_count > p[0]
+            if grew:
+                p[0] = stat.byte_count
+                p[1] = self.round
+            if p[0] * PAYLOAD_RATIO >= size:
+                # the byte count includes the headers: only when its payload
+                # share covers the content can the transfer be complete
+                del self.progress[key]
+                t = self.owner.metrics.timer('FlowStats')
+                self.owner._learnSource(key)
+                t.stop()
+            elif grew and self.owner.oracle.chunkSize:
+                # the redirects are plain GETs, from the first byte
+                self.owner.oracle.markBytes(flows[key], str(key[1]), 0,
+                                            int(p[0] * PAYLOAD_RATIO))
@@ -0,0 +1,134 @@
+"""Unit test for flow_learner.py. Needs POX, found on the path or in the POX
+environment variable (e.g. POX=~/pox)"""
+import os
+import json
+import tempfile
+import threading
+import unittest
+import BaseHTTPServer
+import replay
+from oracleDB import OracleDB
+from metrics import NullMetrics
+
+core = replay.trySetup()
+if core is not None:
+    from flow_learner import FlowStatsLearner, loadCatalog, PAYLOAD_RATIO
+
+class Stat(object):
+    def __init__(self, match, byte_count):
+        self.match = match
+        self.byte_count = byte_count
+
+class Stats(object):
+    def __init__(self, *stats):
+        self.stats = stats
+
+class Owner(object):
+    """the oracle side of the learner: tracks transfers keyed by their match"""
+    def __init__(self):
+        self.oracle = OracleDB()
+        self.metrics = NullMetrics()
+        self.tcpFlowsMap = {}
+        self.learned = []
+
+    def _flowKey(self, match):
+        return match if match in self.tcpFlowsMap else None
+
+    def _learnSource(self, key):
+        self.learned.append(key)
+        del self.tcpFlowsMap[key]
+
+@unittest.skipIf(core is None, "POX can't be imported")
+class Learner(unittest.TestCase):
+    def setUp(self):
+        self.owner = Owner()
+        self.owner.tcpFlowsMap[('10.0.0.2', '10.0.0.5')] = 'a.mp4'
+        self.learner = FlowStatsLearner(self.owner, {'a.mp4': 1000000},
+                                        interval = 3600, stall_polls = 2)
+
+    def tearDown(self):
+        self.learner.timer.cancel()
+        core.openflow.clearHandlers()
+
+    def stats(self, byte_count):
+        self.learner._handle_FlowStatsReceived(
+            Stats(Stat(('10.0.0.2', '10.0.0.5'), byte_count)))
+
+    def testComplete(self):
+        """a transfer should be learned once the payload of its flow covers the content"""
+        self.stats(1000000)
+        self.assertEqual(self.owner.learned, [])
+        self.stats(int(1000000 / PAYLOAD_RATIO) + 1)
+        self.assertEqual(self.owner.learned, [('10.0.0.2', '10.0.0.5')])
+        self.assertEqual(self.learner.progress, {})
+
+    def testStalled(self):
+        """a transfer whose byte count stops growing should be dropped, not learned"""
+        self.stats(960000)
+        for i in range(3):
+            self.learner._poll()
+            self.stats(960000)
+        self.assertEqual(self.owner.tcpFlowsMap, {})
+        self.assertEqual(self.learner.progress, {})
+        self.assertEqual(self.owner.learned, [])
+
+    def testGrowing(self):
+        """a transfer still growing should be kept, however long it takes"""
+        for i in range(5):
+            self.stats(100000 * (i + 1))
+            self.learner._poll()
+        self.assertEqual(len(self.owner.tcpFlowsMap), 1)
+
+class CatalogHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps({u'caf\xe9.mp4': 10, 'b.mp4': 20})
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@unittest.skipIf(core is None, "POX can't be imported")
+class Catalog(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(data)
+        return path
+
+    def testText(self):
+        """text catalogs should have a content and its size per line"""
+        path = self.write('catalog.txt', '# sizes\na.mp4 10\n\nmy movie.mp4 20\n')
+        self.assertEqual(loadCatalog(path), {'a.mp4': 10, 'my movie.mp4': 20})
+
+    def testJson(self):
+        """JSON catalogs should map each content to its size"""
+        path = self.write('catalog.json', '{"a.mp4": 10, "b.mp4": "20"}')
+        self.assertEqual(loadCatalog(path), {'a.mp4': 10, 'b.mp4': 20})
+
+    def testUrl(self):
+        """the catalog of an MsHTTPServer should be fetched over HTTP"""
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), CatalogHandler)
+        thread = threading.Thread(target = server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            catalog = loadCatalog('http://127.0.0.1:%d/_catalog'
+                                  % server.server_address[1])
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(catalog, {'caf\xc3\xa9.mp4': 10, 'b.mp4': 20})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,276 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Keeps the flow tables of the switches within a budget.
+
+Hardware switches have small tables and silently stop installing flows once
+they are full. The FlowTableManager accounts for the entries of each switch:
+the flows installed through send() below, minus the ones reported by
+FlowRemoved or rejected by an error. Every entry belongs to a class:
+  ORACLE  the rules punting the VoD requests to the controller, never evicted
+  TEMP    short-lived flows, e.g. the drop flows of admission control
+  L2      the exact-match flows of l2_learning, evicted first
+Flows are installed with OFPFF_SEND_FLOW_REM, so that their expiry is known.
+
+Every interval seconds, each switch holding more than high * capacity
+entries is asked for the statistics of all its flows, in a single request.
+An entry whose packet count grew since the previous reply was hit in the
+meantime; the least recently hit ones (L2 first, then TEMP) are deleted until
+the table is down to low * capacity. An install into a full table evicts the
+same way right away, using the hits known so far, or is refused if only more
+important entries are left. A "tables full" error means the switch holds
+fewer entries than its budget: the budget shrinks to what it actually holds.
+
+Modules use send(connection, msg, cls), which falls back to
+connection.send(msg) when the manager isn't running.
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.util import dpid_to_str
+from pox.lib.recoco import Timer
+from metrics import Metrics, NullMetrics
+import metrics as oracle_metrics
+import time
+
+log = core.getLogger()
+
+ORACLE, TEMP, L2 = range(3)
+CLASS_NAMES = ('oracle', 'temp', 'l2')
+
+
+def send (connection, msg, cls = L2):
+    """installs the flow-mod msg through the FlowTableManager, if running.
+    Returns False if the table was full and msg was not sent"""
+    if core.hasComponent('FlowTableManager'):
+        return core.FlowTableManager.install(connection, msg, cls)
+    connection.send(msg)
+    return True
+
+
+class _Entry (object):
+    __slots__ = ('match', 'priority', 'cls', 'lastHit', 'packets')
+
+    def __init__ (self, match, priority, cls, now):
+        self.match = match
+        self.priority = priority
+        self.cls = cls
+        self.lastHit = now
+        self.packets = 0
+
+
+class FlowTable (object):
+    """the entries installed in one switch"""
+    def __init__ (self, capacity):
+        self.capacity = capacity
+        # _key(match, priority) -> _Entry
+        self.entries = {}
+        # xid of a recent flow-mod -> (key, time sent), to match the errors
+        self.pending = {}
+
+    def count (self, cls):
+        return sum(1 for e in self.entries.itervalues() if e.cls == cls)
+
+
+# the fields of a match but the IP addresses, which can be prefixes
+_FIELDS = sorted(f for f in of.ofp_match_data if f not in ('nw_src', 'nw_dst'))
+
+
+def _key (match, priority):
+    """identifies an entry by what it matches: switches may report a match
+    normalized (e.g. other values in its wildcarded fields), so that it
+    doesn't pack as the one installed"""
+    return (tuple(getattr(match, f) for f in _FIELDS), match.get_nw_src(),
+            match.get_nw_dst(), priority)
+
+
+class FlowTableManager (object):
+    def __init__ (self, capacity = 1000, high = 0.9, low = 0.8, interval = 5,
+                  metrics = None):
+        self.capacity = capacity
+        self.high = high
+        self.low = low
+        self.interval = interval
+        self.metrics = metrics or NullMetrics()
+        # dpid -> FlowTable
+        self.tables = {}
+        self.metrics.gauge('flows', lambda: sum(len(t.entries) for t in
+                                                self.tables.itervalues()))
+        core.openflow.addListeners(self)
+        self.timer = Timer(interval, self._poll, recurring = True)
+
+    def _table (self, dpid):
+        table = self.tables.get(dpid)
+        if table is None:
+            table = self.tables[dpid] = FlowTable(self.capacity)
+        return table
+
+    def install (self, connection, msg, cls = L2):
+        """sends msg to connection, accounting for the entry it adds or
+        removes. Returns False if the table is full of entries of class cls or
+        more important ones, in which case msg is not sent"""
+        table = self._table(connection.dpid)
+        if msg.command in (of.OFPFC_DELETE, of.OFPFC_DELETE_STRICT):
+            self._deleted(table, msg.match, msg.priority,
+                          msg.command == of.OFPFC_DELETE_STRICT)
+            connection.send(msg)
+            return True
+        key = _key(msg.match, msg.priority)
+        entry = table.entries.get(key)
+        if entry is None:
+            if len(table.entries) >= table.capacity and cls != ORACLE:
+                self._evict(connection, table, int(self.low * table.capacity),
+                            cls)
+                if len(table.entries) >= table.capacity:
+                    self.metrics.count('refused')
+                    log.debug("%s: flow table full, not installing %s",
+                              dpid_to_str(connection.dpid), msg.match)
+                    return False
+            entry = table.entries[key] = _Entry(msg.match, msg.priority, cls,
+                                                time.time())
+            self.metrics.count('installed')
+        else:
+            # a modification, or the same flow installed again
+            entry.cls = min(entry.cls, cls)
+        msg.flags |= of.OFPFF_SEND_FLOW_REM
+        table.pending[msg.xid] = (key, time.time())
+        connection.send(msg)
+        return True
+
+    def _deleted (self, table, match, priority, strict):
+        if strict:
+            table.entries.pop(_key(match, priority), None)
+            return
+        for key, entry in table.entries.items():
+            if match.matches_with_wildcards(entry.match):
+                del table.entries[key]
+
+    def _evict (self, connection, table, target, cls = ORACLE):
+        """deletes the least recently hit entries of class cls or less
+        important ones, until at most target entries are left"""
+        excess = len(table.entries) - target
+        if excess <= 0:
+            return
+        victims = [(-e.cls, e.lastHit, k) for k, e in table.entries.iteritems()
+                   if e.cls != ORACLE and e.cls >= cls]
+        victims.sort()
+        for _, _, key in victims[:excess]:
+            entry = table.entries.pop(key)
+            msg = of.ofp_flow_mod(command = of.OFPFC_DELETE_STRICT,
+                                  match = entry.match,
+                                  priority = entry.priority)
+            connection.send(msg)
+            self.metrics.count('evicted_' + CLASS_NAMES[entry.cls])
+        log.debug("%s: evicted %d flows, %d left",
+                  dpid_to_str(connection.dpid), min(excess, len(victims)),
+                  len(table.entries))
+
+    def _poll (self):
+        limit = time.time() - self.interval
+        for connection in core.openflow.connections:
+            table = self.tables.get(connection.dpid)
+            if table is None:
+                continue
+            for xid in [x for x, p in table.pending.iteritems()
+                        if p[1] < limit]:
+                del table.pending[xid]
+            if len(table.entries) > self.high * table.capacity:
+                connection.send(of.ofp_stats_request(
+                        body = of.ofp_flow_stats_request()))
+
+    def _handle_FlowStatsReceived (self, event):
+        table = self.tables.get(event.connection.dpid)
+        if table is None:
+            return
+        now = time.time()
+        unknown = 0
+        for stat in event.stats:
+            entry = table.entries.get(_key(stat.match, stat.priority))
+            if entry is None:
+                unknown += 1
+            elif stat.packet_count > entry.packets:
+                entry.packets = stat.packet_count
+                entry.lastHit = now
+        if unknown:
+            # not installed through send(), or matches we failed to recognize
+            self.metrics.count('unknown_stats', unknown)
+            log.debug("%s: %d flow stats without an entry",
+                      dpid_to_str(event.connection.dpid), unknown)
+        if len(table.entries) > self.high * table.capacity:
+            self._evict(event.connection, table,
+                        int(self.low * table.capacity))
+
+    def _handle_FlowRemoved (self, event):
+        table = self.tables.get(event.dpid)
+        if table is not None:
+            table.entries.pop(_key(event.ofp.match, event.ofp.priority), None)
+
+    def _handle_ErrorIn (self, event):
+        table = self.tables.get(event.dpid)
+        if table is None or event.ofp.type != of.OFPET_FLOW_MOD_FAILED:
+            return
+        pending = table.pending.pop(event.ofp.xid, None)
+        if pending is not None:
+            table.entries.pop(pending[0], None)
+        if event.ofp.code == of.OFPFMFC_ALL_TABLES_FULL:
+            self.metrics.count('table_full')
+            table.capacity = max(1, len(table.entries))
+            log.warning("%s: flow table full at %d entries, evicting",
+                        dpid_to_str(event.dpid), table.capacity)
+            self._evict(event.connection, table,
+                        int(self.low * table.capacity))
+
+    def _handle_ConnectionDown (self, event):
+        # a new connection starts with a new table, created by its first flow
+        self.tables.pop(event.dpid, None)
+
+    def status (self):
+        """entries per class and budget of each switch"""
+        return dict((dpid_to_str(dpid),
+                     dict([(CLASS_NAMES[c], t.count(c)) for c in
+                           (ORACLE, TEMP, L2)] + [('capacity', t.capacity)]))
+                    for dpid, t in self.tables.iteritems())
+
+
+def launch (capacity = 1000, high = 0.9, low = 0.8, interval = 5,
+            metrics = False):
+    """
+    capacity is the flow table budget of each switch, in entries; when a table
+    holds more than high * capacity entries, its least recently hit flows are
+    evicted down to low * capacity. Hits are polled every interval seconds.
+    metrics counts the installs, refusals and evictions, shown by metrics() in
+    the console; flow_tables() shows the entries of each switch.
+    """
+    try:
+        capacity = int(str(capacity))
+        high = float(str(high))
+        low = float(str(low))
+        interval = float(str(interval))
+        assert capacity > 0 and 0 < low <= high <= 1
+    except (ValueError, AssertionError):
+        raise RuntimeError("Invalid flow table parameters")
+    stats = None
+    if metrics:
+        stats = Metrics('flow_table')
+        core.Interactive.variables['metrics'] = oracle_metrics.show
+    core.registerNew(FlowTableManager, capacity, high, low, interval, stats)
+    core.Interactive.variables['flow_tables'] = show
+
+
+def show ():
+    """prints the entries per class of each switch, for the POX console"""
+    for dpid, status in sorted(core.FlowTableManager.status().items()):
+        print dpid, ' '.join('%s=%d' % (name, status[name]) for name in
+                             CLASS_NAMES + ('capacity',))
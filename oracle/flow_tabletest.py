@@ -0,0 +1,147 @@
+"""Unit test for flow_table.py. Needs POX, found on the path or in the POX
+environment variable (e.g. POX=~/pox)"""
+import unittest
+import replay
+
+core = replay.trySetup()
+if core is not None:
+    import pox.openflow.libopenflow_01 as of
+    import flow_table
+    from flow_table import FlowTableManager, ORACLE, TEMP, L2
+
+class Connection(object):
+    """records the messages sent to a switch"""
+    def __init__(self, dpid = 1):
+        self.dpid = dpid
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+    def deleted(self):
+        """the in_port of the flows deleted since the last call"""
+        ports = [m.match.in_port for m in self.sent
+                 if m.command == of.OFPFC_DELETE_STRICT]
+        self.sent = []
+        return sorted(ports)
+
+class Error(object):
+    def __init__(self, connection, xid, code):
+        self.connection = connection
+        self.dpid = connection.dpid
+        self.ofp = of.ofp_error(type = of.OFPET_FLOW_MOD_FAILED, code = code,
+                                xid = xid)
+
+class Stat(object):
+    def __init__(self, match, packet_count):
+        self.match = match
+        self.priority = of.OFP_DEFAULT_PRIORITY
+        self.packet_count = packet_count
+
+class Stats(object):
+    def __init__(self, connection, *stats):
+        self.connection = connection
+        self.dpid = connection.dpid
+        self.stats = stats
+
+@unittest.skipIf(core is None, "POX can't be imported")
+class Manager(unittest.TestCase):
+    def setUp(self):
+        self.manager = FlowTableManager(capacity = 10, high = 0.9, low = 0.8,
+                                        interval = 3600)
+        self.connection = Connection()
+
+    def tearDown(self):
+        self.manager.timer.cancel()
+        core.openflow.clearHandlers()
+
+    def install(self, port, cls, hit = 0):
+        """installs a flow for in_port port, last hit at time hit"""
+        msg = of.ofp_flow_mod(match = of.ofp_match(in_port = port))
+        if not self.manager.install(self.connection, msg, cls):
+            return None
+        table = self.manager.tables[self.connection.dpid]
+        table.entries[flow_table._key(msg.match, msg.priority)].lastHit = hit
+        return msg
+
+    def fill(self, classes):
+        for port, cls in enumerate(classes):
+            self.install(port + 1, cls, hit = port + 1)
+        self.connection.sent = []
+
+    def table(self):
+        return self.manager.tables[self.connection.dpid]
+
+    def testEvictionOrder(self):
+        """a full table should evict L2 flows first, least recently hit first"""
+        self.fill([ORACLE] * 3 + [L2, TEMP, L2, TEMP, L2, TEMP, L2])
+        self.assertTrue(self.install(11, TEMP))
+        # down to 8 entries: two L2 ones go, although TEMP ones are older
+        self.assertEqual(self.connection.deleted(), [4, 6])
+        self.assertEqual(len(self.table().entries), 9)
+
+    def testPolledEviction(self):
+        """over the high mark, flows should be evicted down to the low mark, never ORACLE ones"""
+        self.fill([TEMP, TEMP] + [ORACLE] * 7)
+        self.install(10, L2, hit = 100)
+        self.connection.sent = []
+        self.manager._handle_FlowStatsReceived(Stats(self.connection))
+        self.assertEqual(self.connection.deleted(), [1, 10])
+        self.assertEqual(self.table().count(ORACLE), 7)
+
+    def testRefused(self):
+        """an install should be refused when only more important flows are left"""
+        self.fill([ORACLE] * 8 + [TEMP] * 2)
+        self.assertEqual(self.install(11, L2), None)
+        self.assertEqual(self.connection.sent, [])
+        self.assertEqual(len(self.table().entries), 10)
+        # the rules of the oracles always go in
+        self.assertTrue(self.install(11, ORACLE))
+
+    def testError(self):
+        """a failed flow-mod should no longer be accounted for"""
+        self.fill([L2] * 3)
+        msg = self.install(4, L2)
+        self.manager._handle_ErrorIn(Error(self.connection, msg.xid,
+                                           of.OFPFMFC_OVERLAP))
+        self.assertEqual(len(self.table().entries), 3)
+        self.assertEqual(self.table().capacity, 10)
+        # an unknown xid changes nothing
+        self.manager._handle_ErrorIn(Error(self.connection, msg.xid + 1000,
+                                           of.OFPFMFC_OVERLAP))
+        self.assertEqual(len(self.table().entries), 3)
+
+    def testTablesFull(self):
+        """a tables full error should shrink the budget to the flows held"""
+        self.fill([ORACLE] * 2 + [L2] * 3)
+        msg = self.install(6, L2)
+        self.manager._handle_ErrorIn(Error(self.connection, msg.xid,
+                                           of.OFPFMFC_ALL_TABLES_FULL))
+        self.assertEqual(self.table().capacity, 5)
+        # and evict down to the low mark of the new budget
+        self.assertEqual(self.connection.deleted(), [3])
+        self.install(7, L2, hit = 100)
+        self.install(8, L2)
+        self.assertEqual(self.connection.deleted(), [4])
+        self.assertEqual(len(self.table().entries), 5)
+
+    def testHits(self):
+        """flows hit since the last stats should be evicted last"""
+        self.fill([ORACLE] * 7 + [L2] * 3)
+        self.manager._handle_FlowStatsReceived(Stats(
+                self.connection, Stat(of.ofp_match(in_port = 8), 5),
+                Stat(of.ofp_match(in_port = 9), 0)))
+        self.assertEqual(self.connection.deleted(), [9, 10])
+
+    def testNormalizedMatch(self):
+        """hits should be recorded for matches reported as packing differently"""
+        class Normalized(of.ofp_match):
+            def pack(self, *args, **kw):
+                return 'normalized'
+        self.fill([ORACLE] * 7 + [L2] * 3)
+        self.manager._handle_FlowStatsReceived(Stats(
+                self.connection, Stat(Normalized(in_port = 8), 5)))
+        self.assertEqual(self.connection.deleted(), [9, 10])
+
+if __name__ == '__main__':
+    unittest.main()
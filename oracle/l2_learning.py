@@ -24,6 +24,7 @@ from pox.core import core
 import pox.openflow.libopenflow_01 as of
 from pox.lib.util import dpid_to_str
 from pox.lib.util import str_to_bool
+import flow_table
 import time
 
 log = core.getLogger()
@@ -32,6 +33,9 @@ log = core.getLogger()
 # Can be overriden on commandline.
 _flood_delay = 0
 
+# Install the exact-match flows (through flow_table) instead of flooding.
+_install_flows = False
+
 class LearningSwitch (object):
   """
   The learning switch "brain" associated with a single OpenFlow switch.
@@ -135,7 +139,7 @@ class LearningSwitch (object):
         msg.idle_timeout = duration[0]
         msg.hard_timeout = duration[1]
         msg.buffer_id = event.ofp.buffer_id
-        self.connection.send(msg)
+        flow_table.send(self.connection, msg, flow_table.TEMP)
       elif event.ofp.buffer_id is not None:
         msg = of.ofp_packet_out()
         msg.buffer_id = event.ofp.buffer_id
@@ -173,7 +177,10 @@ class LearningSwitch (object):
         msg.data = event.ofp # 6a
         # EDP - send a flow removal event to track expiration
         msg.flags = of.OFPFF_SEND_FLOW_REM
+        if _install_flows and flow_table.send(self.connection, msg):
+          return
         # EDP - suppress flow to allow for multiple runs without hiccups
+        # (or the flow table is full)
         # self.connection.send(msg)
         flood()
 
@@ -191,10 +198,15 @@ class l2_learning (object):
     LearningSwitch(event.connection, self.transparent)
 
 
-def launch (transparent=False, hold_down=_flood_delay):
+def launch (transparent=False, hold_down=_flood_delay, install_flows=False):
   """
   Starts an L2 learning switch.
+
+  install_flows installs an exact-match flow for each learned destination,
+  rather than flooding every packet (see flow_table for the table budget).
   """
+  global _install_flows
+  _install_flows = str_to_bool(install_flows)
   try:
     global _flood_delay
     _flood_delay = int(str(hold_down), 10)
@@ -0,0 +1,255 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Latency histograms and counters for the oracles' event handlers.
+
+Each oracle owns a Metrics object (or a NullMetrics when instrumentation is
+disabled, so that the handlers never have to check). Histograms use a fixed
+number of log-linear buckets, like HdrHistogram, so their memory does not
+depend on the number of samples. All the Metrics created are kept in
+`registry`, which serve() exposes over HTTP as text (/metrics) or JSON
+(/metrics.json).
+"""
+
+import time
+import json
+import threading
+import BaseHTTPServer
+
+# all the Metrics objects created so far, by name
+registry = {}
+
+
+class Histogram:
+    """Fixed-memory histogram of integer values (microseconds for latencies).
+
+    Values below 2**sub_bits have their own bucket; above that each power of
+    two is split in 2**(sub_bits-1) linear sub-buckets, which bounds the
+    relative error to 2**(1-sub_bits). Values above 2**max_bits are clamped."""
+
+    def __init__ (self, sub_bits = 5, max_bits = 36):
+        self.sub_bits = sub_bits
+        self.sub_count = 1 << sub_bits
+        self.half = self.sub_count >> 1
+        self.max_value = (1 << max_bits) - 1
+        self.counts = [0] * self._index(self.max_value) + [0]
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index (self, value):
+        if value < self.sub_count:
+            return value
+        shift = value.bit_length() - self.sub_bits
+        return self.sub_count + (shift - 1) * self.half + (value >> shift) - self.half
+
+    def _lowest (self, index):
+        """smallest value that falls in bucket index"""
+        if index < self.sub_count:
+            return index
+        shift, sub = divmod(index - self.sub_count, self.half)
+        return (sub + self.half) << (shift + 1)
+
+    def record (self, value):
+        value = int(value)
+        if value < 0:
+            value = 0
+        elif value > self.max_value:
+            value = self.max_value
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile (self, q):
+        """returns the value below which a fraction q of the samples fall"""
+        if self.count == 0:
+            return 0
+        rank = max(1, int(round(q * self.count)))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self._lowest(index), self.max)
+        return self.max
+
+    def mean (self):
+        if self.count == 0:
+            return 0
+        return float(self.total) / self.count
+
+    def reset (self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def summary (self):
+        return {'count': self.count, 'mean': self.mean(),
+                'min': self.min or 0, 'max': self.max or 0,
+                'p50': self.percentile(0.5), 'p90': self.percentile(0.9),
+                'p99': self.percentile(0.99), 'p999': self.percentile(0.999)}
+
+
+class StageTimer (object):
+    """Measures consecutive stages of a single event. Each call to lap()
+    records the time elapsed since the previous lap (or since the timer was
+    created), stop() records the time since the creation."""
+
+    __slots__ = ('metrics', 'event', 'start', 'last')
+
+    def __init__ (self, metrics, event):
+        self.metrics = metrics
+        self.event = event
+        self.start = self.last = metrics.clock()
+
+    def lap (self, stage):
+        now = self.metrics.clock()
+        self.metrics.record(self.event + '.' + stage, now - self.last)
+        self.last = now
+
+    def stop (self):
+        now = self.metrics.clock()
+        self.metrics.record(self.event + '.total', now - self.start)
+
+
+class Metrics:
+    """Named set of latency histograms, counters and gauges"""
+
+    def __init__ (self, name, clock = time.time):
+        self.name = name
+        self.clock = clock
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        registry[name] = self
+
+    def timer (self, event):
+        return StageTimer(self, event)
+
+    def record (self, name, seconds):
+        """adds a latency sample, in seconds, to the histogram name"""
+        h = self.histograms.get(name)
+        if h is None:
+            h = self.histograms[name] = Histogram()
+        h.record(round(seconds * 1000000))
+
+    def count (self, name, n = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge (self, name, func):
+        """registers a function returning the current value of name"""
+        self.gauges[name] = func
+
+    def reset (self):
+        for h in self.histograms.values():
+            h.reset()
+        self.counters = {}
+
+    def snapshot (self):
+        gauges = {}
+        for name, func in self.gauges.items():
+            try:
+                gauges[name] = func()
+            except Exception:
+                gauges[name] = None
+        return {'counters': dict(self.counters), 'gauges': gauges,
+                'latency_us': dict((name, h.summary())
+                                   for name, h in self.histograms.items())}
+
+    def report (self):
+        """returns the snapshot as human readable text"""
+        snap = self.snapshot()
+        lines = []
+        for kind in ('counters', 'gauges'):
+            for name in sorted(snap[kind]):
+                lines.append("%s.%s %s" % (self.name, name, snap[kind][name]))
+        for name in sorted(snap['latency_us']):
+            s = snap['latency_us'][name]
+            lines.append("%s.%s_us count=%d mean=%.1f p50=%d p90=%d p99=%d "
+                         "p999=%d max=%d" % (self.name, name, s['count'],
+                         s['mean'], s['p50'], s['p90'], s['p99'], s['p999'],
+                         s['max']))
+        return '\n'.join(lines)
+
+
+class _NullTimer (object):
+    __slots__ = ()
+    def lap (self, stage): pass
+    def stop (self): pass
+
+_nullTimer = _NullTimer()
+
+
+class NullMetrics:
+    """Drop-in replacement for Metrics when instrumentation is disabled"""
+
+    def timer (self, event): return _nullTimer
+    def record (self, name, seconds): pass
+    def count (self, name, n = 1): pass
+    def gauge (self, name, func): pass
+    def reset (self): pass
+
+
+def report ():
+    """text report of all the registered Metrics"""
+    return '\n'.join(registry[name].report() for name in sorted(registry))
+
+def show ():
+    """prints the report, for use from the POX console"""
+    print report()
+
+def snapshot ():
+    return dict((name, m.snapshot()) for name, m in registry.items())
+
+
+class MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET (self):
+        if self.path in ('/', '/metrics'):
+            body = report() + '\n'
+            ctype = 'text/plain'
+        elif self.path == '/metrics.json':
+            body = json.dumps(snapshot(), sort_keys = True)
+            ctype = 'application/json'
+        else:
+            self.send_error(404, "Unknown metrics path")
+            return
+        self.send_response(200)
+        self.send_header("Content-type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message (self, format, *args):
+        pass
+
+
+_server = None
+
+def serve (port, address = '127.0.0.1'):
+    """starts (once) a background HTTP server exporting the registry"""
+    global _server
+    if _server is None:
+        _server = BaseHTTPServer.HTTPServer((address, int(port)),
+                                            MetricsRequestHandler)
+        t = threading.Thread(target = _server.serve_forever)
+        t.daemon = True
+        t.start()
+    return _server
@@ -0,0 +1,78 @@
+"""Unit test for metrics.py"""
+import unittest
+import metrics
+from metrics import Histogram, Metrics, NullMetrics
+
+class HistogramRecord(unittest.TestCase):
+    def setUp(self):
+        self.histogram = Histogram()
+
+    def testSmallValuesExact(self):
+        """values below the sub-bucket count should be reported exactly"""
+        for v in range(1, 11):
+            self.histogram.record(v)
+        self.assertEqual(self.histogram.percentile(0.5), 5)
+        self.assertEqual(self.histogram.percentile(1.0), 10)
+
+    def testRelativeError(self):
+        """large values should be reported within the bucket precision"""
+        for v in range(1000, 101000, 1000):
+            self.histogram.record(v)
+        p99 = self.histogram.percentile(0.99)
+        self.assertTrue(abs(p99 - 99000) <= 99000 / 16.0)
+
+    def testClamp(self):
+        """out of range values should be clamped, not lost"""
+        self.histogram.record(-5)
+        self.histogram.record(1 << 40)
+        self.assertEqual(self.histogram.count, 2)
+        self.assertEqual(self.histogram.min, 0)
+        self.assertEqual(self.histogram.max, self.histogram.max_value)
+
+    def testEmpty(self):
+        """an empty histogram should report zeros"""
+        self.assertEqual(self.histogram.percentile(0.99), 0)
+        self.assertEqual(self.histogram.mean(), 0)
+
+class StageTimer(unittest.TestCase):
+    def setUp(self):
+        self.now = [0.0]
+        self.metrics = Metrics('test', clock = lambda: self.now[0])
+
+    def tearDown(self):
+        del metrics.registry['test']
+
+    def testLaps(self):
+        """each lap should record the time since the previous one"""
+        t = self.metrics.timer('PacketIn')
+        self.now[0] = 0.001
+        t.lap('parse')
+        self.now[0] = 0.004
+        t.lap('lookup')
+        t.stop()
+        h = self.metrics.histograms
+        self.assertEqual(h['PacketIn.parse'].max, 1000)
+        self.assertEqual(h['PacketIn.lookup'].max, 3000)
+        self.assertEqual(h['PacketIn.total'].max, 4000)
+
+    def testSnapshot(self):
+        """snapshot should include counters and gauges"""
+        self.metrics.count('redirects')
+        self.metrics.count('redirects')
+        self.metrics.gauge('flows', lambda: 7)
+        snap = self.metrics.snapshot()
+        self.assertEqual(snap['counters']['redirects'], 2)
+        self.assertEqual(snap['gauges']['flows'], 7)
+
+class Disabled(unittest.TestCase):
+    def testNullMetrics(self):
+        """NullMetrics should accept the same calls and record nothing"""
+        m = NullMetrics()
+        t = m.timer('PacketIn')
+        t.lap('parse')
+        t.stop()
+        m.count('redirects')
+        self.assertFalse(hasattr(m, 'histograms'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,11 +15,20 @@
 """
 oracleDB maps contents to IP of peer-to-peer sources. It can be interrogated
 by other modules (e.g. the dns_oracle) to retrieve potential sources. 
+
+In chunk-aware mode (with a chunk_size) it also knows the partial sources,
+which hold only some chunks of a content: their chunks are kept as a bitmap
+(an int, bit i set if chunk i is held) per (content, source), and a partial
+source holding every chunk becomes a regular source. getChunkSources()
+returns a source for each part of a range of chunks, getRangeSource() one
+holding a whole range of bytes. Changes of the partial sources count as
+changes of the sources of the content (see version()).
 """
 
 
 
 # Imports for the OracleDB itself
+import random
 
 
 # Import some POX stuff
@@ -57,56 +66,267 @@ class OracleDB:
     class UnknownContentError(OracleDBError): pass
     class UnknownSourceError(OracleDBError): pass
 
-    def __init__(self):
+    def __init__(self, chunk_size = None):
         self.contentMap = {}
+        # content -> {source: its index in contentMap[content]}, so that
+        # lookups and removals don't scan the list of sources
+        self.positions = {}
+        # content -> value of self.changes when its sources last changed
+        self.changes = 0
+        self.versions = {}
+        # chunk-aware mode: content -> {partial source: bitmap of its chunks},
+        # and content -> size in bytes, when known
+        self.chunkSize = chunk_size
+        self.chunkMaps = {}
+        self.sizes = {}
 
-    def getSource (self, content):
+    def getSource (self, content, exclude = None):
         """returns the IP address of a P2P source for content, if one exists, or None
-        otherwise."""
-        import random
-        if content in self.contentMap.keys():
-            return random.choice(self.contentMap[content])
-        else:
+        otherwise. sources on the host exclude (e.g. the requester itself) are
+        never returned, whatever their port."""
+        sources = self.contentMap.get(content)
+        if sources is None:
             return None
+        source = random.choice(sources)
+        if exclude is None or source.split(':')[0] != exclude:
+            return source
+        others = [other for other in sources if other.split(':')[0] != exclude]
+        if others:
+            return random.choice(others)
+        return None
     
     def addSource (self, content, source):
         """adds a P2P source for the specified content. each source can be listed
         only once for each content. returns True if the insertion succeeds, False
         otherwise"""
-        if content in self.contentMap.keys():
-            if source in self.contentMap[content]:
-                # source was already listed
-                return False
-            else:
-                self.contentMap[content].append(source)
-                return True
-        else:
-            # create empty list for this new content
+        if self.chunkMaps:
+            # no longer a partial source, if it was
+            self.removeChunks(content, source)
+        sources = self.contentMap.get(content)
+        if sources is None:
+            # create the list for this new content
             self.contentMap[content] = [source]
-            # self.contentMap[content].append(source)
+            self.positions[content] = {source: 0}
+            self._changed(content)
             return True
+        positions = self.positions[content]
+        if source in positions:
+            # source was already listed
+            return False
+        positions[source] = len(sources)
+        sources.append(source)
+        self._changed(content)
+        return True
     
     def removeSource (self, content, source):
         """removes a P2P source for the specified content. Raises an
         UnknownContentError exception if content is not present in the map, and an
         UnknownSourceError excepion if the source is not listed for that content"""
-        if content not in self.contentMap.keys():
+        sources = self.contentMap.get(content)
+        if sources is None:
             raise OracleDB.UnknownContentError("content " + content +" not present in contentMap")
-        elif source not in self.contentMap[content]:
+        positions = self.positions[content]
+        index = positions.pop(source, None)
+        if index is None:
             raise OracleDB.UnknownSourceError("source " +source +" not present in the set for" + content)
-        else:
-            self.contentMap[content].remove(source)
+        # move the last source in the hole, the order doesn't matter
+        last = sources.pop()
+        if index < len(sources):
+            sources[index] = last
+            positions[last] = index
+        self._changed(content)
+        if not sources:
+            # getSource expects a non-empty list for known contents
+            del self.contentMap[content]
+            del self.positions[content]
+
+    def addSources (self, contents, source):
+        """adds source for each of the specified contents, e.g. after a peer
+        announced its holdings. returns the number of new insertions"""
+        added = 0
+        for content in contents:
+            if self.addSource(content, source):
+                added += 1
+        return added
+
+    def removeSources (self, contents, source):
+        """removes source from each of the specified contents, ignoring the
+        contents for which it's not listed. returns the number of removals"""
+        removed = 0
+        for content in contents:
+            if self.hasSource(content, source):
+                self.removeSource(content, source)
+                removed += 1
+        return removed
+
+    def hasSource (self, content, source):
+        """returns True if source is listed for content"""
+        positions = self.positions.get(content)
+        return positions is not None and source in positions
     
     def listSources (self, content):
         """list all known sources for the specified content"""
-        if content in self.contentMap.keys():
-            return self.contentMap[content]
-        else:
-            return []
+        return self.contentMap.get(content, [])
             
     def clear (self, content = None):
         if content is None:
+            for content in set(self.contentMap) | set(self.chunkMaps):
+                self._changed(content)
             self.contentMap = {}
-        elif content in self.contentMap.keys():
-            del self.contentMap[content]
+            self.positions = {}
+            self.chunkMaps = {}
+        else:
+            partials = self.chunkMaps.pop(content, None)
+            if content in self.contentMap:
+                del self.contentMap[content]
+                del self.positions[content]
+                self._changed(content)
+            elif partials:
+                self._changed(content)
+
+    def version (self, content):
+        """returns a number that changes whenever the sources of content do"""
+        return self.versions.get(content, 0)
+
+    def setSize (self, content, size):
+        """records the size of content in bytes, so that its partial sources
+        can be told complete"""
+        self.sizes[content] = size
+
+    def chunkCount (self, content):
+        """the number of chunks of content, or None if its size is unknown"""
+        size = self.sizes.get(content)
+        if size is None:
+            return None
+        return max(1, -(-size // self.chunkSize))
+
+    def getChunks (self, content, source):
+        """returns the bitmap of the chunks of content held by source, -1
+        (all bits set) for a regular source"""
+        if self.hasSource(content, source):
+            return -1
+        return self.chunkMaps.get(content, {}).get(source, 0)
+
+    def setChunks (self, content, source, bitmap):
+        """sets the chunks of content held by source, e.g. as it announced
+        them. a source holding them all is added as a regular source. returns
+        True if anything changed"""
+        if self.hasSource(content, source):
+            return False
+        count = self.chunkCount(content)
+        if count is not None:
+            full = (1 << count) - 1
+            bitmap &= full
+            if bitmap == full:
+                self.removeChunks(content, source)
+                return self.addSource(content, source)
+        partials = self.chunkMaps.get(content)
+        if partials is None:
+            if not bitmap:
+                return False
+            partials = self.chunkMaps[content] = {}
+        if partials.get(source, 0) == bitmap:
+            return False
+        if bitmap:
+            partials[source] = bitmap
+            self._changed(content)
+        else:
+            self.removeChunks(content, source)
+        return True
+
+    def markBytes (self, content, source, start, end):
+        """adds the chunks of content entirely within bytes [start, end) to
+        those held by source, e.g. as a transfer goes on. the last chunk is
+        complete when end reaches the size of content"""
+        first = -(-start // self.chunkSize)
+        size = self.sizes.get(content)
+        if size is not None and end >= size:
+            last = self.chunkCount(content)
+        else:
+            last = end // self.chunkSize
+        if last <= first:
+            return False
+        mask = ((1 << (last - first)) - 1) << first
+        held = self.getChunks(content, source)
+        if held & mask == mask:
+            return False
+        return self.setChunks(content, source, held | mask)
+
+    def removeChunks (self, content, source):
+        """forgets the chunks of content held by the partial source"""
+        partials = self.chunkMaps.get(content)
+        if partials is not None and partials.pop(source, None) is not None:
+            if not partials:
+                del self.chunkMaps[content]
+            self._changed(content)
+            return True
+        return False
+
+    def listChunkSources (self, content):
+        """the partial sources of content, mapped to the bitmap of their
+        chunks"""
+        return self.chunkMaps.get(content, {})
+
+    def getChunkSources (self, content, first, last, exclude = None):
+        """returns [(first chunk, last chunk, source)] covering the chunks
+        first to last (included) of content, each part with the source holding
+        its longest run of chunks (a regular source, if any, covers them all),
+        or with None for the parts no source holds. sources on the host
+        exclude are never returned"""
+        def allowed (source):
+            return exclude is None or source.split(':')[0] != exclude
+        whole = [s for s in self.contentMap.get(content, ()) if allowed(s)]
+        if whole:
+            return [(first, last, random.choice(whole))]
+        partials = [(s, b) for s, b in self.chunkMaps.get(content, {}).items()
+                    if allowed(s)]
+        held = 0
+        for source, bitmap in partials:
+            held |= bitmap
+        parts = []
+        i = first
+        while i <= last:
+            best = []
+            bestRun = 0
+            for source, bitmap in partials:
+                run = _run(bitmap >> i)
+                if run > bestRun:
+                    best = [source]
+                    bestRun = run
+                elif run == bestRun and run:
+                    best.append(source)
+            if best:
+                end = min(last, i + bestRun - 1)
+                parts.append((i, end, random.choice(best)))
+            else:
+                # nobody holds chunk i: skip to the next chunk someone holds
+                rest = held >> i
+                if rest:
+                    end = min(last, i + _run(~rest) - 1)
+                else:
+                    end = last
+                parts.append((i, end, None))
+            i = end + 1
+        return parts
+
+    def getRangeSource (self, content, start, end, exclude = None):
+        """returns a partial source holding all of bytes start to end
+        (included) of content, or None if no single one does (or the range is
+        empty). sources on the host exclude are never returned"""
+        if start < 0 or end < start:
+            return None
+        parts = self.getChunkSources(content, start // self.chunkSize,
+                                     end // self.chunkSize, exclude)
+        if len(parts) != 1:
+            return None
+        return parts[0][2]
+
+    def _changed (self, content):
+        self.changes += 1
+        self.versions[content] = self.changes
+
 
+def _run (bits):
+    """the number of consecutive set bits of bits, from the lowest one"""
+    zeros = ~bits
+    return (zeros & -zeros).bit_length() - 1
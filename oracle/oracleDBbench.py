@@ -0,0 +1,259 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmarks of OracleDB.
+
+Each workload runs on a database filled with a number of contents, each with
+the same number of sources, for every combination of the sizes given:
+
+  get      getSource of random known contents
+  list     listSources of random known contents
+  miss     getSource of unknown contents
+  add      addSource of new sources to random contents
+  remove   removeSource of random (content, source) pairs, until empty
+  clear    clear(content) of every content, in random order
+  mixed    getSource, or (with probability 1 - read) a new source replacing
+           an old one, for each mix given
+  churn    sources joining and leaving, the number of sources staying the
+           same, as when peers come and go
+
+The operations and their arguments are drawn beforehand. Each workload is
+run twice: once untimed to measure the throughput, once timing batches of
+--batch operations for the latency percentiles, in nanoseconds per operation
+(time.time() only has a microsecond resolution, too coarse for single
+operations on a small database). Memory per entry is the size of the
+database's structures divided by the number of (content, source) pairs.
+
+    python oracleDBbench.py --contents 100,10000 --sources 1,8 --json out.json
+    python oracleDBbench.py --compare out.json
+
+compares a new run with a previous one, workload by workload.
+"""
+
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+import platform
+from oracleDB import OracleDB
+from metrics import Histogram
+
+WORKLOADS = ['get', 'list', 'miss', 'add', 'remove', 'clear', 'mixed', 'churn']
+
+
+def contentName (i):
+    return "content%d.txt" % i
+
+def sourceName (i):
+    return "10.%d.%d.%d:9002" % ((i >> 16) & 255, (i >> 8) & 255, i & 255)
+
+def populate (contents, sources):
+    db = OracleDB()
+    n = 0
+    for c in range(contents):
+        name = contentName(c)
+        for s in range(sources):
+            db.addSource(name, sourceName(n))
+            n += 1
+    return db
+
+def deepSize (db):
+    """bytes used by the maps of db, their lists and strings (each object
+    being counted once)"""
+    seen = set()
+    total = 0
+    stack = [db.contentMap, db.positions]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set)):
+            stack.extend(obj)
+    return total
+
+
+def plan (workload, db, contents, sources, ops, read, rng):
+    """returns the list of (function, args) of workload on db"""
+    names = [contentName(c) for c in range(contents)]
+    if workload == 'get':
+        return [(db.getSource, (rng.choice(names),)) for i in range(ops)]
+    if workload == 'list':
+        return [(db.listSources, (rng.choice(names),)) for i in range(ops)]
+    if workload == 'miss':
+        return [(db.getSource, ("missing%d.txt" % i,)) for i in range(ops)]
+    if workload == 'add':
+        first = contents * sources
+        return [(db.addSource, (rng.choice(names), sourceName(first + i)))
+                for i in range(ops)]
+    if workload == 'remove':
+        pairs = [(name, source) for name, srcs in db.contentMap.items()
+                 for source in srcs]
+        rng.shuffle(pairs)
+        return [(db.removeSource, pair) for pair in pairs[:ops]]
+    if workload == 'clear':
+        rng.shuffle(names)
+        return [(db.clear, (name,)) for name in names[:ops]]
+    # mixed and churn: every write replaces the oldest source of a content
+    # with a new one, so the size of the database doesn't change
+    oldest = dict((name, list(srcs)) for name, srcs in db.contentMap.items())
+    first = contents * sources
+    steps = []
+    for i in range(ops):
+        name = rng.choice(names)
+        if workload == 'mixed' and rng.random() < read:
+            steps.append((db.getSource, (name,)))
+            continue
+        new = sourceName(first + i)
+        steps.append((db.addSource, (name, new)))
+        steps.append((db.removeSource, (name, oldest[name].pop(0))))
+        oldest[name].append(new)
+    return steps
+
+def execute (steps):
+    start = time.time()
+    for func, args in steps:
+        func(*args)
+    return time.time() - start
+
+def executeTimed (steps, batch):
+    latency = Histogram()
+    for i in range(0, len(steps), batch):
+        start = time.time()
+        for func, args in steps[i:i + batch]:
+            func(*args)
+        n = min(batch, len(steps) - i)
+        latency.record(int((time.time() - start) * 1e9 / n))
+    return latency
+
+
+def bench (workload, contents, sources, ops, read = 1.0, seed = 1, batch = 10):
+    """runs workload, returns its results as a dict"""
+    db = populate(contents, sources)
+    entries = contents * sources
+    memory = deepSize(db)
+    rng = random.Random(seed)
+    steps = plan(workload, db, contents, sources, ops, read, rng)
+    gc.disable()
+    try:
+        elapsed = execute(steps)
+        # again on a fresh copy, for the operations that change it
+        db = populate(contents, sources)
+        steps = plan(workload, db, contents, sources, ops, read,
+                     random.Random(seed))
+        latency = executeTimed(steps, batch)
+    finally:
+        gc.enable()
+    result = {'workload': workload, 'contents': contents, 'sources': sources,
+              'ops': len(steps),
+              'ops_per_second': len(steps) / elapsed if elapsed > 0 else 0,
+              'bytes_per_entry': float(memory) / entries if entries else 0,
+              'latency_ns': latency.summary()}
+    if workload == 'mixed':
+        result['read'] = read
+    return result
+
+def key (result):
+    return (result['workload'], result['contents'], result['sources'],
+            result.get('read'))
+
+def sweep (workloads, contents, sources, reads, ops, seed = 1, batch = 10):
+    """yields the results of each workload, for each combination of sizes"""
+    for workload in workloads:
+        for c in contents:
+            for s in sources:
+                for read in (reads if workload == 'mixed' else [None]):
+                    yield bench(workload, c, s, ops, read, seed, batch)
+
+
+def formatHeader ():
+    return "%-7s %8s %7s %5s %12s %8s %8s %8s %10s" % ('work', 'contents',
+            'sources', 'read', 'ops/s', 'p50 ns', 'p99 ns', 'p999 ns', 'B/entry')
+
+def formatResult (r, previous = None):
+    lat = r['latency_ns']
+    line = "%-7s %8d %7d %5s %12.0f %8d %8d %8d %10.1f" % (r['workload'],
+            r['contents'], r['sources'],
+            '' if r.get('read') is None else '%.2f' % r['read'],
+            r['ops_per_second'], lat['p50'], lat['p99'], lat['p999'],
+            r['bytes_per_entry'])
+    if previous is not None and previous['ops_per_second']:
+        line += "  x%.2f" % (r['ops_per_second'] / previous['ops_per_second'])
+    return line
+
+def main (argv = None):
+    parser = argparse.ArgumentParser(description = "OracleDB microbenchmarks")
+    parser.add_argument('--workloads', default = ','.join(WORKLOADS))
+    parser.add_argument('--contents', default = '100,1000',
+                        help = "comma separated numbers of contents")
+    parser.add_argument('--sources', default = '1,4,16',
+                        help = "comma separated numbers of sources per content")
+    parser.add_argument('--read', default = '0.5,0.9,0.99',
+                        help = "comma separated read fractions of 'mixed'")
+    parser.add_argument('--ops', type = int, default = 20000,
+                        help = "operations per workload")
+    parser.add_argument('--batch', type = int, default = 10,
+                        help = "operations timed together for the latency")
+    parser.add_argument('--seed', type = int, default = 1)
+    parser.add_argument('--json', help = "write the results to this file")
+    parser.add_argument('--compare', help = "show the throughput relative to "
+                        "the results in this file, and run the same sweep")
+    args = parser.parse_args(argv)
+    workloads = args.workloads.split(',')
+    for w in workloads:
+        if w not in WORKLOADS:
+            parser.error("unknown workload %s" % w)
+    contents = [int(x) for x in args.contents.split(',')]
+    sources = [int(x) for x in args.sources.split(',')]
+    reads = [float(x) for x in args.read.split(',')]
+    ops = args.ops
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        for r in old['results']:
+            previous[key(r)] = r
+        # same sweep as the previous run
+        workloads = [w for w in WORKLOADS
+                     if any(r['workload'] == w for r in old['results'])]
+        contents = sorted(set(r['contents'] for r in old['results']))
+        sources = sorted(set(r['sources'] for r in old['results']))
+        reads = sorted(set(r['read'] for r in old['results']
+                           if r.get('read') is not None)) or reads
+        ops = old.get('ops', ops)
+    print formatHeader()
+    results = []
+    for r in sweep(workloads, contents, sources, reads, ops, args.seed,
+                   args.batch):
+        results.append(r)
+        print formatResult(r, previous.get(key(r)))
+        sys.stdout.flush()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'ops': ops, 'seed': args.seed, 'batch': args.batch,
+                       'results': results}, f, indent = 2, sort_keys = True)
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -50,6 +50,19 @@ class GetSource(unittest.TestCase):
         """getSource should return None if the content is unknown """
         source = self.oracle.getSource('c2')
         self.assertEqual(source, None)   
+
+    def testGetSourceExclude(self):
+        """getSource should never return a source on the excluded host"""
+        self.oracle.addSource('c2','10.0.0.1:9002')
+        self.oracle.addSource('c2','10.0.0.3')
+        for i in range(50):
+            self.assertEqual(self.oracle.getSource('c1', exclude = '10.0.0.1'), '10.0.0.2')
+            self.assertEqual(self.oracle.getSource('c2', exclude = '10.0.0.1'), '10.0.0.3')
+
+    def testGetSourceOnlyExcluded(self):
+        """getSource should return None if the excluded host is the only source"""
+        self.oracle.removeSource('c1','10.0.0.2')
+        self.assertEqual(self.oracle.getSource('c1', exclude = '10.0.0.1'), None)
         
 class ListSources(unittest.TestCase):
     def setUp(self):
@@ -93,5 +106,142 @@ class Clear(unittest.TestCase):
         sources = self.oracle.listSources('c2')
         self.assertEqual(len(sources),0)
 
+class BulkSources(unittest.TestCase):
+    def setUp(self):
+        self.oracle = OracleDB()
+        self.oracle.addSource('c1','10.0.0.1')
+
+    def testAddSources(self):
+        """addSources should add the source to every content and count the new ones"""
+        added = self.oracle.addSources(['c1','c2','c3'],'10.0.0.1')
+        self.assertEqual(added, 2)
+        self.assertTrue('10.0.0.1' in self.oracle.listSources('c3'))
+
+    def testRemoveSources(self):
+        """removeSources should skip the contents the source doesn't hold"""
+        self.oracle.addSource('c2','10.0.0.2')
+        removed = self.oracle.removeSources(['c1','c2','c3'],'10.0.0.1')
+        self.assertEqual(removed, 1)
+        self.assertEqual(self.oracle.getSource('c1'), None)
+        self.assertEqual(self.oracle.getSource('c2'), '10.0.0.2')
+
+    def testRemoveKeepsOthers(self):
+        """removing a source should leave the other sources listed, once each"""
+        self.oracle.addSources(['c1'],'10.0.0.2')
+        self.oracle.addSource('c1','10.0.0.3')
+        self.oracle.removeSource('c1','10.0.0.1')
+        self.assertEqual(sorted(self.oracle.listSources('c1')), ['10.0.0.2','10.0.0.3'])
+        self.oracle.removeSource('c1','10.0.0.3')
+        self.assertEqual(self.oracle.listSources('c1'), ['10.0.0.2'])
+        self.assertFalse(self.oracle.addSource('c1','10.0.0.2'))
+        self.assertTrue(self.oracle.hasSource('c1','10.0.0.2'))
+        self.assertFalse(self.oracle.hasSource('c1','10.0.0.3'))
+
+    def testRemoveLastSource(self):
+        """getSource should return None once the last source is removed"""
+        self.oracle.removeSource('c1','10.0.0.1')
+        self.assertEqual(self.oracle.getSource('c1'), None)
+
+class Versions(unittest.TestCase):
+    def setUp(self):
+        self.oracle = OracleDB()
+        self.oracle.addSource('c1','10.0.0.1')
+
+    def testVersion(self):
+        """version should change with the sources of a content only"""
+        v1 = self.oracle.version('c1')
+        self.assertEqual(self.oracle.version('c2'), 0)
+        self.oracle.addSource('c1','10.0.0.1')
+        self.oracle.addSource('c2','10.0.0.1')
+        self.assertEqual(self.oracle.version('c1'), v1)
+        self.oracle.addSource('c1','10.0.0.2')
+        v2 = self.oracle.version('c1')
+        self.assertNotEqual(v2, v1)
+        self.oracle.removeSource('c1','10.0.0.2')
+        self.assertNotEqual(self.oracle.version('c1'), v2)
+
+    def testVersionAfterClear(self):
+        """a content cleared and added again should not get an old version back"""
+        v1 = self.oracle.version('c1')
+        self.oracle.clear()
+        self.oracle.addSource('c1','10.0.0.1')
+        self.assertTrue(self.oracle.version('c1') > v1)
+
+class Chunks(unittest.TestCase):
+    def setUp(self):
+        self.oracle = OracleDB(chunk_size = 100)
+        self.oracle.setSize('c1', 950)
+
+    def testMarkBytes(self):
+        """markBytes should only mark the chunks entirely transferred"""
+        self.assertTrue(self.oracle.markBytes('c1','10.0.0.5', 0, 250))
+        self.assertEqual(self.oracle.getChunks('c1','10.0.0.5'), 0b11)
+        self.assertFalse(self.oracle.markBytes('c1','10.0.0.5', 50, 199))
+        self.oracle.markBytes('c1','10.0.0.5', 450, 700)
+        self.assertEqual(self.oracle.getChunks('c1','10.0.0.5'), 0b1100011)
+
+    def testComplete(self):
+        """a partial source holding every chunk should become a source"""
+        self.oracle.markBytes('c1','10.0.0.5', 0, 900)
+        self.assertEqual(self.oracle.listSources('c1'), [])
+        self.oracle.markBytes('c1','10.0.0.5', 900, 950)
+        self.assertEqual(self.oracle.listSources('c1'), ['10.0.0.5'])
+        self.assertEqual(self.oracle.listChunkSources('c1'), {})
+        self.assertEqual(self.oracle.getChunks('c1','10.0.0.5'), -1)
+
+    def testSetChunks(self):
+        """setChunks should replace the chunks of a source, or forget it"""
+        self.assertTrue(self.oracle.setChunks('c1','10.0.0.5', 0b101))
+        self.assertFalse(self.oracle.setChunks('c1','10.0.0.5', 0b101))
+        self.assertTrue(self.oracle.setChunks('c1','10.0.0.5', 0))
+        self.assertEqual(self.oracle.listChunkSources('c1'), {})
+
+    def testChunkSources(self):
+        """getChunkSources should cover a range with the longest runs"""
+        self.oracle.setChunks('c1','10.0.0.5', 0b0000111)
+        self.oracle.setChunks('c1','10.0.0.6', 0b0011110)
+        self.oracle.setChunks('c1','10.0.0.7', 0b1000000)
+        self.assertEqual(self.oracle.getChunkSources('c1', 0, 9),
+                         [(0, 2, '10.0.0.5'), (3, 4, '10.0.0.6'), (5, 5, None),
+                          (6, 6, '10.0.0.7'), (7, 9, None)])
+        parts = self.oracle.getChunkSources('c1', 1, 9)
+        self.assertEqual(parts, [(1, 4, '10.0.0.6'), (5, 5, None),
+                                 (6, 6, '10.0.0.7'), (7, 9, None)])
+        self.assertEqual(self.oracle.getChunkSources('c1', 0, 1, exclude = '10.0.0.5'),
+                         [(0, 0, None), (1, 1, '10.0.0.6')])
+
+    def testWholeSource(self):
+        """a regular source should cover any range"""
+        self.oracle.setChunks('c1','10.0.0.5', 0b1)
+        self.oracle.addSource('c1','10.0.0.2')
+        self.assertEqual(self.oracle.getChunkSources('c1', 3, 8),
+                         [(3, 8, '10.0.0.2')])
+
+    def testRangeSource(self):
+        """getRangeSource should only return a source holding the whole range"""
+        self.oracle.setChunks('c1','10.0.0.5', 0b0000111)
+        self.oracle.setChunks('c1','10.0.0.6', 0b0011000)
+        self.assertEqual(self.oracle.getRangeSource('c1', 150, 299), '10.0.0.5')
+        self.assertEqual(self.oracle.getRangeSource('c1', 250, 350), None)
+        self.assertEqual(self.oracle.getRangeSource('c1', 700, 800), None)
+        self.assertEqual(self.oracle.getRangeSource('c1', 0, 99, exclude = '10.0.0.5'), None)
+
+    def testInvertedRange(self):
+        """an inverted range should have no source"""
+        self.oracle.setChunks('c1','10.0.0.5', 0b111)
+        self.assertEqual(self.oracle.getChunkSources('c1', 50, 1), [])
+        self.assertEqual(self.oracle.getRangeSource('c1', 5000, 100), None)
+
+    def testVersion(self):
+        """changes of the partial sources should change the version of a content"""
+        versions = [self.oracle.version('c1')]
+        self.oracle.markBytes('c1','10.0.0.5', 0, 250)
+        versions.append(self.oracle.version('c1'))
+        self.assertFalse(self.oracle.setChunks('c1','10.0.0.5', 0b11))
+        self.assertEqual(self.oracle.version('c1'), versions[-1])
+        self.oracle.removeChunks('c1','10.0.0.5')
+        versions.append(self.oracle.version('c1'))
+        self.assertEqual(len(set(versions)), 3)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,182 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Decides where to prefetch the contents in demand (see prefetch.py).
+
+A region is a block of addresses sharing their first region_bits bits. The
+requests for each content are counted per region of the requester, and the
+redirects sent to each source, as exponentially decaying counts (halving
+every halflife seconds, as in ttl.py). A region is under-served for a
+content when its requests per second, shared among the sources of the
+content in the region (plus one, for the origin or a remote source), exceed
+per_replica. plan() then picks an idle peer of the region to prefetch it:
+a source of other contents, which doesn't hold this one, isn't prefetching
+anything, and receives at most idle_rate redirects per second. The copy is
+made from the closest source of the content, or from the origin if it has
+none. At most max_active prefetches run at a time.
+
+Peers are the sources listed with a port (host:port), i.e. VoD servers which
+announced their contents and serve /_prefetch on that port.
+"""
+
+import math
+import socket
+import struct
+import time
+from redirect import closestSource
+
+
+class _Rate (object):
+    __slots__ = ('count', 'last')
+
+    def __init__ (self, now):
+        self.count = 0.0
+        self.last = now
+
+
+class Placement (object):
+    def __init__ (self, db, region_bits = 24, per_replica = 0.5,
+                  idle_rate = 0.1, max_active = 4, halflife = 60,
+                  retry = 300, clock = time.time):
+        self.db = db
+        self.region_bits = region_bits
+        self.per_replica = per_replica
+        self.idle_rate = idle_rate
+        self.max_active = max_active
+        self.halflife = float(halflife)
+        self.retry = retry
+        self.clock = clock
+        # content -> {region: _Rate} of the requests
+        self.demand = {}
+        # source -> _Rate of the redirects to it
+        self.load = {}
+        # (peer, content) -> start time of the prefetches running
+        self.active = {}
+        # (peer, content) -> time of the last failure
+        self.failures = {}
+
+    def region (self, source):
+        address = socket.inet_aton(source.split(':')[0])
+        return struct.unpack('!I', address)[0] >> (32 - self.region_bits)
+
+    def _count (self, rates, key, now):
+        rate = rates.get(key)
+        if rate is None:
+            rate = rates[key] = _Rate(now)
+        rate.count = rate.count * 0.5 ** ((now - rate.last) / self.halflife) + 1
+        rate.last = now
+
+    def _rate (self, rate, now):
+        if rate is None:
+            return 0.0
+        decay = 0.5 ** ((now - rate.last) / self.halflife)
+        return rate.count * decay * math.log(2) / self.halflife
+
+    def request (self, content, requester):
+        """counts a request for content from the host requester"""
+        self._count(self.demand.setdefault(content, {}),
+                    self.region(requester), self.clock())
+
+    def redirected (self, source):
+        """counts a redirect to source"""
+        self._count(self.load, source, self.clock())
+
+    def plan (self):
+        """returns [(peer, content, source)] of the prefetches to start: peer
+        should copy content from source, or from the origin if None"""
+        budget = self.max_active - len(self.active)
+        if budget <= 0:
+            return []
+        now = self.clock()
+        peers = {}
+        busy = set(peer for peer, content in self.active)
+        for sources in self.db.contentMap.itervalues():
+            for source in sources:
+                if ':' in source and source not in busy:
+                    peers.setdefault(self.region(source), set()).add(source)
+        wanted = []
+        for content, regions in self.demand.iteritems():
+            replicas = {}
+            for source in self.db.listSources(content):
+                region = self.region(source)
+                replicas[region] = replicas.get(region, 0) + 1
+            for peer, c in self.active:
+                if c == content:
+                    region = self.region(peer)
+                    replicas[region] = replicas.get(region, 0) + 1
+            for region, rate in regions.iteritems():
+                share = self._rate(rate, now) / (replicas.get(region, 0) + 1)
+                if share > self.per_replica and region in peers:
+                    wanted.append((share, content, region))
+        wanted.sort(reverse = True)
+        orders = []
+        for share, content, region in wanted:
+            idle = []
+            for peer in peers[region]:
+                if self.db.hasSource(content, peer):
+                    continue
+                failed = self.failures.get((peer, content))
+                if failed is not None and now - failed < self.retry:
+                    continue
+                load = self._rate(self.load.get(peer), now)
+                if load <= self.idle_rate:
+                    idle.append((load, peer))
+            if not idle:
+                continue
+            peer = min(idle)[1]
+            peers[region].discard(peer)
+            sources = self.db.listSources(content)
+            source = closestSource(content, peer, sources) if sources else None
+            orders.append((peer, content, source))
+            self.active[(peer, content)] = now
+            if len(orders) >= budget:
+                break
+        return orders
+
+    def finished (self, peer, content, ok):
+        """the prefetch of content by peer completed (ok) or failed; a
+        completed copy is added as a source"""
+        if self.active.pop((peer, content), None) is None:
+            return False
+        if ok:
+            self.failures.pop((peer, content), None)
+            return self.db.addSource(content, peer)
+        self.failures[(peer, content)] = self.clock()
+        return False
+
+    def expire (self, timeout, idle = None):
+        """gives up the prefetches running for more than timeout seconds, and
+        forgets the demand of the contents not requested for idle seconds (by
+        default, ten half-lives). returns the prefetches given up"""
+        now = self.clock()
+        late = [key for key, start in self.active.items()
+                if now - start > timeout]
+        for peer, content in late:
+            self.finished(peer, content, False)
+        if idle is None:
+            idle = 10 * self.halflife
+        for content, regions in self.demand.items():
+            for region, rate in regions.items():
+                if now - rate.last > idle:
+                    del regions[region]
+            if not regions:
+                del self.demand[content]
+        for source, rate in self.load.items():
+            if now - rate.last > idle:
+                del self.load[source]
+        for key, failed in self.failures.items():
+            if now - failed > self.retry:
+                del self.failures[key]
+        return late
@@ -0,0 +1,71 @@
+"""Unit test for placement.py"""
+import unittest
+from oracleDB import OracleDB
+from placement import Placement
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class Plan(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.db = OracleDB()
+        self.db.addSource('hot', '10.0.1.2:9002')
+        self.db.addSource('other', '10.0.2.2:9002')
+        self.db.addSource('other', '10.0.2.3:9002')
+        self.db.addSource('other', '10.0.1.3')
+        self.placement = Placement(self.db, per_replica = 0.5, idle_rate = 0.1,
+                                   max_active = 4, halflife = 60,
+                                   clock = self.clock)
+
+    def requests(self, content, requester, n):
+        """n requests, a tenth of a second apart"""
+        for i in range(n):
+            self.placement.request(content, requester)
+            self.clock.now += 0.1
+
+    def testHotRegion(self):
+        """a region asking a lot for a content should get an idle peer of its own"""
+        # 10.0.2.2 is busy serving other requests
+        for i in range(20):
+            self.placement.redirected('10.0.2.2:9002')
+        self.requests('hot', '10.0.2.50', 100)
+        self.assertEqual(self.placement.plan(), [('10.0.2.3:9002', 'hot', '10.0.1.2:9002')])
+        self.assertEqual(self.placement.plan(), [])
+
+    def testServedRegion(self):
+        """a region with enough replicas, or little demand, should get nothing"""
+        self.requests('hot', '10.0.1.50', 100)
+        self.requests('hot', '10.0.2.50', 5)
+        self.assertEqual(self.placement.plan(), [])
+
+    def testFinished(self):
+        """a completed prefetch should add a source, a failed one be retried later"""
+        self.requests('hot', '10.0.2.50', 100)
+        self.assertEqual(self.placement.plan(), [('10.0.2.2:9002', 'hot', '10.0.1.2:9002')])
+        self.assertTrue(self.placement.finished('10.0.2.2:9002', 'hot', True))
+        self.assertTrue(self.db.hasSource('hot', '10.0.2.2:9002'))
+        self.requests('hot', '10.0.2.50', 200)
+        # copied from the closest source now
+        self.assertEqual(self.placement.plan(), [('10.0.2.3:9002', 'hot', '10.0.2.2:9002')])
+        self.placement.finished('10.0.2.3:9002', 'hot', False)
+        self.assertEqual(self.placement.plan(), [])
+        self.clock.now += 301
+        self.requests('hot', '10.0.2.50', 600)
+        self.assertEqual(self.placement.plan(), [('10.0.2.3:9002', 'hot', '10.0.2.2:9002')])
+
+    def testExpire(self):
+        """prefetches running for too long should be given up"""
+        self.requests('hot', '10.0.2.50', 100)
+        orders = self.placement.plan()
+        self.clock.now += 700
+        self.assertEqual(self.placement.expire(600), [orders[0][:2]])
+        self.assertEqual(self.placement.active, {})
+        self.assertEqual(self.placement.demand, {})
+
+if __name__ == '__main__':
+    unittest.main()
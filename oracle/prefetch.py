@@ -0,0 +1,138 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Copies the contents in demand to idle peers ahead of the requests.
+
+Without this, the replicas of a new content appear only as clients download
+it, so a flash crowd hits the origin and its first few sources. Every
+interval seconds the Prefetcher asks its Placement (see placement.py) where
+copies are missing, and orders the peers picked to fetch them: a JSON POST
+to the /_prefetch of their MsHTTPServer (see vodServer/Prefetcher.py), with
+the URL to copy from and a share of the bandwidth budget as rate. The
+running prefetches are followed by polling GET /_prefetch on their peers; a
+completed copy is added as a source right away (the ContentAnnouncer of the
+peer announces it too, later). A prefetch not completed within timeout
+seconds is given up.
+
+The HTTP requests are made on a background thread, their results applied
+on the POX event loop. The oracle must provide placement and metrics.
+"""
+
+from pox.core import core
+from pox.lib.recoco import Timer
+import threading
+import urllib
+import urllib2
+import json
+
+log = core.getLogger()
+
+
+def _name (content):
+    """the content as a UTF-8 str, as the OracleDB keys it"""
+    if isinstance(content, unicode):
+        return content.encode('utf-8')
+    return str(content)
+
+
+class Prefetcher (object):
+    def __init__ (self, owner, origin, interval = 10, bandwidth = 1000000,
+                  timeout = 600):
+        # the oracle whose Placement decides the prefetches
+        self.owner = owner
+        self.placement = owner.placement
+        # host[:port] of the origin server, for the contents without source
+        self.origin = origin
+        # bytes per second for all the prefetches together
+        self.bandwidth = bandwidth
+        self.timeout = timeout
+        self.running = False
+        self.timer = Timer(interval, self._plan, recurring = True)
+
+    def _plan (self):
+        for peer, content in self.placement.expire(self.timeout):
+            log.info("Prefetch of %s by %s timed out", content, peer)
+            self.owner.metrics.count('prefetch_failed')
+        if self.running:
+            # the previous round is still talking to the peers
+            return
+        orders = self.placement.plan()
+        peers = set(peer for peer, content in self.placement.active)
+        if not orders and not peers:
+            return
+        rate = self.bandwidth // max(1, self.placement.max_active)
+        self.running = True
+        thread = threading.Thread(target = self._run,
+                                  args = (orders, peers, rate))
+        thread.daemon = True
+        thread.start()
+
+    def _run (self, orders, peers, rate):
+        """background thread: sends orders, then polls peers"""
+        try:
+            for peer, content, source in orders:
+                url = 'http://%s/%s' % (source or self.origin,
+                                        urllib.quote(content.lstrip('/')))
+                body = json.dumps({'content': content, 'url': url,
+                                   'rate': rate})
+                try:
+                    urllib2.urlopen(urllib2.Request(
+                            'http://%s/_prefetch' % (peer,), body,
+                            {'Content-Type': 'application/json'}),
+                                    timeout = 5).close()
+                    ok = True
+                except (urllib2.URLError, IOError) as e:
+                    ok = False
+                    core.callLater(log.info, "Prefetch of %s refused by %s: %s",
+                                   content, peer, e)
+                core.callLater(self._ordered, peer, content, url, ok)
+            for peer in peers:
+                try:
+                    f = urllib2.urlopen('http://%s/_prefetch' % (peer,),
+                                        timeout = 5)
+                    try:
+                        status = json.load(f)
+                    finally:
+                        f.close()
+                except (urllib2.URLError, IOError, ValueError):
+                    continue
+                core.callLater(self._status, peer, status.get('done', ()),
+                               status.get('failed', ()))
+        finally:
+            core.callLater(self._finished)
+
+    def _finished (self):
+        self.running = False
+
+    def _ordered (self, peer, content, url, ok):
+        if ok:
+            self.owner.metrics.count('prefetch_ordered')
+            log.info("%s prefetching %s from %s", peer, content, url)
+        else:
+            self.owner.metrics.count('prefetch_failed')
+            self.placement.finished(peer, content, False)
+
+    def _status (self, peer, done, failed):
+        for content in done:
+            content = _name(content)
+            if (peer, content) in self.placement.active:
+                self.placement.finished(peer, content, True)
+                self.owner.metrics.count('prefetch_done')
+                log.info("%s prefetched %s", peer, content)
+        for content in failed:
+            content = _name(content)
+            if (peer, content) in self.placement.active:
+                self.placement.finished(peer, content, False)
+                self.owner.metrics.count('prefetch_failed')
@@ -0,0 +1,274 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Profiling of the live controller, toggled from the POX console.
+
+install() adds to the console:
+
+  profile(seconds = 10, mode = 'sample', interval = 0.005, path = None)
+      profiles the event loop, where the handlers of the oracles and of
+      l2_learning run, for seconds seconds (or until profile_stop()), then
+      writes a report to path (profile-<date>-<time>.txt by default)
+  profile_stop()
+      ends the running profile early, and writes its report
+  profile_status()
+      tells whether a profile is running
+
+In 'sample' mode a background thread takes the stack of the event loop every
+interval seconds (with sys._current_frames()): the report lists the functions
+found most often on top of the stack (self) or anywhere in it (total). In
+'cprofile' mode cProfile runs on the event loop thread: call counts and
+times are exact, but every call pays for them. Its raw stats are dumped to
+path + '.prof' too, for pstats or snakeviz.
+
+In both modes the stalls of the event loop are measured with a timer due
+every tick seconds: the delay with which it fires is the time the loop spent
+on something else, mostly handlers. Their histogram and the longest ones are
+in the report; in 'sample' mode, the samples taken while the loop is stalled
+are also counted apart, pointing at what caused the stalls.
+
+Nothing runs on the event loop, and no thread is started, while no profile
+is running.
+"""
+
+from pox.core import core
+from pox.lib.recoco import Timer
+from metrics import Histogram
+import sys
+import os
+import time
+import threading
+import cProfile
+import pstats
+
+log = core.getLogger()
+
+MODES = ('sample', 'cprofile')
+# the loop is stalled when the tick timer is this late (seconds)
+STALL = 0.05
+# lines of the report
+TOP = 40
+LONGEST = 10
+
+
+def _where (key):
+    filename, line, name = key
+    return "%s (%s:%d)" % (name, os.path.basename(filename), line)
+
+
+class Profile (object):
+    def __init__ (self, seconds = 10, mode = 'sample', interval = 0.005,
+                  tick = 0.01, path = None):
+        if mode not in MODES:
+            raise ValueError("mode must be one of %s" % ', '.join(MODES))
+        self.seconds = seconds
+        self.mode = mode
+        self.interval = interval
+        self.tick = tick
+        if path is None:
+            path = time.strftime('profile-%Y%m%d-%H%M%S.txt')
+        self.path = path
+        self.running = False
+        self.started = None
+        self.stopped = None
+        # delays of the tick timer, in microseconds
+        self.stalls = Histogram()
+        # (delay, time) of the longest stalls
+        self.longest = []
+        # sample mode: (file, first line, function) -> samples
+        self.samples = 0
+        self.stalledSamples = 0
+        self.selfCounts = {}
+        self.totalCounts = {}
+        self.stallCounts = {}
+        self.profiler = None
+        self.timer = None
+        self.deadline = None
+
+    def start (self):
+        self.running = True
+        core.callLater(self._begin)
+
+    def stop (self):
+        """ends the profile and writes its report, from any thread"""
+        if self.running:
+            self.running = False
+            core.callLater(self._end)
+
+    def _begin (self):
+        # on the event loop from here
+        self.started = time.time()
+        self.loopThread = threading.current_thread().ident
+        self.lastBeat = self.started
+        if self.mode == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            sampler = threading.Thread(target = self._sample)
+            sampler.daemon = True
+            sampler.start()
+        self._schedule()
+        self.deadline = Timer(self.seconds, self.stop)
+        log.info("Profiling the event loop (%s) for %ss", self.mode,
+                 self.seconds)
+
+    def _schedule (self):
+        self.due = time.time() + self.tick
+        self.timer = Timer(self.tick, self._beat)
+
+    def _beat (self):
+        if not self.running:
+            return
+        now = time.time()
+        late = max(0.0, now - self.due)
+        self.lastBeat = now
+        self.stalls.record(late * 1e6)
+        if late >= STALL:
+            self.longest.append((late, self.due))
+            if len(self.longest) > 2 * LONGEST:
+                self.longest.sort(reverse = True)
+                del self.longest[LONGEST:]
+        self._schedule()
+
+    def _sample (self):
+        while self.running:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self.loopThread)
+            if frame is None:
+                continue
+            stalled = time.time() - self.lastBeat > self.tick + STALL
+            self.samples += 1
+            if stalled:
+                self.stalledSamples += 1
+            seen = set()
+            top = True
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_filename, code.co_firstlineno, code.co_name)
+                if top:
+                    self.selfCounts[key] = self.selfCounts.get(key, 0) + 1
+                    top = False
+                if key not in seen:
+                    seen.add(key)
+                    self.totalCounts[key] = self.totalCounts.get(key, 0) + 1
+                    if stalled:
+                        self.stallCounts[key] = self.stallCounts.get(key, 0) + 1
+                frame = frame.f_back
+
+    def _end (self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        for timer in self.timer, self.deadline:
+            if timer is not None:
+                timer.cancel()
+        self.stopped = time.time()
+        try:
+            with open(self.path, 'w') as f:
+                self.report(f)
+            if self.profiler is not None:
+                self.profiler.dump_stats(self.path + '.prof')
+        except IOError as e:
+            log.error("Cannot write the profile to %s: %s", self.path, e)
+            return
+        log.info("Profile written to %s", self.path)
+
+    def report (self, out):
+        elapsed = (self.stopped or time.time()) - self.started
+        out.write("Profile of the event loop, %s mode, %.1fs from %s\n\n" % (
+                self.mode, elapsed,
+                time.strftime('%Y-%m-%d %H:%M:%S',
+                              time.localtime(self.started))))
+        s = self.stalls.summary()
+        out.write("Stalls (ms, delay of a %gms timer): count %d, mean %.2f, "
+                  "p50 %.2f, p99 %.2f, p999 %.2f, max %.2f\n" % (
+                  self.tick * 1000, s['count'], s['mean'] / 1000.0,
+                  s['p50'] / 1000.0, s['p99'] / 1000.0, s['p999'] / 1000.0,
+                  s['max'] / 1000.0))
+        self.longest.sort(reverse = True)
+        for late, due in self.longest[:LONGEST]:
+            out.write("  %8.1f ms at %s.%03d\n" % (late * 1000,
+                      time.strftime('%H:%M:%S', time.localtime(due)),
+                      int((due - int(due)) * 1000)))
+        out.write("\n")
+        if self.mode == 'cprofile':
+            stats = pstats.Stats(self.profiler, stream = out)
+            stats.sort_stats('tottime').print_stats(TOP)
+            stats.sort_stats('cumulative').print_stats(TOP)
+            return
+        out.write("%d samples every %gms, %d while stalled\n" % (
+                self.samples, self.interval * 1000, self.stalledSamples))
+        if not self.samples:
+            return
+        out.write("%7s %7s %7s  %s\n" % ('self%', 'total%', 'stall%',
+                                         'function'))
+        keys = sorted(self.totalCounts, key = lambda k:
+                      (self.selfCounts.get(k, 0), self.totalCounts[k]),
+                      reverse = True)
+        for key in keys[:TOP]:
+            out.write("%7.1f %7.1f %7.1f  %s\n" % (
+                    100.0 * self.selfCounts.get(key, 0) / self.samples,
+                    100.0 * self.totalCounts[key] / self.samples,
+                    100.0 * self.stallCounts.get(key, 0) / self.samples,
+                    _where(key)))
+        if self.stallCounts:
+            out.write("\nDuring stalls:\n")
+            keys = sorted(self.stallCounts, key = self.stallCounts.get,
+                          reverse = True)
+            for key in keys[:TOP]:
+                out.write("%7.1f  %s\n" % (
+                        100.0 * self.stallCounts[key] / self.stalledSamples,
+                        _where(key)))
+
+
+_current = None
+
+def profile (seconds = 10, mode = 'sample', interval = 0.005, tick = 0.01,
+             path = None):
+    """profiles the event loop for seconds seconds, see profiling.py"""
+    global _current
+    if _current is not None and _current.running:
+        print "Already profiling, profile_stop() first"
+        return
+    _current = Profile(seconds, mode, interval, tick, path)
+    _current.start()
+    print "Profiling for %ss, the report will be in %s" % (seconds,
+                                                          _current.path)
+
+def profile_stop ():
+    """ends the running profile and writes its report"""
+    if _current is None or not _current.running:
+        print "Not profiling"
+        return
+    _current.stop()
+    print "Report in", _current.path
+
+def profile_status ():
+    if _current is None:
+        print "Not profiling"
+    elif _current.running:
+        print "Profiling (%s) for %ss, report in %s" % (_current.mode,
+                _current.seconds, _current.path)
+    else:
+        print "Not profiling, the last report is in", _current.path
+
+def install ():
+    """adds profile(), profile_stop() and profile_status() to the console"""
+    variables = core.Interactive.variables
+    variables['profile'] = profile
+    variables['profile_stop'] = profile_stop
+    variables['profile_status'] = profile_status
+
+def launch ():
+    install()
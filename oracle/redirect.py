@@ -0,0 +1,152 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The redirect and learn logic shared by the oracles, kept free of POX so that
+the simulator can drive it too.
+
+A requester is redirected to a source of the content, never to itself. The
+transfer is then tracked under a (source, destination) key until its flow
+expires (or FlowStatsLearner sees all its bytes go through): the destination
+holds the content from then on, and is learned as a new source.
+
+A MissCache remembers for a few seconds the contents without any source, so
+that the requests for them are sent to the origin without another lookup.
+
+POLICIES are the source selection policies that can run off the event loop
+(see selection.py): functions of (content, requester, sources) returning one
+of sources, the list of the sources of content other than requester.
+"""
+
+import socket
+import struct
+import random
+import time
+
+
+class RedirectTracker (object):
+    def __init__ (self, db):
+        self.db = db
+        # (source, destination) -> content of the redirected transfers; this
+        # is the oracles' tcpFlowsMap
+        self.flows = {}
+
+    def select (self, content, requester):
+        """returns a source for content other than the host requester, or
+        None if there's none"""
+        return self.db.getSource(content, exclude = requester)
+
+    def candidates (self, content, requester):
+        """the sources of content other than the host requester"""
+        return [source for source in self.db.listSources(content)
+                if source.split(':')[0] != requester]
+
+    def track (self, key, content):
+        """remembers that the transfer key is a download of content"""
+        self.flows[key] = content
+
+    def learn (self, key, dest):
+        """the transfer tracked under key has completed: stop tracking it and
+        add dest as a source of its content. returns (content, True if dest
+        is a new source)"""
+        content = self.flows.pop(key)
+        return content, self.db.addSource(content, dest)
+
+    def forget (self, key):
+        """stops tracking key without learning anything from it"""
+        return self.flows.pop(key, None)
+
+
+class _Miss (object):
+    __slots__ = ('expiry', 'version', 'flows')
+
+    def __init__ (self, expiry, version):
+        self.expiry = expiry
+        self.version = version
+        self.flows = []
+
+
+class MissCache (object):
+    """negative cache of the lookups: a content without source is
+    remembered as such for ttl seconds, or until its sources change (as told
+    by OracleDB.version()). The flows sending its requesters to the origin
+    meanwhile are recorded with it, to be removed once it has a source"""
+    def __init__ (self, db, ttl = 5, clock = time.time):
+        self.db = db
+        self.ttl = ttl
+        self.clock = clock
+        # content -> _Miss
+        self.misses = {}
+
+    def missed (self, content):
+        """True if content was found without source less than ttl seconds
+        ago, and hasn't changed since"""
+        miss = self.misses.get(content)
+        return (miss is not None and miss.expiry > self.clock() and
+                miss.version == self.db.version(content))
+
+    def add (self, content, flow = None):
+        """records a miss for content, and the flow (if any) installed for
+        it. returns True if content wasn't known to be missing already"""
+        new = not self.missed(content)
+        if new:
+            old = self.misses.get(content)
+            miss = self.misses[content] = _Miss(self.clock() + self.ttl,
+                                                self.db.version(content))
+            if old is not None and old.version == miss.version:
+                # only expired: its flows are still worth removing later
+                miss.flows = old.flows
+        if flow is not None:
+            self.misses[content].flows.append(flow)
+        return new
+
+    def clear (self, content):
+        """forgets the miss of content, returns its flows"""
+        miss = self.misses.pop(content, None)
+        return miss.flows if miss is not None else []
+
+    def expire (self, idle = None):
+        """forgets the misses expired for idle seconds (by default, ttl), and
+        returns the flows of the contents whose sources changed"""
+        if idle is None:
+            idle = self.ttl
+        limit = self.clock() - idle
+        changed = []
+        for content, miss in self.misses.items():
+            if miss.version != self.db.version(content):
+                changed.extend(self.misses.pop(content).flows)
+            elif miss.expiry < limit:
+                del self.misses[content]
+        return changed
+
+
+def _address (source):
+    return struct.unpack('!I', socket.inet_aton(source.split(':')[0]))[0]
+
+def closestSource (content, requester, sources):
+    """one of the sources sharing the longest IP prefix with requester, e.g.
+    in the same subnet"""
+    target = _address(requester)
+    best = []
+    bestLength = -1
+    for source in sources:
+        length = 32 - (_address(source) ^ target).bit_length()
+        if length > bestLength:
+            best = [source]
+            bestLength = length
+        elif length == bestLength:
+            best.append(source)
+    return random.choice(best)
+
+POLICIES = {'closest': closestSource}
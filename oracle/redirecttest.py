@@ -0,0 +1,85 @@
+"""Unit test for redirect.py"""
+import unittest
+from oracleDB import OracleDB
+from redirect import RedirectTracker, MissCache, closestSource, POLICIES
+
+class Tracker(unittest.TestCase):
+    def setUp(self):
+        self.db = OracleDB()
+        self.db.addSource('c1','10.0.0.2')
+        self.redirects = RedirectTracker(self.db)
+
+    def testLearn(self):
+        """learn should add the destination as a source, once"""
+        self.redirects.track(('10.0.0.2','10.0.0.5'), 'c1')
+        self.assertEqual(self.redirects.learn(('10.0.0.2','10.0.0.5'), '10.0.0.5'), ('c1', True))
+        self.assertEqual(self.redirects.flows, {})
+        self.redirects.track(('10.0.0.2','10.0.0.5'), 'c1')
+        self.assertEqual(self.redirects.learn(('10.0.0.2','10.0.0.5'), '10.0.0.5'), ('c1', False))
+
+    def testSelf(self):
+        """select should never redirect the requester to itself"""
+        self.assertEqual(self.redirects.select('c1', '10.0.0.2'), None)
+        self.assertEqual(self.redirects.select('c1', '10.0.0.5'), '10.0.0.2')
+
+    def testCandidates(self):
+        """candidates should list every source but the requester"""
+        self.db.addSource('c1','10.0.0.5:9002')
+        self.db.addSource('c1','10.0.0.6')
+        self.assertEqual(sorted(self.redirects.candidates('c1', '10.0.0.5')), ['10.0.0.2','10.0.0.6'])
+        self.assertEqual(self.redirects.candidates('c2', '10.0.0.5'), [])
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class Misses(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.db = OracleDB()
+        self.misses = MissCache(self.db, ttl = 5, clock = self.clock)
+
+    def testTTL(self):
+        """a miss should be remembered for ttl seconds"""
+        self.assertTrue(self.misses.add('c1', 'f1'))
+        self.assertFalse(self.misses.add('c1', 'f2'))
+        self.clock.now += 4
+        self.assertTrue(self.misses.missed('c1'))
+        self.clock.now += 2
+        self.assertFalse(self.misses.missed('c1'))
+        self.assertTrue(self.misses.add('c1'))
+        self.assertEqual(self.misses.clear('c1'), ['f1', 'f2'])
+
+    def testLearned(self):
+        """a new source should end the miss and return its flows"""
+        self.misses.add('c1', 'f1')
+        self.misses.add('c2', 'f2')
+        self.db.addSource('c1','10.0.0.2')
+        self.assertFalse(self.misses.missed('c1'))
+        self.assertEqual(self.misses.expire(), ['f1'])
+        self.assertEqual(list(self.misses.misses), ['c2'])
+        self.clock.now += 20
+        self.assertEqual(self.misses.expire(), [])
+        self.assertEqual(self.misses.misses, {})
+
+class Policies(unittest.TestCase):
+    def testClosest(self):
+        """closestSource should pick a source with the longest common prefix"""
+        sources = ['10.1.0.7:9002', '10.0.1.9', '10.0.0.200', '10.0.0.130']
+        self.assertEqual(closestSource('c1', '10.0.0.129', sources), '10.0.0.130')
+        for i in range(20):
+            self.assertTrue(closestSource('c1', '10.0.1.1', sources) in ['10.0.1.9'])
+            self.assertTrue(closestSource('c1', '10.0.2.1', sources) in ['10.0.1.9', '10.0.0.200', '10.0.0.130'])
+        self.assertEqual(closestSource('c1', '10.1.2.3', sources), '10.1.0.7:9002')
+
+    def testPolicies(self):
+        """every policy should pick one of the sources given"""
+        sources = ['10.1.0.7:9002', '10.0.1.9', '10.0.0.200']
+        for name, policy in POLICIES.items():
+            self.assertTrue(policy('c1', '10.0.0.129', sources) in sources, name)
+
+if __name__ == '__main__':
+    unittest.main()
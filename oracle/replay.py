@@ -0,0 +1,460 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Replays traffic through the PacketIn handlers of the oracles, offline.
+
+No controller, switch or Mininet is involved: POX's core is started without
+OpenFlow, a bare OpenFlowNexus is registered in its place, and a
+ReplayConnection stands for a switch, recording every message the components
+send to it. Packets, read from a pcap file or generated (DNS queries or HTTP
+GETs for a synthetic catalog), are turned into PacketIn events and raised
+one at a time, as POX does: first on the nexus (where the oracles listen),
+then on the connection (where LearningSwitch listens) unless halted.
+
+The time spent handling each event is recorded, and the replies can be
+checked: every VoD request must be answered by a single packet-out, holding a
+redirect (or DNS answer) to one of the sources of the content.
+
+POX is only needed as a library, e.g. from a checkout given with --pox:
+
+    python replay.py --pox ~/pox --oracle tcp --requests 100000 --check
+"""
+
+import sys
+import os
+import time
+import json
+import struct
+import random
+import logging
+import argparse
+
+# set by setup(), once POX can be imported
+core = None
+of = None
+pkt = None
+
+# the defaults of the oracles
+VOD_IP = "10.0.0.3"
+DOMAIN = "bogusdomain.com"
+DNS_SERVER = "10.0.0.254"
+
+
+def setup (pox_path = None):
+    """imports POX, starts its core and registers a bare OpenFlowNexus as
+    core.openflow. Must be called before importing the oracles"""
+    global core, of, pkt
+    if pox_path is not None:
+        sys.path.insert(0, os.path.expanduser(pox_path))
+    import pox.core
+    if pox.core.core is None:
+        pox.core.initialize()
+    core = pox.core.core
+    import pox.openflow
+    import pox.openflow.libopenflow_01
+    import pox.lib.packet
+    of = pox.openflow.libopenflow_01
+    pkt = pox.lib.packet
+    if not core.hasComponent('openflow'):
+        core.register('openflow', pox.openflow.OpenFlowNexus())
+    if not core.hasComponent('Interactive'):
+        # DNSOracle adds its functions to the console
+        class Interactive (object):
+            variables = {}
+        core.register('Interactive', Interactive())
+    return core
+
+
+def trySetup (pox_path = None):
+    """setup() for the unit tests of the components: POX is looked for in
+    the POX environment variable, if set, then on the path. Returns the
+    core, or None if POX can't be imported"""
+    if pox_path is None:
+        pox_path = os.environ.get('POX')
+    try:
+        return setup(pox_path)
+    except ImportError:
+        return None
+
+
+def readPcap (path):
+    """yields (timestamp, frame) for each packet of a libpcap file of
+    Ethernet frames"""
+    with open(path, 'rb') as f:
+        header = f.read(24)
+        if len(header) < 24:
+            raise ValueError("%s: not a pcap file" % path)
+        for endian in '<', '>':
+            magic = struct.unpack(endian + 'I', header[:4])[0]
+            if magic in (0xa1b2c3d4, 0xa1b23c4d):
+                break
+        else:
+            raise ValueError("%s: not a pcap file (pcapng is not supported)"
+                             % path)
+        scale = 1e-6 if magic == 0xa1b2c3d4 else 1e-9
+        linktype = struct.unpack(endian + 'I', header[20:24])[0]
+        if linktype != 1:
+            raise ValueError("%s: link type %d, only Ethernet is supported"
+                             % (path, linktype))
+        record = struct.Struct(endian + 'IIII')
+        while True:
+            data = f.read(16)
+            if len(data) < 16:
+                return
+            sec, frac, caplen, length = record.unpack(data)
+            frame = f.read(caplen)
+            if len(frame) < caplen:
+                return
+            yield sec + frac * scale, frame
+
+
+class ReplayConnection (object):
+    """stands for the connection to a switch, and records what is sent to it"""
+
+    def __init__ (self, dpid = 1):
+        from pox.lib.revent import EventMixin
+        import pox.openflow
+        # defined here, as POX can only be imported after setup()
+        class Connection (EventMixin):
+            _eventMixin_events = set([pox.openflow.PacketIn,
+                                      pox.openflow.FlowRemoved,
+                                      pox.openflow.ConnectionUp,
+                                      pox.openflow.FlowStatsReceived])
+        self.events = Connection()
+        self.addListeners = self.events.addListeners
+        self.addListenerByName = self.events.addListenerByName
+        self.raiseEvent = self.events.raiseEvent
+        self.dpid = dpid
+        self.ID = dpid
+        self.connect_time = 0
+        # messages sent since the last call to take(), and totals by type
+        self.sent = []
+        self.counts = {}
+        self.bytes = 0
+        self.pack = True
+
+    def send (self, data):
+        # a real connection packs the messages, so we do too
+        if self.pack and not isinstance(data, bytes):
+            self.bytes += len(data.pack())
+        self.sent.append(data)
+        name = type(data).__name__
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def take (self):
+        sent = self.sent
+        self.sent = []
+        return sent
+
+    def __str__ (self):
+        return "[replay %s]" % self.dpid
+
+
+class Replay (object):
+    """raises PacketIn events for frames on a ReplayConnection, and measures
+    how long the components take to handle them"""
+
+    def __init__ (self, connection, metrics):
+        import pox.openflow
+        self.nexus = core.openflow
+        self.connection = connection
+        self.metrics = metrics
+        self.PacketIn = pox.openflow.PacketIn
+        self.errors = 0
+        # MAC -> switch port, so that each host stays on its own port
+        self.ports = {}
+        self.nexus._connections[connection.dpid] = connection
+
+    def connectionUp (self):
+        import pox.openflow
+        features = of.ofp_features_reply(datapath_id = self.connection.dpid)
+        self.nexus.raiseEvent(pox.openflow.ConnectionUp, self.connection,
+                              features)
+        self.connection.raiseEvent(pox.openflow.ConnectionUp, self.connection,
+                                   features)
+        self.connection.take()
+
+    def portOf (self, frame):
+        src = frame[6:12]
+        port = self.ports.get(src)
+        if port is None:
+            port = self.ports[src] = len(self.ports) + 1
+        return port
+
+    def packetIn (self, frame, port = None):
+        """raises a PacketIn for frame, returns the messages sent in reply"""
+        if port is None:
+            port = self.portOf(frame)
+        msg = of.ofp_packet_in(in_port = port, data = frame,
+                               total_len = len(frame), buffer_id = None,
+                               reason = of.OFPR_NO_MATCH)
+        start = time.time()
+        try:
+            event = self.nexus.raiseEvent(self.PacketIn, self.connection, msg)
+            if event is None or event.halt != True:
+                self.connection.raiseEvent(self.PacketIn, self.connection, msg)
+        except Exception:
+            self.errors += 1
+            if self.errors == 1:
+                logging.getLogger("replay").exception("Error handling PacketIn")
+        self.metrics.record('PacketIn', time.time() - start)
+        return self.connection.take()
+
+
+class Synthetic (object):
+    """builds VoD requests for a catalog of contents, from hosts requesters,
+    each content having sources sources"""
+
+    def __init__ (self, kind, contents = 100, sources = 4, hosts = 50,
+                  seed = None):
+        from pox.lib.addresses import IPAddr, EthAddr
+        self.kind = kind
+        self.random = random.Random(seed)
+        # requesters are 10.1.0.1 onwards, sources 10.0.2.x
+        self.hosts = []
+        for i in range(1, hosts + 1):
+            self.hosts.append((EthAddr("02:00:00:%02x:%02x:%02x" % (i >> 16,
+                                       (i >> 8) & 255, i & 255)),
+                               IPAddr("10.%d.%d.%d" % (1 + (i >> 16),
+                                      (i >> 8) & 255, i & 255))))
+        self.gateway = EthAddr("02:00:00:00:00:fe")
+        self.catalog = {}
+        for c in range(contents):
+            if kind == 'dns':
+                name = "content%d" % c
+                srcs = ["10.0.2.%d" % ((c + s) % 250 + 1) for s in range(sources)]
+            else:
+                name = "content%d.txt" % c
+                srcs = ["10.0.2.%d:9002" % ((c + s) % 250 + 1)
+                        for s in range(sources)]
+            self.catalog[name] = srcs
+        self.names = sorted(self.catalog)
+
+    def seed (self, oracle):
+        """adds the sources of the catalog to the OracleDB of oracle"""
+        for name, srcs in self.catalog.items():
+            for source in srcs:
+                oracle.oracle.addSource(name, source)
+
+    def request (self, n):
+        """returns (frame, host IP, content) of the n-th request"""
+        mac, ip = self.hosts[self.random.randrange(len(self.hosts))]
+        content = self.names[self.random.randrange(len(self.names))]
+        eth = pkt.ethernet(src = mac, dst = self.gateway,
+                           type = pkt.ethernet.IP_TYPE)
+        ipp = pkt.ipv4(srcip = ip)
+        if self.kind == 'dns':
+            query = pkt.dns()
+            query.id = n & 0xffff
+            query.rd = True
+            query.questions.append(pkt.dns.question(content + '.' + DOMAIN,
+                                                    1, 1))
+            l4 = pkt.udp()
+            l4.srcport = 1024 + n % 60000
+            l4.dstport = 53
+            l4.set_payload(query)
+            ipp.dstip = _ip(DNS_SERVER)
+            ipp.protocol = pkt.ipv4.UDP_PROTOCOL
+        else:
+            l4 = pkt.tcp()
+            l4.srcport = 1024 + n % 60000
+            l4.dstport = 80
+            l4.seq = n
+            l4.ack = 1
+            l4.off = 5
+            l4.win = 29200
+            l4.ACK = True
+            l4.PSH = True
+            l4.set_payload("GET %s HTTP/1.1\r\nHost: %s\r\n\r\n"
+                           % (content, DOMAIN))
+            ipp.dstip = _ip(VOD_IP)
+            ipp.protocol = pkt.ipv4.TCP_PROTOCOL
+        ipp.set_payload(l4)
+        eth.set_payload(ipp)
+        return eth.pack(), ip, content
+
+    def background (self, n):
+        """returns a frame of plain TCP traffic between two hosts"""
+        (smac, sip), (dmac, dip) = self.random.sample(self.hosts, 2)
+        l4 = pkt.tcp()
+        l4.srcport = 1024 + n % 60000
+        l4.dstport = 5001
+        l4.off = 5
+        l4.ACK = True
+        l4.set_payload('x' * 64)
+        ipp = pkt.ipv4(srcip = sip, dstip = dip,
+                       protocol = pkt.ipv4.TCP_PROTOCOL)
+        ipp.set_payload(l4)
+        eth = pkt.ethernet(src = smac, dst = dmac, type = pkt.ethernet.IP_TYPE)
+        eth.set_payload(ipp)
+        return eth.pack(), None, None
+
+    def check (self, sent, host, content):
+        """returns None if sent holds a valid redirect of host to a source of
+        content, or what is wrong with it"""
+        outs = [m for m in sent if isinstance(m, of.ofp_packet_out) and m.data]
+        replies = []
+        for m in outs:
+            frame = pkt.ethernet(m.data)
+            ipp = frame.find('ipv4')
+            if ipp is None or ipp.dstip != host:
+                continue
+            if self.kind == 'dns':
+                d = frame.find('dns')
+                if d is not None and d.qr:
+                    replies.extend(str(a.rddata) for a in d.answers)
+            else:
+                t = frame.find('tcp')
+                payload = t.payload if t is not None else None
+                if isinstance(payload, bytes) and payload.startswith("HTTP/1.1 307"):
+                    for line in payload.splitlines():
+                        if line.lower().startswith('location:'):
+                            replies.append(line.split(':', 1)[1].strip())
+        if len(replies) != 1:
+            return "%d replies for %s from %s" % (len(replies), content, host)
+        if replies[0] not in self.catalog[content]:
+            return "%s is not a source of %s" % (replies[0], content)
+        return None
+
+
+def _ip (s):
+    from pox.lib.addresses import IPAddr
+    return IPAddr(s)
+
+
+def build (kind, stages = False):
+    """creates the components for kind ('tcp', 'dns' or 'l2'), as they would
+    be launched together with l2_learning. Returns the oracle, or None"""
+    import l2_learning
+    from metrics import Metrics
+    oracle = None
+    metrics = Metrics(kind + "_oracle") if stages else None
+    if kind == 'tcp':
+        import tcp_oracle
+        oracle = tcp_oracle.TCPOracle(True, None, metrics)
+    elif kind == 'dns':
+        import dns_oracle
+        oracle = dns_oracle.DNSOracle(True, None, metrics)
+    l2_learning.l2_learning(False)
+    return oracle
+
+
+def run (args):
+    from metrics import Metrics
+    import metrics as oracle_metrics
+    setup(args.pox)
+    oracle = build(args.oracle, args.stages)
+    connection = ReplayConnection()
+    connection.pack = not args.no_pack
+    stats = Metrics("replay")
+    replay = Replay(connection, stats)
+    replay.connectionUp()
+    synthetic = None
+    if args.pcap is None:
+        synthetic = Synthetic('dns' if args.oracle == 'dns' else 'tcp',
+                              args.contents, args.sources, args.hosts,
+                              args.seed)
+        if oracle is not None:
+            synthetic.seed(oracle)
+        # build the packets beforehand, we only want to time the handlers
+        frames = []
+        for n in range(args.requests):
+            if args.oracle == 'l2' or synthetic.random.random() < args.background:
+                frames.append(synthetic.background(n))
+            else:
+                frames.append(synthetic.request(n))
+    else:
+        frames = [(frame, None, None) for ts, frame in readPcap(args.pcap)]
+    failures = 0
+    examples = []
+    start = time.time()
+    for i in range(args.loop):
+        for frame, host, content in frames:
+            sent = replay.packetIn(frame)
+            if args.check and content is not None:
+                problem = synthetic.check(sent, host, content)
+                if problem is not None:
+                    failures += 1
+                    if len(examples) < 5:
+                        examples.append(problem)
+    elapsed = time.time() - start
+    events = len(frames) * args.loop
+    result = {'oracle': args.oracle,
+              'events': events,
+              'elapsed': elapsed,
+              'events_per_second': events / elapsed if elapsed else 0,
+              'errors': replay.errors,
+              'sent': dict(connection.counts),
+              'sent_bytes': connection.bytes,
+              'latency_us': stats.snapshot()['latency_us'].get('PacketIn')}
+    if args.check:
+        result['check_failures'] = failures
+        result['check_examples'] = examples
+    if args.stages and oracle is not None:
+        result['stages'] = oracle.metrics.snapshot()
+    print "%d events in %.3fs: %.0f events/s, %d errors" % (events, elapsed,
+            result['events_per_second'], replay.errors)
+    print "sent:", ', '.join("%s %d" % item for item in sorted(connection.counts.items()))
+    print stats.report()
+    if args.stages and oracle is not None:
+        print oracle.metrics.report()
+    if args.check:
+        print "check failures: %d" % failures
+        for problem in examples:
+            print "  " + problem
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent = 2, sort_keys = True)
+    return result
+
+
+def main (argv = None):
+    parser = argparse.ArgumentParser(description = "Replays PacketIn events "
+                                     "through the oracles, without a network")
+    parser.add_argument('--pox', help = "path of a POX checkout")
+    parser.add_argument('--oracle', choices = ['tcp', 'dns', 'l2'],
+                        default = 'tcp', help = "components to load, "
+                        "l2_learning being always loaded")
+    parser.add_argument('--pcap', help = "replay the frames of this file "
+                        "rather than synthetic traffic")
+    parser.add_argument('--requests', type = int, default = 10000,
+                        help = "number of synthetic packets")
+    parser.add_argument('--contents', type = int, default = 100)
+    parser.add_argument('--sources', type = int, default = 4,
+                        help = "sources of each content")
+    parser.add_argument('--hosts', type = int, default = 50,
+                        help = "number of requesters")
+    parser.add_argument('--background', type = float, default = 0.0,
+                        help = "fraction of non-VoD packets")
+    parser.add_argument('--loop', type = int, default = 1,
+                        help = "replay the packets this many times")
+    parser.add_argument('--seed', type = int, default = 1)
+    parser.add_argument('--check', action = 'store_true',
+                        help = "check the reply to each synthetic request")
+    parser.add_argument('--stages', action = 'store_true',
+                        help = "also report the oracle's own stage timers")
+    parser.add_argument('--no-pack', action = 'store_true',
+                        help = "don't pack the messages sent to the switch")
+    parser.add_argument('--log-level', default = 'WARNING')
+    parser.add_argument('--json', help = "write the results to this file")
+    args = parser.parse_args(argv)
+    if args.check and args.pcap is not None:
+        parser.error("--check only applies to synthetic traffic")
+    logging.basicConfig(level = getattr(logging, args.log_level.upper()))
+    return run(args)
+
+
+if __name__ == '__main__':
+    main()
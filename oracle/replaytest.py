@@ -0,0 +1,53 @@
+"""Unit test for the parts of replay.py that don't need POX"""
+import os
+import struct
+import tempfile
+import unittest
+from replay import readPcap
+
+def writePcap(path, frames, endian = '<', magic = 0xa1b2c3d4, linktype = 1):
+    with open(path, 'wb') as f:
+        f.write(struct.pack(endian + 'IHHiIII', magic, 2, 4, 0, 0, 65535,
+                            linktype))
+        for ts, frac, frame in frames:
+            f.write(struct.pack(endian + 'IIII', ts, frac, len(frame),
+                                len(frame)))
+            f.write(frame)
+
+class ReadPcap (unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix = '.pcap')
+        os.close(fd)
+        self.frames = [(100, 250000, 'a' * 60), (101, 0, 'b' * 1514)]
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def testLittleEndian(self):
+        """frames and timestamps should be read back in order"""
+        writePcap(self.path, self.frames)
+        self.assertEqual(list(readPcap(self.path)),
+                         [(100.25, 'a' * 60), (101.0, 'b' * 1514)])
+
+    def testBigEndianNanoseconds(self):
+        """big endian files with nanosecond timestamps should be supported"""
+        writePcap(self.path, [(5, 500000000, 'c' * 42)], '>', 0xa1b23c4d)
+        self.assertEqual(list(readPcap(self.path)), [(5.5, 'c' * 42)])
+
+    def testTruncated(self):
+        """a truncated last record should be ignored"""
+        writePcap(self.path, self.frames)
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 10)
+        self.assertEqual(len(list(readPcap(self.path))), 1)
+
+    def testWrongFormat(self):
+        """non-Ethernet captures and other files should be refused"""
+        writePcap(self.path, self.frames, linktype = 101)
+        self.assertRaises(ValueError, list, readPcap(self.path))
+        with open(self.path, 'wb') as f:
+            f.write('\x0a\x0d\x0d\x0a' + '\0' * 40)
+        self.assertRaises(ValueError, list, readPcap(self.path))
+
+if __name__ == '__main__':
+    unittest.main()
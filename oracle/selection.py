@@ -0,0 +1,132 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Source selection off the event loop, for policies too slow to run inline in
+_handle_PacketIn.
+
+The candidate sources of a request are handed to the policy (one of
+redirect.POLICIES) on a pool of worker threads, or of processes if the policy
+is CPU bound: with threads it still competes with the event loop for the GIL.
+The oracle's callback is called back on the event loop with the chosen
+source, or with a random candidate if the policy doesn't answer within the
+deadline (or fails); a late answer is then dropped.
+"""
+
+from pox.core import core
+from pox.lib.recoco import Timer
+from multiprocessing.pool import Pool, ThreadPool
+from redirect import POLICIES
+from metrics import NullMetrics
+import time
+import random
+
+log = core.getLogger()
+
+
+def _run (policy, content, requester, sources):
+    # in the pool: a failure is answered with None rather than never
+    try:
+        return policy(content, requester, sources)
+    except Exception:
+        log.exception("Source selection failed for %s", content)
+        return None
+
+
+class _Pending (object):
+    __slots__ = ('callback', 'sources', 'start', 'timer', 'done')
+
+    def __init__ (self, callback, sources):
+        self.callback = callback
+        self.sources = sources
+        self.start = time.time()
+        self.timer = None
+        self.done = False
+
+
+class DeferredSelector (object):
+    def __init__ (self, redirects, policy, workers = 4, processes = False,
+                  deadline = 0.05, metrics = None):
+        self.redirects = redirects
+        self.policy = policy
+        self.deadline = deadline
+        if metrics is None:
+            metrics = NullMetrics()
+        self.metrics = metrics
+        if processes:
+            self.pool = Pool(workers)
+        else:
+            self.pool = ThreadPool(workers)
+        self.pending = 0
+        self.metrics.gauge('selecting', lambda: self.pending)
+
+    def select (self, content, requester, callback):
+        """calls callback(source) on the event loop once a source for content
+        other than requester is chosen, maybe right away. returns False, and
+        doesn't call callback, if there's no such source"""
+        sources = self.redirects.candidates(content, requester)
+        if not sources:
+            return False
+        if len(sources) == 1:
+            callback(sources[0])
+            return True
+        pending = _Pending(callback, sources)
+        pending.timer = Timer(self.deadline, self._expire, args = (pending,))
+        self.pending += 1
+        self.pool.apply_async(_run, (self.policy, content, requester, sources),
+                              callback = lambda source:
+                              core.callLater(self._deliver, pending, source))
+        return True
+
+    def _finish (self, pending, source):
+        pending.done = True
+        self.pending -= 1
+        self.metrics.record('select', time.time() - pending.start)
+        pending.callback(source)
+
+    def _deliver (self, pending, source):
+        if pending.done:
+            self.metrics.count('select_late')
+            return
+        pending.timer.cancel()
+        if source not in pending.sources:
+            self.metrics.count('select_failed')
+            source = random.choice(pending.sources)
+        self._finish(pending, source)
+
+    def _expire (self, pending):
+        if pending.done:
+            return
+        self.metrics.count('select_deadline')
+        self._finish(pending, random.choice(pending.sources))
+
+    def close (self):
+        self.pool.terminate()
+
+
+def build (redirects, policy = None, workers = 4, processes = False,
+           deadline = 0.05, metrics = None):
+    """Creates a DeferredSelector from (string) launch() arguments, or
+    returns None if no policy was specified"""
+    if policy is None:
+        return None
+    if policy not in POLICIES:
+        raise RuntimeError("Unknown selection policy %s, use one of: %s"
+                           % (policy, ', '.join(sorted(POLICIES))))
+    try:
+        return DeferredSelector(redirects, POLICIES[policy], int(str(workers)),
+                                str(processes).lower() in ('true', '1', 'yes'),
+                                float(str(deadline)), metrics)
+    except ValueError as e:
+        raise RuntimeError("Invalid selection parameters: %s" % (e,))
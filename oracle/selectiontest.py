@@ -0,0 +1,136 @@
+"""Unit test for selection.py. Needs POX, found on the path or in the POX
+environment variable (e.g. POX=~/pox)"""
+import threading
+import time
+import unittest
+import replay
+from oracleDB import OracleDB
+from redirect import RedirectTracker, closestSource
+from metrics import Metrics
+
+core = replay.trySetup()
+if core is not None:
+    import selection
+    from selection import DeferredSelector
+
+class FakeTimer(object):
+    """stands for POX's Timer: fired by the test rather than by the clock"""
+    started = []
+
+    def __init__(self, interval, callback, args = ()):
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        FakeTimer.started.append(self)
+
+    def fire(self):
+        if not self.cancelled:
+            self.callback(*self.args)
+
+    def cancel(self):
+        self.cancelled = True
+
+class Loop(object):
+    """stands for POX's event loop: runs what is called later when asked to"""
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def callLater(self, func, *args):
+        with self.lock:
+            self.calls.append((func, args))
+
+    def run(self, count = 1, timeout = 5):
+        """waits for count calls, then makes them"""
+        deadline = time.time() + timeout
+        while len(self.calls) < count and time.time() < deadline:
+            time.sleep(0.01)
+        with self.lock:
+            calls, self.calls = self.calls, []
+        for func, args in calls:
+            func(*args)
+        return len(calls)
+
+def first(content, requester, sources):
+    return sources[0]
+
+def failing(content, requester, sources):
+    raise ValueError("no luck")
+
+@unittest.skipIf(core is None, "POX can't be imported")
+class Selector(unittest.TestCase):
+    def setUp(self):
+        self.db = OracleDB()
+        for source in '10.0.0.2', '10.0.1.3', '10.1.0.4':
+            self.db.addSource('c1', source)
+        self.db.addSource('c2', '10.0.0.2')
+        self.loop = Loop()
+        self.core, selection.core = selection.core, self.loop
+        self.timer, selection.Timer = selection.Timer, FakeTimer
+        FakeTimer.started = []
+        self.metrics = Metrics('selectiontest')
+        self.selected = []
+        self.selector = None
+
+    def tearDown(self):
+        selection.core = self.core
+        selection.Timer = self.timer
+        if self.selector is not None:
+            self.selector.close()
+
+    def select(self, policy, content = 'c1', processes = False):
+        if self.selector is None:
+            self.selector = DeferredSelector(RedirectTracker(self.db), policy,
+                                             workers = 1, processes = processes,
+                                             metrics = self.metrics)
+        return self.selector.select(content, '10.0.0.9', self.selected.append)
+
+    def testSingleSource(self):
+        """a single candidate should be answered right away, without a deadline"""
+        self.assertTrue(self.select(first, 'c2'))
+        self.assertEqual(self.selected, ['10.0.0.2'])
+        self.assertEqual(FakeTimer.started, [])
+        self.assertFalse(self.select(first, 'c3'))
+
+    def testDeliver(self):
+        """the choice of the policy should be called back on the event loop"""
+        self.assertTrue(self.select(closestSource))
+        self.assertEqual(self.selected, [])
+        self.assertEqual(self.loop.run(), 1)
+        self.assertEqual(self.selected, ['10.0.0.2'])
+        self.assertTrue(FakeTimer.started[0].cancelled)
+        self.assertEqual(self.selector.pending, 0)
+
+    def testDeadline(self):
+        """past the deadline, a random candidate should be picked and the late answer dropped"""
+        release = threading.Event()
+        def slow(content, requester, sources):
+            release.wait(5)
+            return sources[0]
+        self.select(slow)
+        FakeTimer.started[0].fire()
+        self.assertEqual(len(self.selected), 1)
+        self.assertTrue(self.selected[0] in self.db.listSources('c1'))
+        release.set()
+        self.assertEqual(self.loop.run(), 1)
+        self.assertEqual(len(self.selected), 1)
+        self.assertEqual(self.metrics.counters.get('select_deadline'), 1)
+        self.assertEqual(self.metrics.counters.get('select_late'), 1)
+
+    def testFailed(self):
+        """a failing policy should be answered with a random candidate"""
+        self.select(failing)
+        self.assertEqual(self.loop.run(), 1)
+        self.assertEqual(len(self.selected), 1)
+        self.assertEqual(self.metrics.counters.get('select_failed'), 1)
+
+    def testProcesses(self):
+        """the policy and the candidates should go through a process pool"""
+        self.select(closestSource, processes = True)
+        self.assertEqual(self.loop.run(), 1)
+        self.assertEqual(self.selected, ['10.0.0.2'])
+        self.assertEqual(self.metrics.counters.get('select_failed'), None)
+
+if __name__ == '__main__':
+    unittest.main()
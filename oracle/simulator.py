@@ -0,0 +1,613 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Discrete-event simulation of a swarm of peers downloading from each other
+through the oracle, to tune source selection and expiry without a testbed.
+
+It drives the real OracleDB and RedirectTracker, the redirect and learn
+logic of the oracles: each request is redirected to a source picked by a
+policy, the transfer is tracked under its (source, destination) key, and the
+destination is learned as a new source when the flow expires, idle_timeout
+seconds after its last byte, as in the oracles' _handle_FlowRemoved.
+
+The model:
+  - peers are spread uniformly over regions (e.g. ISPs), a redirect is local
+    when the source is in the region of the requester. The origin server is
+    a source of every content, in no region. Sources are named by their IP
+    alone, as in the DNS oracle
+  - each peer has an uplink drawn from uplinks (Mbit/s) and a common
+    downlink. A transfer gets min(downlink, uplink / uploads) of its source,
+    as computed when it starts: it isn't sped up when others complete
+  - peers come and go, with exponentially distributed online and offline
+    times, and keep their cache of the last cache_size contents meanwhile
+  - requests arrive as a Poisson process, with a daily profile peaking at
+    21:00 (diurnal is the amplitude of the variations), from random online
+    peers for contents of Zipf-distributed popularity
+  - a redirect to a source that is offline fails after connect_timeout, to
+    one that doesn't hold the content any more after rtt. The request is
+    redirected again, retries times at most, then downloads from the origin
+    directly. Transfers interrupted by their source leaving are redirected
+    again too, the ones of a requester leaving are abandoned
+  - with announce, peers announce their holdings as the ContentAnnouncer
+    does, and are expired expiry seconds after leaving. Otherwise the oracle
+    only learns from the flows, and never forgets a source
+  - with the 'flows' learner, every redirected flow that expires is learned,
+    interrupted ones included. With 'stats', only complete transfers are,
+    stats_interval seconds after their last byte, as with FlowStatsLearner
+
+Only the requests arriving after warmup seconds are accounted for.
+
+    python simulator.py --peers 100000 --rate 20 --policy local --json out.json
+"""
+
+import sys
+import json
+import math
+import time
+import heapq
+import bisect
+import random
+import argparse
+import itertools
+from oracleDB import OracleDB
+from redirect import RedirectTracker
+from metrics import Histogram
+
+# bytes per second in a Mbit/s
+MBIT = 125000.0
+DAY = 86400.0
+
+# event kinds
+ARRIVAL, ATTEMPT, DONE, LEARN, LEAVE, JOIN, EXPIRE = range(7)
+
+
+class Peer (object):
+    __slots__ = ('name', 'region', 'uplink', 'downlink', 'online', 'index',
+                 'session', 'cache', 'pending', 'transfers', 'uploads',
+                 'uploaded')
+
+    def __init__ (self, name, region, uplink, downlink):
+        self.name = name
+        self.region = region
+        # bytes per second
+        self.uplink = uplink
+        self.downlink = downlink
+        self.online = False
+        # position in Simulator.online
+        self.index = None
+        # incremented when the peer leaves, to ignore stale expiries
+        self.session = 0
+        # content -> time of its last use
+        self.cache = {}
+        # content -> Request being downloaded
+        self.pending = {}
+        # serial -> Transfer being uploaded
+        self.transfers = {}
+        self.uploads = 0
+        self.uploaded = 0
+
+
+class Request (object):
+    __slots__ = ('peer', 'content', 'start', 'attempts', 'transfer', 'done',
+                 'counted')
+
+    def __init__ (self, peer, content, start, counted):
+        self.peer = peer
+        self.content = content
+        self.start = start
+        self.attempts = 0
+        self.transfer = None
+        self.done = False
+        self.counted = counted
+
+
+class Transfer (object):
+    __slots__ = ('serial', 'request', 'source', 'key', 'aborted')
+
+    def __init__ (self, serial, request, source, key):
+        # to go through the transfers of a peer in a reproducible order
+        self.serial = serial
+        self.request = request
+        self.source = source
+        # tracked (source, destination), None for direct downloads
+        self.key = key
+        self.aborted = False
+
+
+def randomPolicy (sim, content, peer):
+    """any source, as the oracles do"""
+    return sim.redirects.select(content, peer.name)
+
+def localPolicy (sim, content, peer, samples = 8):
+    """a source in the region of peer, among a few random ones"""
+    first = None
+    for i in range(samples):
+        source = sim.redirects.select(content, peer.name)
+        if source is None:
+            return None
+        if sim.peers[source].region == peer.region:
+            return source
+        if first is None:
+            first = source
+    return first
+
+def leastLoadedPolicy (sim, content, peer):
+    """the better of two random sources, by the share of their uplink a new
+    transfer would get"""
+    first = sim.redirects.select(content, peer.name)
+    if first is None:
+        return None
+    second = sim.redirects.select(content, peer.name)
+    a = sim.peers[first]
+    b = sim.peers[second]
+    if b.uplink / (b.uploads + 1) > a.uplink / (a.uploads + 1):
+        return second
+    return first
+
+POLICIES = {'random': randomPolicy, 'local': localPolicy,
+            'least-loaded': leastLoadedPolicy}
+
+
+def percentile (values, q):
+    """nearest-rank percentile of the sorted list values"""
+    if not values:
+        return 0
+    rank = int(q * len(values) + 0.5)
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+class Simulator (object):
+    def __init__ (self, peers = 10000, regions = 20, contents = 1000,
+                  zipf = 0.8, size = 100.0, rate = 5.0, diurnal = 0.5,
+                  duration = DAY, warmup = 3600, session = 3600,
+                  offline = 7200, cache_size = 20, prefill = 0,
+                  uplinks = (1, 4, 16), downlink = 50, origin = 10000,
+                  policy = 'random', idle_timeout = 10, connect_timeout = 3,
+                  rtt = 0.1, retries = 3, announce = True, expiry = 15,
+                  learner = 'flows', stats_interval = 2, seed = 1):
+        self.random = random.Random(seed)
+        # OracleDB uses the random module
+        random.seed(seed)
+        self.db = OracleDB()
+        self.redirects = RedirectTracker(self.db)
+        self.policy = POLICIES[policy]
+        self.rate = rate
+        self.diurnal = diurnal
+        self.duration = duration
+        self.warmup = warmup
+        self.session = session
+        self.offline = offline
+        self.cache_size = cache_size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.rtt = rtt
+        self.retries = retries
+        self.announce = announce
+        self.expiry = expiry
+        self.learner = learner
+        self.stats_interval = stats_interval
+        self.now = 0.0
+        self.queue = []
+        self.seq = itertools.count()
+        self.stats = dict.fromkeys(['requests', 'cache_hits', 'duplicates',
+                'completed', 'abandoned', 'redirects', 'local_redirects',
+                'origin_redirects', 'misses', 'failures', 'interrupted',
+                'direct', 'learned', 'learned_stale', 'bytes', 'local_bytes',
+                'origin_bytes', 'max_uploads'], 0)
+        self.completion = Histogram()
+        self.events = 0
+        self.handlers = [self.arrival, self.attempt, self.done, self.learn,
+                         self.leave, self.join, self.expire]
+
+        # contents, most popular first, with sizes around size MB
+        self.contents = ["content%d.txt" % i for i in range(contents)]
+        self.sizes = dict((c, int(size * 1e6 * math.exp(
+                self.random.gauss(0, 0.5)))) for c in self.contents)
+        self.cumulative = []
+        total = 0.0
+        for i in range(contents):
+            total += 1.0 / (i + 1) ** zipf
+            self.cumulative.append(total)
+
+        self.peers = {}
+        self.online = []
+        self.origin = Peer("10.0.0.2", None, origin * MBIT, downlink * MBIT)
+        self.peers[self.origin.name] = self.origin
+        self.origin.online = True
+        for c in self.contents:
+            self.origin.cache[c] = 0.0
+            self.db.addSource(c, self.origin.name)
+        up = session / float(session + offline)
+        for i in range(peers):
+            n = i + 256
+            peer = Peer("10.%d.%d.%d" % ((n >> 16) & 255, (n >> 8) & 255,
+                                         n & 255),
+                        self.random.randrange(regions),
+                        self.random.choice(uplinks) * MBIT, downlink * MBIT)
+            self.peers[peer.name] = peer
+            for j in range(prefill):
+                peer.cache[self.popular()] = 0.0
+            if self.random.random() < up:
+                self.join(peer)
+            else:
+                self.schedule(self.random.expovariate(1.0 / offline), JOIN,
+                              peer)
+        self.nextArrival()
+
+
+    def schedule (self, delay, kind, obj):
+        heapq.heappush(self.queue, (self.now + delay, next(self.seq), kind,
+                                    obj))
+
+    def popular (self):
+        x = self.random.random() * self.cumulative[-1]
+        return self.contents[min(bisect.bisect_right(self.cumulative, x),
+                                 len(self.contents) - 1)]
+
+    def rateAt (self, t):
+        return self.rate * (1 + self.diurnal *
+                            math.cos(2 * math.pi * (t - 21 * 3600) / DAY))
+
+    def nextArrival (self):
+        # thinning of a Poisson process at the peak rate
+        peak = self.rate * (1 + abs(self.diurnal))
+        t = self.now
+        while True:
+            t += self.random.expovariate(peak)
+            if self.random.random() * peak <= self.rateAt(t):
+                break
+        self.schedule(t - self.now, ARRIVAL, None)
+
+    def run (self):
+        queue = self.queue
+        pop = heapq.heappop
+        handlers = self.handlers
+        started = time.time()
+        while queue:
+            t, seq, kind, obj = pop(queue)
+            if t > self.duration:
+                break
+            self.now = t
+            self.events += 1
+            handlers[kind](obj)
+        self.wall = time.time() - started
+        return self.summary()
+
+    # requests and transfers
+
+    def count (self, request, name):
+        if request.counted:
+            self.stats[name] += 1
+
+    def arrival (self, unused):
+        self.nextArrival()
+        if not self.online:
+            return
+        peer = self.online[int(self.random.random() * len(self.online))]
+        content = self.popular()
+        counted = self.now >= self.warmup
+        stats = self.stats
+        if counted:
+            stats['requests'] += 1
+        if content in peer.cache:
+            peer.cache[content] = self.now
+            if counted:
+                stats['cache_hits'] += 1
+            return
+        if content in peer.pending:
+            if counted:
+                stats['duplicates'] += 1
+            return
+        request = Request(peer, content, self.now, counted)
+        peer.pending[content] = request
+        self.attempt(request)
+
+    def attempt (self, request):
+        if request.done:
+            # abandoned while waiting to retry
+            return
+        peer = request.peer
+        content = request.content
+        source = None
+        if request.attempts < self.retries:
+            source = self.policy(self, content, peer)
+            if source is None:
+                # only the requester itself was listed
+                self.count(request, 'misses')
+        request.attempts += 1
+        if source is None:
+            source = self.origin.name
+            key = None
+            self.count(request, 'direct')
+        else:
+            key = (source, peer.name)
+            self.redirects.track(key, content)
+            self.count(request, 'redirects')
+            if source == self.origin.name:
+                self.count(request, 'origin_redirects')
+            elif self.peers[source].region == peer.region:
+                self.count(request, 'local_redirects')
+        src = self.peers[source]
+        if not src.online or content not in src.cache:
+            # stale source: nothing comes back, and the flow never expires
+            self.count(request, 'failures')
+            self.schedule(self.connect_timeout if not src.online else self.rtt,
+                          ATTEMPT, request)
+            return
+        transfer = Transfer(next(self.seq), request, src, key)
+        request.transfer = transfer
+        src.cache[content] = self.now
+        src.transfers[transfer.serial] = transfer
+        src.uploads += 1
+        if src.uploads > self.stats['max_uploads'] and src is not self.origin:
+            self.stats['max_uploads'] = src.uploads
+        rate = min(peer.downlink, src.uplink / src.uploads)
+        self.schedule(self.sizes[content] / rate, DONE, transfer)
+
+    def done (self, transfer):
+        if transfer.aborted:
+            return
+        src = transfer.source
+        request = transfer.request
+        peer = request.peer
+        content = request.content
+        src.uploads -= 1
+        del src.transfers[transfer.serial]
+        request.done = True
+        del peer.pending[content]
+        self.store(peer, content)
+        if request.counted:
+            size = self.sizes[content]
+            stats = self.stats
+            stats['completed'] += 1
+            stats['bytes'] += size
+            src.uploaded += size
+            if src is self.origin:
+                stats['origin_bytes'] += size
+            elif src.region == peer.region:
+                stats['local_bytes'] += size
+            self.completion.record((self.now - request.start) * 1000)
+        if transfer.key is not None:
+            if self.learner == 'stats':
+                self.schedule(self.stats_interval, LEARN, transfer)
+            else:
+                self.schedule(self.idle_timeout, LEARN, transfer)
+
+    def abort (self, transfer):
+        transfer.aborted = True
+        src = transfer.source
+        src.uploads -= 1
+        del src.transfers[transfer.serial]
+        if transfer.key is None:
+            return
+        if self.learner == 'stats':
+            # the learner saw the flow stall
+            self.redirects.forget(transfer.key)
+        else:
+            # the flow expires all the same, and is learned
+            self.schedule(self.idle_timeout, LEARN, transfer)
+
+    def learn (self, transfer):
+        key = transfer.key
+        if key not in self.redirects.flows:
+            return
+        content, added = self.redirects.learn(key, key[1])
+        if added and self.now >= self.warmup:
+            self.stats['learned'] += 1
+            if content not in self.peers[key[1]].cache:
+                self.stats['learned_stale'] += 1
+
+    def store (self, peer, content):
+        cache = peer.cache
+        if len(cache) >= self.cache_size:
+            # least recently used
+            old = min(cache, key = cache.get)
+            del cache[old]
+            if self.announce and self.db.hasSource(old, peer.name):
+                self.db.removeSource(old, peer.name)
+        cache[content] = self.now
+        if self.announce:
+            self.db.addSource(content, peer.name)
+
+    # churn
+
+    def join (self, peer):
+        peer.online = True
+        peer.index = len(self.online)
+        self.online.append(peer)
+        if self.announce:
+            self.db.addSources(list(peer.cache), peer.name)
+        self.schedule(self.random.expovariate(1.0 / self.session), LEAVE, peer)
+
+    def leave (self, peer):
+        peer.online = False
+        last = self.online.pop()
+        if last is not peer:
+            self.online[peer.index] = last
+            last.index = peer.index
+        peer.index = None
+        peer.session += 1
+        for serial in sorted(peer.transfers):
+            transfer = peer.transfers[serial]
+            # the requester notices right away, and asks for another source
+            self.abort(transfer)
+            request = transfer.request
+            self.count(request, 'interrupted')
+            self.schedule(self.rtt, ATTEMPT, request)
+        for request in peer.pending.values():
+            request.done = True
+            if request.transfer is not None and not request.transfer.aborted:
+                self.abort(request.transfer)
+            self.count(request, 'abandoned')
+        peer.pending = {}
+        self.schedule(self.random.expovariate(1.0 / self.offline), JOIN, peer)
+        if self.announce:
+            self.schedule(self.expiry, EXPIRE, (peer, peer.session))
+
+    def expire (self, item):
+        peer, session = item
+        if peer.session == session and not peer.online:
+            self.db.removeSources(list(peer.cache), peer.name)
+
+    # results
+
+    def staleSources (self):
+        """(content, source) pairs listed for a source that is offline or
+        doesn't hold the content"""
+        stale = 0
+        for content, sources in self.db.contentMap.items():
+            for source in sources:
+                peer = self.peers[source]
+                if not peer.online or content not in peer.cache:
+                    stale += 1
+        return stale
+
+    def summary (self):
+        stats = self.stats
+        peers = [p for p in self.peers.values() if p is not self.origin]
+        uploaded = sorted(p.uploaded for p in peers)
+        total = float(sum(uploaded)) or 1.0
+        top = uploaded[-max(1, len(uploaded) / 100):]
+        span = max(self.now - self.warmup, 0)
+        summary = dict(stats)
+        summary.update({
+                'simulated': self.now,
+                'wall': self.wall,
+                'events': self.events,
+                'events_per_second': self.events / self.wall if self.wall else 0,
+                'speedup': self.now / self.wall if self.wall else 0,
+                'requests_per_second': stats['requests'] / span if span else 0,
+                'locality': float(stats['local_redirects']) / stats['redirects']
+                            if stats['redirects'] else 0,
+                'local_bytes_share': float(stats['local_bytes']) / stats['bytes']
+                                     if stats['bytes'] else 0,
+                'origin_bytes_share': float(stats['origin_bytes']) / stats['bytes']
+                                      if stats['bytes'] else 0,
+                'completion_ms': self.completion.summary(),
+                'peer_upload_mb': {
+                        'serving': len([u for u in uploaded if u]),
+                        'mean': total / 1e6 / len(uploaded) if uploaded else 0,
+                        'p50': percentile(uploaded, 0.5) / 1e6,
+                        'p90': percentile(uploaded, 0.9) / 1e6,
+                        'p99': percentile(uploaded, 0.99) / 1e6,
+                        'max': uploaded[-1] / 1e6 if uploaded else 0,
+                        'top1_share': sum(top) / total},
+                'online': len(self.online),
+                'db_contents': len(self.db.contentMap),
+                'db_sources': sum(len(s) for s in self.db.contentMap.values()),
+                'db_stale': self.staleSources(),
+                'tracked_flows': len(self.redirects.flows)})
+        return summary
+
+
+def report (s, out = sys.stdout):
+    out.write("%.0fs simulated in %.1fs (x%.0f), %d events, %.0f events/s\n" % (
+            s['simulated'], s['wall'], s['speedup'], s['events'],
+            s['events_per_second']))
+    out.write("requests %d (%.2f/s): %d cache hits, %d duplicates, "
+              "%d completed, %d abandoned\n" % (s['requests'],
+              s['requests_per_second'], s['cache_hits'], s['duplicates'],
+              s['completed'], s['abandoned']))
+    out.write("redirects %d: locality %.3f, %d to the origin, %d misses, "
+              "%d failures, %d interrupted, %d direct\n" % (s['redirects'],
+              s['locality'], s['origin_redirects'], s['misses'],
+              s['failures'], s['interrupted'], s['direct']))
+    out.write("bytes %.1f GB: %.3f local, %.3f from the origin\n" % (
+            s['bytes'] / 1e9, s['local_bytes_share'], s['origin_bytes_share']))
+    c = s['completion_ms']
+    out.write("completion (s): mean %.1f, p50 %.1f, p90 %.1f, p99 %.1f, "
+              "p999 %.1f, max %.1f\n" % (c['mean'] / 1000.0, c['p50'] / 1000.0,
+              c['p90'] / 1000.0, c['p99'] / 1000.0, c['p999'] / 1000.0,
+              c['max'] / 1000.0))
+    u = s['peer_upload_mb']
+    out.write("peer uploads (MB): %d serving, mean %.1f, p50 %.1f, p90 %.1f, "
+              "p99 %.1f, max %.1f, top 1%% %.3f of the bytes; at most %d at "
+              "once\n" % (u['serving'], u['mean'], u['p50'], u['p90'], u['p99'],
+              u['max'], u['top1_share'], s['max_uploads']))
+    out.write("oracle: %d learned (%d stale), %d sources for %d contents, "
+              "%d stale, %d flows tracked\n" % (s['learned'],
+              s['learned_stale'], s['db_sources'], s['db_contents'],
+              s['db_stale'], s['tracked_flows']))
+
+def main (argv = None):
+    parser = argparse.ArgumentParser(description = "VoD swarm simulator")
+    parser.add_argument('--peers', type = int, default = 10000)
+    parser.add_argument('--regions', type = int, default = 20)
+    parser.add_argument('--contents', type = int, default = 1000)
+    parser.add_argument('--zipf', type = float, default = 0.8,
+                        help = "exponent of the content popularity")
+    parser.add_argument('--size', type = float, default = 100,
+                        help = "median size of the contents, in MB")
+    parser.add_argument('--rate', type = float, default = 5,
+                        help = "mean requests per second")
+    parser.add_argument('--diurnal', type = float, default = 0.5,
+                        help = "amplitude of the daily variations of the rate")
+    parser.add_argument('--duration', type = float, default = DAY,
+                        help = "simulated seconds")
+    parser.add_argument('--warmup', type = float, default = 3600,
+                        help = "seconds before the requests are accounted for")
+    parser.add_argument('--session', type = float, default = 3600,
+                        help = "mean seconds online")
+    parser.add_argument('--offline', type = float, default = 7200,
+                        help = "mean seconds offline")
+    parser.add_argument('--cache', type = int, default = 20,
+                        help = "contents kept by each peer")
+    parser.add_argument('--prefill', type = int, default = 0,
+                        help = "contents each peer holds at the start")
+    parser.add_argument('--uplinks', default = '1,4,16',
+                        help = "comma separated uplinks of the peers, Mbit/s")
+    parser.add_argument('--downlink', type = float, default = 50,
+                        help = "downlink of the peers, Mbit/s")
+    parser.add_argument('--origin', type = float, default = 10000,
+                        help = "uplink of the origin server, Mbit/s")
+    parser.add_argument('--policy', choices = sorted(POLICIES),
+                        default = 'random')
+    parser.add_argument('--idle-timeout', type = float, default = 10,
+                        help = "idle timeout of the flows, in seconds")
+    parser.add_argument('--connect-timeout', type = float, default = 3)
+    parser.add_argument('--retries', type = int, default = 3,
+                        help = "redirects per request before the origin")
+    parser.add_argument('--no-announce', action = 'store_true',
+                        help = "only learn sources from the flows")
+    parser.add_argument('--expiry', type = float, default = 15,
+                        help = "seconds before a peer that left is expired")
+    parser.add_argument('--learner', choices = ['flows', 'stats'],
+                        default = 'flows')
+    parser.add_argument('--seed', type = int, default = 1)
+    parser.add_argument('--json', help = "also write the results to this file")
+    args = parser.parse_args(argv)
+    sim = Simulator(peers = args.peers, regions = args.regions,
+                    contents = args.contents, zipf = args.zipf,
+                    size = args.size, rate = args.rate,
+                    diurnal = args.diurnal, duration = args.duration,
+                    warmup = args.warmup, session = args.session,
+                    offline = args.offline, cache_size = args.cache,
+                    prefill = args.prefill,
+                    uplinks = [float(x) for x in args.uplinks.split(',')],
+                    downlink = args.downlink, origin = args.origin,
+                    policy = args.policy, idle_timeout = args.idle_timeout,
+                    connect_timeout = args.connect_timeout,
+                    retries = args.retries, announce = not args.no_announce,
+                    expiry = args.expiry, learner = args.learner,
+                    seed = args.seed)
+    summary = sim.run()
+    report(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent = 2, sort_keys = True)
+    return summary
+
+if __name__ == '__main__':
+    main()
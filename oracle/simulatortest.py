@@ -0,0 +1,36 @@
+"""Unit test for simulator.py"""
+import unittest
+from simulator import Simulator
+
+class Simulation(unittest.TestCase):
+    def run_(self, **kw):
+        args = dict(peers = 200, regions = 4, contents = 50, rate = 1,
+                    duration = 3000, warmup = 0, session = 600, offline = 600,
+                    size = 10)
+        args.update(kw)
+        return Simulator(**args).run()
+
+    def testRun(self):
+        """a short run should complete downloads and learn sources"""
+        s = self.run_()
+        self.assertTrue(s['completed'] > 0)
+        self.assertTrue(s['redirects'] >= s['local_redirects'] + s['origin_redirects'])
+        self.assertTrue(0 <= s['locality'] <= 1)
+        self.assertTrue(s['db_sources'] > 50)
+        self.assertEqual(s['completion_ms']['count'], s['completed'])
+
+    def testDeterministic(self):
+        """runs with the same seed should give the same results"""
+        a = self.run_(seed = 3)
+        b = self.run_(seed = 3)
+        for key in 'requests', 'redirects', 'completed', 'learned', 'db_sources':
+            self.assertEqual(a[key], b[key])
+
+    def testLocalPolicy(self):
+        """the local policy should redirect within the region more often"""
+        random = self.run_(policy = 'random', prefill = 5)
+        local = self.run_(policy = 'local', prefill = 5)
+        self.assertTrue(local['locality'] > random['locality'])
+
+if __name__ == '__main__':
+    unittest.main()
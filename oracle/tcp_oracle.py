@@ -28,30 +28,77 @@ import pox.lib.packet.ipv4 as pkt_ip
 import pox.lib.packet.ethernet as pkt_eth
 from pox.lib.addresses import IPAddr
 from pox.lib.revent import *
+from pox.lib.recoco import Timer
 from oracleDB import OracleDB
+import admission
+from metrics import Metrics, NullMetrics
+import metrics as oracle_metrics
+import profiling as oracle_profiling
+import selection
+import eventlog
+import flow_table
+from flow_learner import FlowStatsLearner, loadCatalog
+from announce import AnnounceListener
+from eventlog import Stamp
+from redirect import RedirectTracker, MissCache
+from placement import Placement
+from prefetch import Prefetcher
 import struct
-import datetime
+import random
+import re
 
 log = core.getLogger()
 
+# other sources listed in the X-Sources header of a redirect, for the clients
+# that download from several sources at once
+MAX_ALTERNATES = 8
+
+# the single, closed byte range of a GET, from swarming clients
+RANGE = re.compile(r'\nRange:\s*bytes=(\d+)-(\d+)\s*\r?\n', re.IGNORECASE)
+
 
                 
 class TCPOracle (EventMixin):
     _eventMixin_events = set([])
     
-    def __init__ (self, install_flow = True):
+    def __init__ (self, install_flow = True, admission = None, metrics = None,
+                  events = None, chunk_size = None):
         self._install_flow = install_flow
-        self.oracle = OracleDB()
-        self.tcpFlowsMap = {}
+        # optional AdmissionControl limiting the rate of VoD requests
+        self.admission = admission
+        if metrics is None:
+            metrics = NullMetrics()
+        self.metrics = metrics
+        # EventLog for the messages on the redirect path
+        if events is None:
+            events = eventlog.EventLog(log)
+        self.events = events
+        self.oracle = OracleDB(chunk_size)
+        self.redirects = RedirectTracker(self.oracle)
+        self.tcpFlowsMap = self.redirects.flows
+        # optional FlowStatsLearner, AnnounceListener and DeferredSelector,
+        # set by launch()
+        self.learner = None
+        self.announcer = None
+        self.selector = None
+        # optional MissCache: the requests for contents without source are
+        # then sent to the origin by a flow lasting the TCP session, idle for
+        # missIdle seconds at most, with the output action to missPort
+        self.misses = None
+        self.missIdle = 10
+        self.missPort = of.OFPP_FLOOD
+        # optional Placement watching the demand, and the Prefetcher copying
+        # the contents in demand to the peers it picks
+        self.placement = None
+        self.prefetcher = None
         self.domain = "bogusdomain.com"
         self.vodIP = "10.0.0.3"
+        self.metrics.gauge('flows', lambda: len(self.tcpFlowsMap))
+        self.metrics.gauge('contents', lambda: len(self.oracle.contentMap))
         # hardcoded sources to test functionality
         if not self.oracle.addSource("first.txt", "10.0.0.2:9002"):
             raise Exception("Failed to initialize oracle in tcp_oracle.py")
         core.openflow.addListeners(self)
-        self.monthname = [None,
-                 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
-                 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
            
     def _handle_ConnectionUp (self, event):
         if self._install_flow:
@@ -61,38 +108,148 @@ class TCPOracle (EventMixin):
             msg.match.nw_proto = pkt.ipv4.TCP_PROTOCOL
             msg.match.nw_dstip = IPAddr(self.vodIP)
             msg.actions.append(of.ofp_action_output(port = of.OFPP_CONTROLLER))
-            event.connection.send(msg)
+            flow_table.send(event.connection, msg, flow_table.ORACLE)
             
+    def _flowKey (self, match):
+        """returns the tcpFlowsMap key of the redirected transfer matched by
+        match, or None if it's not a flow we are tracking"""
+        if match.nw_proto != pkt_ip.TCP_PROTOCOL:
+            return None
+        if match.nw_src is None or match.nw_dst is None:
+            return None
+        source = match.nw_src.toStr() + ':' + str(match.tp_src)
+        # destination port will change after the redirect, we only keep the IP
+        dest = match.nw_dst.toStr()
+        if (source, dest) in self.tcpFlowsMap:
+            return (source, dest)
+        return None
+
+    def _learnSource (self, key):
+        """the transfer tracked under key has completed: add its destination
+        as a new source for the content and stop tracking it"""
+        dest = key[1]
+        content, added = self.redirects.learn(key, dest)
+        if added:
+            self.metrics.count('learned')
+            self.events.info('learn', "Added source %s for content %s",
+                             dest, content)
+            log.debug("Sources: %s", self.oracle.listSources(content))
+            if self.misses is not None:
+                self._removeFastLanes(self.misses.clear(content))
+
+    def _fastLane (self, event):
+        """installs a flow forwarding the rest of the TCP session of the
+        PacketIn event, this packet included, straight to the origin. returns
+        (connection, match, priority) of the flow, or None if the flow table
+        was full"""
+        ip = event.parsed.find('ipv4')
+        tcp = event.parsed.find('tcp')
+        msg = of.ofp_flow_mod()
+        msg.match = of.ofp_match(dl_type = pkt.ethernet.IP_TYPE,
+                                 nw_proto = pkt.ipv4.TCP_PROTOCOL,
+                                 nw_src = ip.srcip, nw_dst = ip.dstip,
+                                 tp_src = tcp.srcport, tp_dst = tcp.dstport)
+        # above the rule sending the VoD requests to the controller
+        msg.priority = of.OFP_DEFAULT_PRIORITY + 1
+        msg.idle_timeout = self.missIdle
+        msg.actions.append(of.ofp_action_output(port = self.missPort))
+        msg.data = event.ofp
+        if not flow_table.send(event.connection, msg, flow_table.TEMP):
+            return None
+        self.metrics.count('fast_lanes')
+        return (event.connection, msg.match, msg.priority)
+
+    def _removeFastLanes (self, flows):
+        """removes the flows installed by _fastLane, their content has a
+        source now"""
+        for connection, match, priority in flows:
+            msg = of.ofp_flow_mod(command = of.OFPFC_DELETE_STRICT,
+                                  match = match, priority = priority)
+            flow_table.send(connection, msg, flow_table.TEMP)
+
+    def _expireMisses (self):
+        self._removeFastLanes(self.misses.expire())
+
     def _handle_FlowRemoved(self, event):
         log.debug("FlowRemoved event")
-        if event.idleTimeout and event.ofp.match.nw_proto is pkt_ip.TCP_PROTOCOL:
-            sourceIP = event.ofp.match.nw_src
-            if sourceIP is None:
-            	return
-            sourcePort = str(event.ofp.match.tp_src)
-            source = sourceIP.toStr() + ':' + sourcePort
-            destIP = event.ofp.match.nw_dst
-            if destIP is None:
-            	return
-            #destPort = str(event.ofp.match.tp_dst)
-            dest = destIP.toStr() # + ':' + destPort 
-            log.debug("TCP flow expired for %s, %s", source, dest)
-            if (source,dest) in self.tcpFlowsMap.keys():
+        if event.idleTimeout:
+            key = self._flowKey(event.ofp.match)
+            if key is not None:
+                log.debug("TCP flow expired for %s, %s", key[0], key[1])
                 # completed P2P flow, add new source
-                content = self.tcpFlowsMap[(source,dest)]
-                if self.oracle.addSource(content,dest):
-                    log.info("Added source " + dest + " for content " + content)
-                    log.info("Sources: " + str(self.oracle.listSources(content)))
-                del self.tcpFlowsMap[(source, dest)]
-
-    def getTimeStamp(self):
-        now = datetime.datetime.now()
-        tt = now.timetuple()
-        ms = now.microsecond / 1000
-        s = "[%02d/%3s/%04d %02d:%02d:%02d:%04d]" % (
-                tt[2], self.monthname[tt[1]], tt[0], tt[3], tt[4], tt[5], ms)
-        return s            	
-            
+                t = self.metrics.timer('FlowRemoved')
+                self._learnSource(key)
+                t.stop()
+
+    def _chunkSource (self, http, content, requester):
+        """returns a partial source holding the whole byte range requested by
+        the HTTP GET http, or None. partial sources only serve the ranges they
+        hold, so plain GETs and open or inverted ranges are never sent there"""
+        match = RANGE.search(http)
+        if match is None:
+            return None
+        return self.oracle.getRangeSource(content, int(match.group(1)),
+                                          int(match.group(2)),
+                                          exclude = requester)
+
+    def _redirect (self, event, content, source, t = None, track = True):
+        """answers the HTTP GET for content in the PacketIn event with a
+        redirect to source, and tracks the transfer (unless from a partial
+        source, whose destination won't hold the whole content)"""
+        tcp = event.parsed.find('tcp')
+        ip = event.parsed.find('ipv4')
+        # return the IP address of the source as an HTTP Redirect
+        response = "HTTP/1.1 307 Temporary Redirect\nLocation: " + source +'\n'
+        alternates = [other for other in self.oracle.listSources(content)
+                      if other != source and other.split(':')[0] != ip.srcip.toStr()]
+        if alternates:
+            if len(alternates) > MAX_ALTERNATES:
+                alternates = random.sample(alternates, MAX_ALTERNATES)
+            response += "X-Sources: " + ', '.join(alternates) + '\n'
+        response += '\n'
+        tcp_res = pkt_tcp()
+        tcp_res.srcport = tcp.dstport
+        tcp_res.dstport = tcp.srcport
+        tcp_res.ACK = True
+        # tcp_res.FIN = True
+        tcp_res.win = 14000
+        tcp_res.seq = tcp.ack
+        tcp_res.ack = tcp.seq + tcp.payload_len
+        tcp_res.off = 5 # is that right?
+        tcp_res.set_payload(response)
+        tcp_res.len = pkt_tcp.MIN_LEN + len(response)
+        ip_res = pkt_ip()
+        ip_res.iplen = pkt_ip.MIN_LEN + tcp_res.len
+        ip_res.protocol = pkt_ip.TCP_PROTOCOL
+        ip_res.dstip = ip.srcip
+        ip_res.srcip = ip.dstip
+        ip_res.set_payload(tcp_res)
+        eth_res = pkt_eth()
+        eth_res.type = pkt_eth.IP_TYPE
+        eth = event.parsed.find('ethernet')
+        eth_res.src = eth.dst
+        eth_res.dst = eth.src
+        eth_res.set_payload(ip_res)
+        msg = of.ofp_packet_out(data = eth_res.pack())
+        msg.actions.append(of.ofp_action_output(port = event.port))
+        if t is not None:
+            t.lap('build')
+        event.connection.send(msg)
+        if t is not None:
+            t.lap('send')
+        self.metrics.count('redirects')
+        if self.placement is not None:
+            self.placement.redirected(source)
+        self.events.info('redirect', "%sHTTP 307 response with source %s for content %s sent",
+                         Stamp(), source, content)
+        # record the flow - content association to monitor it
+        # note: destination port will change after the redirect, cannot save it
+        dest = ip_res.dstip.toStr() # +':'+str(tcp_res.dstport)
+        if not track:
+            return
+        self.redirects.track((source, dest), content)
+        self.events.debug('redirect', '%s - %s pair saved for content %s', source, dest, content)
+
     def _handle_PacketIn (self, event):
         def drop (duration = None):
             """
@@ -103,78 +260,175 @@ class TCPOracle (EventMixin):
                 if not isinstance(duration, tuple):
                     duration = (duration,duration)
                 msg = of.ofp_flow_mod()
-                msg.match = of.ofp_match.from_packet(p)
+                msg.match = of.ofp_match.from_packet(event.parsed, event.port)
                 msg.idle_timeout = duration[0]
                 msg.hard_timeout = duration[1]
                 msg.buffer_id = event.ofp.buffer_id
-                event.connection.send(msg)
+                flow_table.send(event.connection, msg, flow_table.TEMP)
             elif event.ofp.buffer_id is not None:
                 msg = of.ofp_packet_out()
                 msg.buffer_id = event.ofp.buffer_id
                 msg.in_port = event.port
                 event.connection.send(msg)
-            log.info("Dropped packet.")
+            self.events.info('drop', "Dropped packet.")
 
+        t = self.metrics.timer('PacketIn')
         # Check if it's a TCP VoD request
         tcp = event.parsed.find('tcp')
         if tcp is not None and tcp.parsed:
             ip = event.parsed.find('ipv4')
             if ip.dstip == self.vodIP: # http vod request
+                if self.admission is not None and not self.admission.admit(ip.srcip):
+                    log.debug("Over the request rate, dropping packet from %s", ip.srcip)
+                    self.metrics.count('rejected')
+                    drop(self.admission.drop_time)
+                    event.halt = True
+                    return
                 http = tcp.payload
                 index = http.find('GET') 
                 if index is not -1:
                     delim = http.find('HTTP/1')
                     content = http[index+4:delim-1].strip()
-                    log.info(self.getTimeStamp() + "Request for content " + content)
-                    source = self.oracle.getSource(content)
-                    # make sure we're not telling the requester to contact itself (just for the demo)
-                    n = len(self.oracle.listSources(content))
-                    while n>1 and source.split(':')[0] == ip.srcip.toStr():
-                    	source = self.oracle.getSource(content)
+                    self.events.info('request', "%sRequest for content %s", Stamp(), content)
+                    t.lap('parse')
+                    requester = ip.srcip.toStr()
+                    if self.placement is not None:
+                        self.placement.request(content, requester)
+                    if self.misses is not None and self.misses.missed(content):
+                        # no source a moment ago, don't look it up again
+                        self.metrics.count('miss_cached')
+                        source = None
+                    elif self.selector is not None:
+                        if self.selector.select(content, requester,
+                                lambda source: self._redirect(event, content, source)):
+                            # answered once the policy decides (or gives up)
+                            t.lap('defer')
+                            event.halt = True
+                            t.stop()
+                            return
+                        source = None
+                    else:
+                        # never tell the requester to contact itself
+                        source = self.redirects.select(content, requester)
+                    t.lap('lookup')
+                    if source is None and self.oracle.chunkSize:
+                        source = self._chunkSource(http, content, requester)
+                        if source is not None:
+                            self.metrics.count('chunk_redirects')
+                            self._redirect(event, content, source, t, False)
+                            event.halt = True
+                            t.stop()
+                            return
                     if source is not None:
-                        # return the IP address of the source as an HTTP Redirect
-                        response = "HTTP/1.1 307 Temporary Redirect\nLocation: " + source +'\n\n'
-                        tcp_res = pkt_tcp()
-                        tcp_res.srcport = tcp.dstport
-                        tcp_res.dstport = tcp.srcport
-                        tcp_res.ACK = True
-                        # tcp_res.FIN = True
-                        tcp_res.win = 14000
-                        tcp_res.seq = tcp.ack
-                        tcp_res.ack = tcp.seq + tcp.payload_len
-                        tcp_res.off = 5 # is that right?
-                        tcp_res.set_payload(response)
-                        tcp_res.len = pkt_tcp.MIN_LEN + len(response)
-                        ip_res = pkt_ip()
-                        ip_res.iplen = pkt_ip.MIN_LEN + tcp_res.len
-                        ip_res.protocol = pkt_ip.TCP_PROTOCOL
-                        ip_res.dstip = ip.srcip
-                        ip_res.srcip = ip.dstip
-                        ip_res.set_payload(tcp_res)
-                        eth_res = pkt_eth()
-                        eth_res.type = pkt_eth.IP_TYPE
-                        eth = event.parsed.find('ethernet')
-                        eth_res.src = eth.dst
-                        eth_res.dst = eth.src
-                        eth_res.set_payload(ip_res)                        
-                        msg = of.ofp_packet_out(data = eth_res.pack())
-                        msg.actions.append(of.ofp_action_output(port = event.port))
-                        event.connection.send(msg)
-                        log.info (self.getTimeStamp() + "HTTP 307 response with source %s for content %s sent" % (source, content))
-                        # record the flow - content association to monitor it
-                        # note: destination port will change after the redirect, cannot save it
-                        dest = ip_res.dstip.toStr() # +':'+str(tcp_res.dstport)
-                        self.tcpFlowsMap[source, dest] = content
-                        log.info('%s - %s pair saved for content %s', source, dest, content)
+                        self._redirect(event, content, source, t)
                         # attempt to stop other modules from forwarding the packet
                         event.halt = True
+                        t.stop()
                         return
                     else:
-                        log.info(self.getTimeStamp() + "No source found, we won't redirect")
+                        self.metrics.count('misses')
+                        self.events.info('miss', "%sNo source found, we won't redirect", Stamp())
+                        if self.misses is not None:
+                            flow = self._fastLane(event)
+                            self.misses.add(content, flow)
+                            if flow is not None:
+                                # the flow forwards this packet too
+                                event.halt = True
+                        t.stop()
                         return
                 else: # not an HTTP GET
-                    log.info(self.getTimeStamp() + "VoD TCP flow match but not a GET request")
+                    self.events.info('other', "%sVoD TCP flow match but not a GET request", Stamp())
                     return                        
                 
-def launch (no_flow = False):
-    core.registerNew(TCPOracle, not no_flow)
+def launch (no_flow = False, rate = None, burst = None, global_rate = None,
+            global_burst = None, drop_time = None, metrics = False,
+            metrics_port = None, log_sample = None, log_rate = None,
+            log_burst = None, log_queue = None, catalog = None,
+            poll_interval = 2, announce_port = None, profiling = False,
+            policy = None, policy_workers = 4, policy_processes = False,
+            policy_deadline = 0.05, miss_ttl = None, miss_idle = 10,
+            miss_port = 'flood', chunk_size = None, prefetch_origin = None,
+            prefetch_interval = 10, prefetch_bandwidth = 1000000,
+            prefetch_active = 4, prefetch_hot = 0.5, prefetch_region = 24):
+    """
+    rate/burst limit the packets each requester can send to the VoD server
+    through the controller, global_rate/global_burst those of all requesters
+    together; drop_time installs a drop flow for that many seconds when a
+    requester goes over its rate.
+    metrics enables latency histograms and counters, shown by metrics() in the
+    console and, if metrics_port is given, served on localhost over HTTP.
+    log_sample logs one message out of that many for each kind of event,
+    log_rate/log_burst cap the messages per second of each kind, and log_queue
+    hands them to a background writer through a queue of that size.
+    catalog is a file listing the size of each content: when given, transfers
+    are polled every poll_interval seconds and their destination is learned as
+    soon as the whole content went through, instead of when the flow expires.
+    announce_port is the UDP port on which VoD servers announce their contents.
+    profiling adds profile(), profile_stop() and profile_status() to the
+    console, to profile the handlers for a while (see profiling.py).
+    policy picks the sources with one of redirect.POLICIES, off the event
+    loop, on policy_workers threads (or processes, with policy_processes);
+    if it takes more than policy_deadline seconds, a random source is picked.
+    miss_ttl remembers for that many seconds that a content has no source: the
+    requests for it are then forwarded to the origin by a flow per TCP
+    session (idle for miss_idle seconds at most), output to miss_port, either
+    flood, normal or a port number. The flows are removed once the content
+    has a source.
+    chunk_size also tracks the chunks of that many bytes held by the partial
+    sources, from the catalog's transfers and the announcements: a GET of a
+    single byte range without a regular source is sent to a partial source
+    holding all of it (see vodServer/MsHTTPServer.py for how they serve it).
+    prefetch_origin, the host[:port] of the origin HTTP server, enables the
+    prefetching of the contents in demand: every prefetch_interval seconds,
+    the regions (blocks of addresses of prefetch_region bits) asking for a
+    content more than prefetch_hot times a second per source get a copy on
+    an idle VoD server of theirs, prefetch_active at a time at most, sharing
+    prefetch_bandwidth bytes per second (see placement.py and prefetch.py).
+    """
+    ac = admission.build(rate, burst, global_rate, global_burst, drop_time)
+    events = eventlog.build(log, log_sample, log_rate, log_burst, log_queue)
+    stats = None
+    if metrics or metrics_port is not None:
+        stats = Metrics("tcp_oracle")
+        core.Interactive.variables['metrics'] = oracle_metrics.show
+        if metrics_port is not None:
+            oracle_metrics.serve(metrics_port)
+    if profiling:
+        oracle_profiling.install()
+    if chunk_size is not None:
+        try:
+            chunk_size = int(str(chunk_size))
+            assert chunk_size > 0
+        except (ValueError, AssertionError):
+            raise RuntimeError("Expected chunk_size to be a positive number")
+    oracle = core.registerNew(TCPOracle, not no_flow, ac, stats, events,
+                              chunk_size)
+    oracle.selector = selection.build(oracle.redirects, policy, policy_workers,
+                                      policy_processes, policy_deadline, stats)
+    if miss_ttl is not None:
+        try:
+            oracle.missIdle = int(str(miss_idle))
+            ports = {'flood': of.OFPP_FLOOD, 'normal': of.OFPP_NORMAL}
+            oracle.missPort = ports.get(str(miss_port).lower())
+            if oracle.missPort is None:
+                oracle.missPort = int(str(miss_port))
+            oracle.misses = MissCache(oracle.oracle, float(str(miss_ttl)))
+        except ValueError as e:
+            raise RuntimeError("Invalid miss parameters: %s" % (e,))
+        Timer(oracle.misses.ttl, oracle._expireMisses, recurring = True)
+    if prefetch_origin is not None:
+        try:
+            oracle.placement = Placement(oracle.oracle, int(str(prefetch_region)),
+                                         float(str(prefetch_hot)),
+                                         max_active = int(str(prefetch_active)))
+            oracle.prefetcher = Prefetcher(oracle, str(prefetch_origin),
+                                           float(str(prefetch_interval)),
+                                           int(str(prefetch_bandwidth)))
+        except ValueError as e:
+            raise RuntimeError("Invalid prefetch parameters: %s" % (e,))
+    if catalog is not None:
+        oracle.learner = FlowStatsLearner(oracle, loadCatalog(catalog),
+                                          float(poll_interval))
+    if announce_port is not None:
+        oracle.announcer = AnnounceListener(oracle.oracle, announce_port,
+                                            with_port = True)
@@ -0,0 +1,110 @@
+"""Unit test for tcp_oracle.py, through the harness of replay.py. Needs POX,
+found on the path or in the POX environment variable (e.g. POX=~/pox)"""
+import unittest
+import replay
+from redirect import MissCache
+
+core = replay.trySetup()
+if core is not None:
+    import pox.openflow
+    import tcp_oracle
+    import flow_table
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@unittest.skipIf(core is None, "POX can't be imported")
+class FastLane(unittest.TestCase):
+    def setUp(self):
+        self.connection = replay.ReplayConnection()
+        self.oracle = tcp_oracle.TCPOracle(False)
+        self.clock = FakeClock()
+        self.oracle.misses = MissCache(self.oracle.oracle, 5, clock = self.clock)
+        # no source for the requests: each one is a miss
+        self.requests = replay.Synthetic('tcp', contents = 1, sources = 1,
+                                         hosts = 2, seed = 1)
+        self.content = self.requests.names[0]
+
+    def tearDown(self):
+        core.openflow.clearHandlers()
+        core.components.pop('FlowTableManager', None)
+
+    def packetIn(self, n):
+        frame = self.requests.request(n)[0]
+        msg = replay.of.ofp_packet_in(in_port = 1, data = frame,
+                                      total_len = len(frame), buffer_id = None,
+                                      reason = replay.of.OFPR_NO_MATCH)
+        return core.openflow.raiseEvent(pox.openflow.PacketIn,
+                                        self.connection, msg)
+
+    def flowMods(self, command):
+        return [m for m in self.connection.take()
+                if isinstance(m, replay.of.ofp_flow_mod) and m.command == command]
+
+    def testInstall(self):
+        """a miss should send the session to the origin by a flow, this packet included"""
+        event = self.packetIn(0)
+        self.assertTrue(event.halt)
+        flows = self.flowMods(replay.of.OFPFC_ADD)
+        self.assertEqual(len(flows), 1)
+        self.assertEqual(flows[0].priority, replay.of.OFP_DEFAULT_PRIORITY + 1)
+        self.assertEqual(flows[0].idle_timeout, self.oracle.missIdle)
+        self.assertEqual(flows[0].match.tp_dst, 80)
+        self.assertTrue(flows[0].data is not None)
+        self.assertTrue(self.oracle.misses.missed(self.content))
+
+    def testTableFull(self):
+        """without room in the flow table, the packet should be left to the other components"""
+        manager = flow_table.FlowTableManager(capacity = 1, interval = 3600)
+        core.register('FlowTableManager', manager)
+        try:
+            rule = replay.of.ofp_flow_mod(match = replay.of.ofp_match(in_port = 1))
+            manager.install(self.connection, rule, flow_table.ORACLE)
+            self.connection.take()
+            event = self.packetIn(0)
+            self.assertFalse(event.halt)
+            self.assertEqual(self.flowMods(replay.of.OFPFC_ADD), [])
+            self.assertTrue(self.oracle.misses.missed(self.content))
+        finally:
+            manager.timer.cancel()
+
+    def testLearned(self):
+        """the flows of a miss should be removed once its content is learned"""
+        self.packetIn(0)
+        self.packetIn(1)
+        installed = self.flowMods(replay.of.OFPFC_ADD)
+        key = ('10.0.2.1:9002', '10.9.0.1')
+        self.oracle.redirects.track(key, self.content)
+        self.oracle._learnSource(key)
+        removed = self.flowMods(replay.of.OFPFC_DELETE_STRICT)
+        self.assertEqual([(m.match, m.priority) for m in removed],
+                         [(m.match, m.priority) for m in installed])
+        self.assertFalse(self.oracle.misses.missed(self.content))
+
+    def testExpired(self):
+        """the flows of a miss should be removed on expiry if a source showed up"""
+        self.packetIn(0)
+        installed = self.flowMods(replay.of.OFPFC_ADD)
+        self.oracle._expireMisses()
+        self.assertEqual(self.flowMods(replay.of.OFPFC_DELETE_STRICT), [])
+        self.oracle.oracle.addSource(self.content, '10.0.2.1:9002')
+        self.oracle._expireMisses()
+        removed = self.flowMods(replay.of.OFPFC_DELETE_STRICT)
+        self.assertEqual([m.match for m in removed], [installed[0].match])
+        self.assertEqual(self.oracle.misses.misses, {})
+
+    def testTimedOut(self):
+        """a miss timed out without source should leave its flows to their idle timeout"""
+        self.packetIn(0)
+        self.connection.take()
+        self.clock.now += 20
+        self.oracle._expireMisses()
+        self.assertEqual(self.flowMods(replay.of.OFPFC_DELETE_STRICT), [])
+        self.assertEqual(self.oracle.misses.misses, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per-content TTLs for the answers of the DNS oracle.
+
+A cached answer spares the controller a query, but sends the requester to a
+source the oracle may have dropped meanwhile, and its transfer isn't tracked
+(so its destination isn't learned). Answers are only made cacheable for the
+contents worth it: with at least min_sources sources, whose sources haven't
+changed for stable seconds, and popular enough. The TTL grows with the rate
+of queries for the content, up to max_ttl at hot_rate queries per second.
+Everything else keeps a TTL of 0, as before.
+
+The rate is an exponentially decaying count of the queries (halving every
+halflife seconds). Changes of the sources are noticed through
+OracleDB.version() when the content is queried, so that a content changing
+while nobody asks for it is treated as having just changed.
+"""
+
+import math
+import time
+
+
+class _State (object):
+    __slots__ = ('version', 'since', 'count', 'last')
+
+    def __init__ (self, version, now):
+        self.version = version
+        self.since = now
+        self.count = 0.0
+        self.last = now
+
+
+class AdaptiveTTL (object):
+    def __init__ (self, db, max_ttl = 30, min_sources = 3, stable = 60,
+                  hot_rate = 1.0, halflife = 60, clock = time.time):
+        self.db = db
+        self.max_ttl = max_ttl
+        self.min_sources = min_sources
+        self.stable = stable
+        self.hot_rate = hot_rate
+        self.halflife = float(halflife)
+        self.clock = clock
+        # content -> _State
+        self.states = {}
+
+    def rate (self, content):
+        """queries per second for content, recently"""
+        state = self.states.get(content)
+        if state is None:
+            return 0.0
+        decay = 0.5 ** ((self.clock() - state.last) / self.halflife)
+        return state.count * decay * math.log(2) / self.halflife
+
+    def ttl (self, content):
+        """counts a query for content, and returns the TTL of its answer"""
+        now = self.clock()
+        version = self.db.version(content)
+        state = self.states.get(content)
+        if state is None:
+            state = self.states[content] = _State(version, now)
+        elif version != state.version:
+            state.version = version
+            state.since = now
+        state.count = state.count * 0.5 ** ((now - state.last) / self.halflife) + 1
+        state.last = now
+        if now - state.since < self.stable:
+            return 0
+        if len(self.db.listSources(content)) < self.min_sources:
+            return 0
+        rate = state.count * math.log(2) / self.halflife
+        return int(self.max_ttl * min(1.0, rate / self.hot_rate))
+
+    def expire (self, idle = None):
+        """forgets the contents not queried for idle seconds (by default, ten
+        half-lives)"""
+        if idle is None:
+            idle = 10 * self.halflife
+        limit = self.clock() - idle
+        for content in [c for c, s in self.states.items() if s.last < limit]:
+            del self.states[content]
+
+
+def build (db, max_ttl = None, min_sources = 3, stable = 60, hot_rate = 1.0):
+    """Creates an AdaptiveTTL from (string) launch() arguments, or returns
+    None if no max_ttl was specified"""
+    if max_ttl is None:
+        return None
+    try:
+        return AdaptiveTTL(db, int(str(max_ttl)), int(str(min_sources)),
+                           float(str(stable)), float(str(hot_rate)))
+    except ValueError as e:
+        raise RuntimeError("Invalid TTL parameters: %s" % (e,))
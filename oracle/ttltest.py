@@ -0,0 +1,64 @@
+"""Unit test for ttl.py"""
+import unittest
+from oracleDB import OracleDB
+from ttl import AdaptiveTTL
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TTL(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.db = OracleDB()
+        for i in range(3):
+            self.db.addSource('c1','10.0.0.%d' % (i + 1))
+        self.ttl = AdaptiveTTL(self.db, max_ttl = 30, min_sources = 3,
+                               stable = 60, hot_rate = 1.0, halflife = 60,
+                               clock = self.clock)
+
+    def query(self, n, interval, content = 'c1'):
+        """n queries every interval seconds, returns the last TTL"""
+        for i in range(n):
+            ttl = self.ttl.ttl(content)
+            self.clock.now += interval
+        return ttl
+
+    def testUnstable(self):
+        """a content seen for the first time should not be cacheable"""
+        self.assertEqual(self.ttl.ttl('c1'), 0)
+
+    def testHot(self):
+        """a stable, hot content should get the maximum TTL"""
+        self.query(200, 0.5)
+        self.assertEqual(self.ttl.ttl('c1'), 30)
+
+    def testCold(self):
+        """the TTL should shrink with the rate of queries"""
+        ttl = self.query(20, 10)
+        self.assertTrue(0 < ttl < 30)
+
+    def testFewSources(self):
+        """a content with too few sources should not be cacheable"""
+        self.db.removeSource('c1','10.0.0.3')
+        self.assertEqual(self.query(200, 0.5), 0)
+
+    def testChurn(self):
+        """a change of the sources should make the content uncacheable again"""
+        self.query(200, 0.5)
+        self.db.addSource('c1','10.0.0.4')
+        self.assertEqual(self.query(50, 0.5), 0)
+        self.assertEqual(self.query(100, 0.5), 30)
+
+    def testExpire(self):
+        """contents not queried for a while should be forgotten"""
+        self.query(1, 0)
+        self.clock.now += 1000
+        self.ttl.expire()
+        self.assertEqual(self.ttl.states, {})
+
+if __name__ == '__main__':
+    unittest.main()
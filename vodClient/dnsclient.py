@@ -16,23 +16,44 @@
 dnsclient will attempt to request content by mapping their name to a 
 domain name; the dns request will be intercepted by the oracle in the controller
 and the IP address of a P2P source will be returned if available. 
+Contents are streamed to disk, and interrupted downloads are resumed (see
+download.py). Answers are cached as long as their TTL allows (see
+resolver.py); if the cached source doesn't answer, the oracle is asked again.
 """
 import httplib
+import socket
+import os
+import sys
+import time
 import SimpleHTTPServer
 import SocketServer
 import threading
+from download import Download, CHUNK_SIZE
+from resolver import Resolver
 
 class IndexOutOfRange(Exception): pass
 class WrongHttpResponse(Exception): pass
 
 class DnsClient:
-    def __init__(self):
+    def __init__(self, chunkSize = CHUNK_SIZE, preallocate = False,
+                 serve = True, verbose = True, directory = '.',
+                 resolver = None):
+        self.chunkSize = chunkSize
+        self.preallocate = preallocate
+        self.verbose = verbose
+        # where downloaded contents are written
+        self.directory = directory
         self.catalog = ['first','second']
         self.cached = []
         self.baseDomain = '.bogusvod.com'
-        self.thread = threading.Thread(target=self.webserver)
-        self.thread.daemon = True
-        self.thread.start()
+        if resolver is None:
+            resolver = Resolver()
+        self.resolver = resolver
+        # serve the downloaded contents to other peers
+        if serve:
+            self.thread = threading.Thread(target=self.webserver)
+            self.thread.daemon = True
+            self.thread.start()
 
     def webserver(self):
         handler = SimpleHTTPServer.SimpleHTTPRequestHandler
@@ -40,20 +61,55 @@ class DnsClient:
         httpd.serve_forever()
         
     def requestContent(self, contentIndex):
+        """Downloads the content at contentIndex in the catalog, and returns
+        the time spent resolving its name, the time spent downloading it, and
+        its size."""
         if contentIndex < 0 or contentIndex >= len(self.catalog):
             raise IndexOutOfRange("Index " + contentIndex + ", catalog size " + self.catalog.len)
         else:
-            conn = httplib.HTTPConnection(self.catalog[contentIndex] + self.baseDomain)
             fileName = self.catalog[contentIndex]+'.txt'
-            conn.request("GET", fileName)
-            response = conn.getresponse()
-            if response.status == 200:
-                with open(fileName, 'wb') as out:
-                    out.write(response.read())
-                    self.cached.append(self.catalog[contentIndex])
-                    print "Succesfully retrieved", fileName
-            else:
-                raise WrongHttpResponse(response.status + response.reason)
+            download = Download(os.path.join(self.directory, fileName),
+                                self.chunkSize, self.preallocate,
+                                progressInterval = 1.0 if self.verbose else None,
+                                out = sys.stdout if self.verbose else None)
+            host = self.catalog[contentIndex] + self.baseDomain
+            start = time.time()
+            # resolved here rather than by httplib, to time the oracle apart
+            address, cached = self.resolver.resolve(host)
+            resolveTime = time.time() - start
+            downloaded = False
+            while not downloaded:
+                conn = httplib.HTTPConnection(address)
+                headers = download.headers()
+                headers['Host'] = host
+                try:
+                    conn.request("GET", fileName, headers = headers)
+                    response = conn.getresponse()
+                    status = response.status
+                except (httplib.HTTPException, socket.error):
+                    conn.close()
+                    if not cached:
+                        raise
+                    status = None
+                if status in (200, 206, 416):
+                    try:
+                        downloaded = download.save(response)
+                    finally:
+                        conn.close()
+                elif cached:
+                    # the source may be gone since the answer was cached
+                    conn.close()
+                    self.resolver.forget(host)
+                    again = time.time()
+                    address, cached = self.resolver.resolve(host)
+                    resolveTime += time.time() - again
+                else:
+                    raise WrongHttpResponse(str(response.status) + ' ' + response.reason)
+            if self.catalog[contentIndex] not in self.cached:
+                self.cached.append(self.catalog[contentIndex])
+            if self.verbose:
+                print "Succesfully retrieved", fileName
+            return resolveTime, time.time() - start - resolveTime, download.size
 
     def interactiveShell(self):
         while True:
@@ -72,6 +128,17 @@ class DnsClient:
           #      self.thread.join()
 
 if __name__ == "__main__":
-    client = DnsClient()
+    # first argument is the nameserver to query (default: the first one in
+    # /etc/resolv.conf), second argument is the longest time answers are
+    # cached, in seconds
+    if len(sys.argv) > 2:
+        maxTTL = int(sys.argv[2])
+    else:
+        maxTTL = 300
+    if len(sys.argv) > 1:
+        nameserver = sys.argv[1]
+    else:
+        nameserver = None
+    client = DnsClient(resolver = Resolver(nameserver, maxTTL = maxTTL))
     client.interactiveShell()
         
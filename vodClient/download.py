@@ -0,0 +1,203 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+download writes the body of an HTTP response to disk in chunks, so that a
+client never holds more than chunkSize bytes of a content in memory.
+The data goes to fileName.part, which is renamed to fileName once complete.
+If a download is interrupted, the partial file is kept together with
+fileName.part.info (the ETag of the content and, if the file was
+preallocated, how many bytes were written), and the next request for the
+same file asks only for the missing bytes with a Range header.
+"""
+import os
+import sys
+import json
+import time
+
+CHUNK_SIZE = 64 * 1024
+
+class IncompleteDownload(Exception): pass
+class WrongContentRange(Exception): pass
+
+def parseContentRange(value):
+    """Parses a 'bytes first-last/total' Content-Range header. Returns
+    (first, last, total), with first and last None for 'bytes */total' and
+    total None for an unknown length, or None if the header is invalid"""
+    try:
+        unit, spec = value.strip().split(None, 1)
+        span, total = spec.split('/', 1)
+    except (AttributeError, ValueError):
+        return None
+    if unit.lower() != 'bytes':
+        return None
+    try:
+        total = None if total.strip() == '*' else int(total)
+        if span.strip() == '*':
+            return None, None, total
+        first, last = span.split('-', 1)
+        return int(first), int(last), total
+    except ValueError:
+        return None
+
+def formatRate(bytesPerSecond):
+    return '%.2f MB/s' % (bytesPerSecond / 1000000.0)
+
+
+class Download(object):
+    def __init__(self, fileName, chunkSize = CHUNK_SIZE, preallocate = False,
+                 progressInterval = 1.0, stamp = None, out = sys.stdout):
+        self.fileName = fileName
+        self.partName = fileName + '.part'
+        self.infoName = fileName + '.part.info'
+        self.chunkSize = chunkSize
+        # set the size of the file before writing to it (sparse where the
+        # filesystem allows it)
+        self.preallocate = preallocate
+        # seconds between two progress lines, None to only print the summary
+        self.progressInterval = progressInterval
+        # returns the prefix of the progress lines
+        self.stamp = stamp or (lambda: '')
+        # where progress is written, None to be quiet
+        self.out = out
+        # bytes in the file, once complete
+        self.size = None
+
+    def readInfo(self):
+        try:
+            with open(self.infoName) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def writeInfo(self, info):
+        with open(self.infoName, 'w') as f:
+            json.dump(info, f)
+
+    def offset(self):
+        """Returns how many bytes of the file are already on disk"""
+        if not os.path.exists(self.partName):
+            return 0
+        info = self.readInfo()
+        if not info:
+            # no way to check that the data belongs to the same content
+            return 0
+        if info.get('offset') is not None:
+            return info['offset']
+        return os.path.getsize(self.partName)
+
+    def headers(self):
+        """Returns the headers to send to resume the download, if possible"""
+        offset = self.offset()
+        if not offset:
+            return {}
+        headers = {'Range': 'bytes=%d-' % offset}
+        etag = self.readInfo().get('etag')
+        if etag:
+            headers['If-Range'] = etag
+        return headers
+
+    def discard(self):
+        for name in self.partName, self.infoName:
+            if os.path.exists(name):
+                os.remove(name)
+
+    def save(self, response):
+        """Writes the body of response (200, 206 or 416) to the file. Returns
+        True when the file is complete, False if the partial file had to be
+        discarded and the request should be sent again. Raises
+        IncompleteDownload if the connection is closed before the end of the
+        body; the data received so far is kept for the next attempt."""
+        offset = self.offset()
+        if response.status == 416:
+            response.read()
+            cr = parseContentRange(response.getheader('content-range'))
+            if offset and cr is not None and cr[2] == offset:
+                # we had it all, but got interrupted before renaming it
+                self.finish(offset, offset, 0)
+                return True
+            self.discard()
+            return False
+        if response.status == 206:
+            cr = parseContentRange(response.getheader('content-range'))
+            if cr is None or cr[0] != offset:
+                raise WrongContentRange(response.getheader('content-range'))
+            total = cr[2]
+        else:
+            # the server ignored the range, or the content has changed
+            offset = 0
+            length = response.getheader('content-length')
+            total = int(length) if length else None
+        info = {'etag': response.getheader('etag'), 'offset': None}
+        preallocate = self.preallocate and total is not None
+        if offset:
+            info['offset'] = self.readInfo().get('offset')
+            f = open(self.partName, 'r+b')
+            f.seek(offset)
+        else:
+            if preallocate:
+                info['offset'] = 0
+            self.writeInfo(info)
+            f = open(self.partName, 'wb')
+            if preallocate:
+                f.truncate(total)
+        done = offset
+        start = last = time.time()
+        try:
+            while True:
+                chunk = response.read(self.chunkSize)
+                if not chunk:
+                    break
+                f.write(chunk)
+                done += len(chunk)
+                if self.progressInterval is None or self.out is None:
+                    continue
+                now = time.time()
+                if now - last >= self.progressInterval:
+                    last = now
+                    self.report(done, total, (done - offset) / (now - start))
+                    if info['offset'] is not None:
+                        f.flush()
+                        info['offset'] = done
+                        self.writeInfo(info)
+        finally:
+            f.close()
+            if info['offset'] is not None and info['offset'] != done:
+                info['offset'] = done
+                self.writeInfo(info)
+        if total is not None and done < total:
+            raise IncompleteDownload('%s: %d of %d bytes' % (self.fileName,
+                                                            done, total))
+        self.finish(offset, done, time.time() - start)
+        return True
+
+    def finish(self, offset, done, elapsed):
+        os.rename(self.partName, self.fileName)
+        os.remove(self.infoName)
+        self.size = done
+        if self.out is None:
+            return
+        rate = (done - offset) / elapsed if elapsed > 0 else 0
+        self.out.write('%s%s: %d bytes (%d resumed) in %.3fs, %s\n' % (
+                self.stamp(), self.fileName, done, offset, elapsed,
+                formatRate(rate)))
+
+    def report(self, done, total, rate):
+        if total:
+            progress = '%d of %d bytes (%.1f%%)' % (done, total,
+                                                    100.0 * done / total)
+        else:
+            progress = '%d bytes' % done
+        self.out.write('%s%s: %s, %s\n' % (self.stamp(), self.fileName,
+                                           progress, formatRate(rate)))
@@ -0,0 +1,111 @@
+"""Unit test for download.py"""
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from download import Download, IncompleteDownload, parseContentRange
+
+class FakeResponse(object):
+    """Stands for an httplib.HTTPResponse whose body may be cut short"""
+    def __init__(self, status, body, headers = {}, length = None):
+        self.status = status
+        self.body = StringIO(body)
+        self.headers = dict((k.lower(), v) for k, v in headers.items())
+        if 'content-length' not in self.headers:
+            self.headers['content-length'] = str(length or len(body))
+
+    def getheader(self, name, default = None):
+        return self.headers.get(name.lower(), default)
+
+    def read(self, amt = None):
+        return self.body.read() if amt is None else self.body.read(amt)
+
+class ParseContentRange(unittest.TestCase):
+    def testRange(self):
+        """a byte range should give first, last and total"""
+        self.assertEqual(parseContentRange('bytes 10-19/100'), (10, 19, 100))
+        self.assertEqual(parseContentRange('bytes 10-19/*'), (10, 19, None))
+
+    def testUnsatisfied(self):
+        """'bytes */total' should only give the total"""
+        self.assertEqual(parseContentRange('bytes */100'), (None, None, 100))
+
+    def testInvalid(self):
+        """malformed or missing headers should give None"""
+        self.assertEqual(parseContentRange(None), None)
+        self.assertEqual(parseContentRange('items 1-2/3'), None)
+        self.assertEqual(parseContentRange('bytes a-b/3'), None)
+
+class SaveDownload(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.dir, 'first.txt')
+        self.data = ''.join(chr(i % 256) for i in range(1000))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def download(self, preallocate = False):
+        return Download(self.fileName, chunkSize = 64, preallocate = preallocate,
+                        out = StringIO())
+
+    def interrupted(self, preallocate = False):
+        d = self.download(preallocate)
+        response = FakeResponse(200, self.data[:300], {'ETag': '"v1"'}, 1000)
+        self.assertRaises(IncompleteDownload, d.save, response)
+        return d
+
+    def testComplete(self):
+        """a 200 response should be written to the file, and nothing else left"""
+        d = self.download()
+        self.assertTrue(d.save(FakeResponse(200, self.data)))
+        self.assertEqual(open(self.fileName, 'rb').read(), self.data)
+        self.assertEqual(os.listdir(self.dir), ['first.txt'])
+        self.assertEqual(d.headers(), {})
+
+    def testResume(self):
+        """an interrupted download should be resumed with Range and If-Range"""
+        d = self.interrupted()
+        self.assertEqual(d.headers(), {'Range': 'bytes=300-', 'If-Range': '"v1"'})
+        response = FakeResponse(206, self.data[300:],
+                                {'Content-Range': 'bytes 300-999/1000'})
+        self.assertTrue(d.save(response))
+        self.assertEqual(open(self.fileName, 'rb').read(), self.data)
+
+    def testResumePreallocated(self):
+        """a preallocated file should be resumed from the bytes written"""
+        d = self.interrupted(preallocate = True)
+        self.assertEqual(os.path.getsize(d.partName), 1000)
+        self.assertEqual(d.offset(), 300)
+        response = FakeResponse(206, self.data[300:],
+                                {'Content-Range': 'bytes 300-999/1000'})
+        self.assertTrue(d.save(response))
+        self.assertEqual(open(self.fileName, 'rb').read(), self.data)
+
+    def testRestart(self):
+        """a 200 answer to a range request should replace the partial file"""
+        d = self.interrupted()
+        self.assertTrue(d.save(FakeResponse(200, self.data[::-1])))
+        self.assertEqual(open(self.fileName, 'rb').read(), self.data[::-1])
+
+    def testAlreadyComplete(self):
+        """a 416 for a partial file that has all the bytes should complete it"""
+        d = self.download()
+        self.assertTrue(d.save(FakeResponse(200, self.data)))
+        os.rename(self.fileName, d.partName)
+        d.writeInfo({'etag': None, 'offset': None})
+        response = FakeResponse(416, '', {'Content-Range': 'bytes */1000'})
+        self.assertTrue(d.save(response))
+        self.assertTrue(os.path.exists(self.fileName))
+
+    def testUnsatisfiable(self):
+        """a 416 for a shorter content should discard the partial file"""
+        d = self.interrupted()
+        response = FakeResponse(416, '', {'Content-Range': 'bytes */200'})
+        self.assertFalse(d.save(response))
+        self.assertEqual(d.headers(), {})
+        self.assertEqual(os.listdir(self.dir), [])
+
+if __name__ == '__main__':
+    unittest.main()
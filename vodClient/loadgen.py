@@ -0,0 +1,312 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+loadgen benchmarks the oracles with many concurrent virtual clients, each
+one a quiet TcpClient (or DnsClient) that doesn't serve what it downloads.
+Contents are picked from a catalog with Zipf-distributed popularity (the
+first content is the most popular).
+In closed loop mode, each virtual client sends its next request as soon as
+the previous one is complete (after an optional exponential think time). In
+open loop mode, requests arrive as a Poisson process at a fixed rate, and are
+handed to the first idle virtual client; their latency is measured from the
+arrival, so that the time spent waiting for a client is accounted for.
+The latency percentiles of the redirects (or DNS resolutions), of the
+downloads and of the whole requests are reported at the end.
+"""
+import os
+import sys
+import json
+import time
+import random
+import bisect
+import shutil
+import tempfile
+import argparse
+import threading
+import Queue
+from tcpclient import TcpClient
+from dnsclient import DnsClient
+from resolver import Resolver
+
+def readCatalog(path):
+    """Reads the content names listed in path, one per line (anything after
+    the name, like its size, is ignored), most popular first"""
+    catalog = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                catalog.append(line.split()[0])
+    return catalog
+
+def percentile(values, q):
+    """Nearest-rank percentile of the sorted list values"""
+    if not values:
+        return None
+    rank = int(q * len(values) + 0.5)
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+class Zipf(object):
+    """Picks an index in [0, n) with probability proportional to 1/(i+1)**s"""
+    def __init__(self, n, s = 1.0, rng = random):
+        self.rng = rng
+        self.cumulative = []
+        total = 0.0
+        for i in range(n):
+            total += 1.0 / (i + 1) ** s
+            self.cumulative.append(total)
+
+    def sample(self):
+        x = self.rng.random() * self.cumulative[-1]
+        return min(bisect.bisect_right(self.cumulative, x),
+                   len(self.cumulative) - 1)
+
+
+class Results(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.redirect = []
+        self.download = []
+        self.total = []
+        self.queue = []
+        self.bytes = 0
+        self.errors = {}
+        self.dropped = 0
+        self.started = time.time()
+        self.stopped = None
+
+    def record(self, redirect, download, total, size, queue = None):
+        with self.lock:
+            if redirect is not None:
+                self.redirect.append(redirect)
+            self.download.append(download)
+            self.total.append(total)
+            if queue is not None:
+                self.queue.append(queue)
+            self.bytes += size or 0
+
+    def error(self, e):
+        name = e.__class__.__name__
+        with self.lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self):
+        elapsed = (self.stopped or time.time()) - self.started
+        done = len(self.total)
+        summary = {'elapsed': elapsed,
+                   'requests': done,
+                   'errors': dict(self.errors),
+                   'dropped': self.dropped,
+                   'requests_per_second': done / elapsed if elapsed else 0,
+                   'bytes_per_second': self.bytes / elapsed if elapsed else 0}
+        for name in 'redirect', 'download', 'total', 'queue':
+            values = sorted(getattr(self, name))
+            if not values:
+                continue
+            summary[name + '_ms'] = {
+                    'count': len(values),
+                    'mean': 1000 * sum(values) / len(values),
+                    'p50': 1000 * percentile(values, 0.5),
+                    'p99': 1000 * percentile(values, 0.99),
+                    'p999': 1000 * percentile(values, 0.999),
+                    'max': 1000 * values[-1]}
+        return summary
+
+
+class LoadGenerator(object):
+    def __init__(self, catalog, clients = 10, mode = 'tcp', targetPort = 9003,
+                 zipf = 1.0, rate = None, thinkTime = 0, duration = 10,
+                 requests = None, redirectTTL = 0, directory = None,
+                 seed = None):
+        self.catalog = catalog
+        self.clients = clients
+        self.mode = mode
+        self.targetPort = targetPort
+        # requests per second in open loop mode, None for closed loop
+        self.rate = rate
+        # mean seconds between two requests of a client in closed loop mode
+        self.thinkTime = thinkTime
+        # the run stops after duration seconds or requests requests
+        self.duration = duration
+        self.requests = requests
+        # cached redirects (or DNS answers) would spare the oracle, disabled
+        # by default
+        self.redirectTTL = redirectTTL
+        self.directory = directory
+        self.random = random.Random(seed)
+        self.popularity = Zipf(len(catalog), zipf, self.random)
+        self.sent = 0
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+
+    def makeClient(self, directory):
+        if self.mode == 'dns':
+            client = DnsClient(serve = False, verbose = False,
+                               directory = directory,
+                               resolver = Resolver(maxTTL = self.redirectTTL))
+            # DnsClient asks for name.txt at name + baseDomain
+            client.catalog = [os.path.splitext(c)[0] for c in self.catalog]
+            return lambda index: client.requestContent(index)
+        client = TcpClient(None, self.targetPort, 1, self.redirectTTL,
+                           serve = False, verbose = False, directory = directory)
+        return lambda index: client.requestContent(self.catalog[index])
+
+    def take(self):
+        """Counts a new request, returns False once the run is over"""
+        with self.lock:
+            if self.stop.is_set():
+                return False
+            if self.duration is not None and time.time() > self.deadline:
+                self.stop.set()
+                return False
+            if self.requests is not None and self.sent >= self.requests:
+                self.stop.set()
+                return False
+            self.sent += 1
+            return True
+
+    def request(self, client, index, arrival = None):
+        start = time.time()
+        try:
+            redirect, download, size = client(index)
+        except Exception as e:
+            self.results.error(e)
+            return
+        now = time.time()
+        if arrival is None:
+            self.results.record(redirect, download, now - start, size)
+        else:
+            self.results.record(redirect, download, now - arrival, size,
+                                start - arrival)
+
+    def closedLoop(self, client):
+        while self.take():
+            self.request(client, self.popularity.sample())
+            if self.thinkTime:
+                self.stop.wait(self.random.expovariate(1.0 / self.thinkTime))
+
+    def openLoopWorker(self, client):
+        while True:
+            item = self.arrivals.get()
+            if item is None:
+                return
+            self.request(client, item[1], item[0])
+
+    def openLoop(self):
+        """Generates the arrivals, at self.rate per second on average"""
+        arrival = time.time()
+        while self.take():
+            arrival += self.random.expovariate(self.rate)
+            delay = arrival - time.time()
+            if delay > 0:
+                self.stop.wait(delay)
+            try:
+                self.arrivals.put_nowait((arrival, self.popularity.sample()))
+            except Queue.Full:
+                # the clients can't keep up, this is not going to end well
+                self.results.dropped += 1
+        for i in range(self.clients):
+            self.arrivals.put(None)
+
+    def run(self):
+        base = self.directory or tempfile.mkdtemp(prefix = 'loadgen')
+        self.results = Results()
+        self.deadline = time.time() + (self.duration or 0)
+        threads = []
+        if self.rate is None:
+            target = self.closedLoop
+        else:
+            target = self.openLoopWorker
+            self.arrivals = Queue.Queue(self.clients * 100)
+            threads.append(threading.Thread(target = self.openLoop))
+        try:
+            for i in range(self.clients):
+                directory = os.path.join(base, str(i))
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                threads.append(threading.Thread(target = target,
+                        args = (self.makeClient(directory),)))
+            for t in threads:
+                t.daemon = True
+                t.start()
+            while any(t.is_alive() for t in threads):
+                threads[-1].join(0.2)
+        except KeyboardInterrupt:
+            self.stop.set()
+        finally:
+            self.results.stopped = time.time()
+            if self.directory is None:
+                shutil.rmtree(base, ignore_errors = True)
+        return self.results.summary()
+
+def report(summary, out = sys.stdout):
+    out.write('%d requests in %.1fs: %.1f req/s, %.2f MB/s\n' % (
+            summary['requests'], summary['elapsed'],
+            summary['requests_per_second'],
+            summary['bytes_per_second'] / 1000000.0))
+    if summary['errors']:
+        out.write('errors: %s\n' % ', '.join('%s %d' % item
+                  for item in sorted(summary['errors'].items())))
+    if summary['dropped']:
+        out.write('dropped arrivals: %d\n' % summary['dropped'])
+    out.write('%-10s %8s %9s %9s %9s %9s %9s\n' % ('(ms)', 'count', 'mean',
+                                                   'p50', 'p99', 'p999', 'max'))
+    for name in 'redirect', 'download', 'total', 'queue':
+        s = summary.get(name + '_ms')
+        if s is not None:
+            out.write('%-10s %8d %9.2f %9.2f %9.2f %9.2f %9.2f\n' % (name,
+                      s['count'], s['mean'], s['p50'], s['p99'], s['p999'],
+                      s['max']))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'VoD oracle load generator')
+    parser.add_argument('--mode', choices = ['tcp', 'dns'], default = 'tcp')
+    parser.add_argument('--port', type = int, default = 9003,
+                        help = 'port of the VoD server (tcp mode)')
+    parser.add_argument('--clients', type = int, default = 10,
+                        help = 'number of virtual clients')
+    parser.add_argument('--catalog', help = 'file listing the contents, most '
+                        'popular first (default: first.txt, second.txt)')
+    parser.add_argument('--zipf', type = float, default = 1.0,
+                        help = 'exponent of the content popularity')
+    parser.add_argument('--rate', type = float,
+                        help = 'open loop: requests per second')
+    parser.add_argument('--think', type = float, default = 0,
+                        help = 'closed loop: mean think time in seconds')
+    parser.add_argument('--duration', type = float, default = 10)
+    parser.add_argument('--requests', type = int,
+                        help = 'stop after this many requests')
+    parser.add_argument('--redirect-ttl', type = float, default = 0,
+                        help = 'seconds redirects (or DNS answers) are cached '
+                        'by the clients')
+    parser.add_argument('--dir', help = 'keep the downloads in this directory')
+    parser.add_argument('--seed', type = int)
+    parser.add_argument('--json', help = 'also write the results to this file')
+    args = parser.parse_args()
+    if args.catalog:
+        catalog = readCatalog(args.catalog)
+    else:
+        catalog = ['first.txt', 'second.txt']
+    generator = LoadGenerator(catalog, args.clients, args.mode, args.port,
+                              args.zipf, args.rate, args.think,
+                              args.duration if args.requests is None else None,
+                              args.requests, args.redirect_ttl, args.dir,
+                              args.seed)
+    summary = generator.run()
+    report(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent = 2, sort_keys = True)
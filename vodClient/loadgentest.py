@@ -0,0 +1,52 @@
+"""Unit test for loadgen.py"""
+import random
+import unittest
+from loadgen import Zipf, Results, percentile
+
+class ZipfTest(unittest.TestCase):
+    def testRange(self):
+        """samples should be valid indexes of the catalog"""
+        zipf = Zipf(5, 1.0, random.Random(1))
+        for i in range(1000):
+            self.assertTrue(0 <= zipf.sample() < 5)
+
+    def testPopularity(self):
+        """with s = 1 and two contents, the first should be picked 2/3 of the time"""
+        zipf = Zipf(2, 1.0, random.Random(1))
+        first = sum(1 for i in range(30000) if zipf.sample() == 0)
+        self.assertAlmostEqual(first / 30000.0, 2 / 3.0, places = 2)
+
+    def testUniform(self):
+        """with s = 0 all the contents should be equally popular"""
+        zipf = Zipf(4, 0, random.Random(1))
+        counts = [0] * 4
+        for i in range(40000):
+            counts[zipf.sample()] += 1
+        for n in counts:
+            self.assertAlmostEqual(n / 40000.0, 0.25, places = 2)
+
+class ResultsTest(unittest.TestCase):
+    def testPercentile(self):
+        """percentiles should use the nearest rank"""
+        values = range(1, 1001)
+        self.assertEqual(percentile(values, 0.5), 500)
+        self.assertEqual(percentile(values, 0.99), 990)
+        self.assertEqual(percentile(values, 0.999), 999)
+        self.assertEqual(percentile([7], 0.999), 7)
+        self.assertEqual(percentile([], 0.5), None)
+
+    def testSummary(self):
+        """redirects should only be counted for the requests that had one"""
+        results = Results()
+        results.record(0.001, 0.010, 0.011, 100)
+        results.record(None, 0.020, 0.020, 100)
+        results.error(IOError())
+        summary = results.summary()
+        self.assertEqual(summary['requests'], 2)
+        self.assertEqual(summary['redirect_ms']['count'], 1)
+        self.assertEqual(summary['download_ms']['max'], 20)
+        self.assertEqual(summary['errors'], {'IOError': 1})
+        self.assertFalse('queue_ms' in summary)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+resolver resolves names with a minimal DNS client over UDP, so that the TTL
+of the answers is known (socket.gethostbyname hides it), and caches them for
+as long as their TTL allows, maxTTL seconds at most. A maxTTL of 0 disables
+the cache.
+Queries are sent to nameserver, the first one in /etc/resolv.conf by
+default, and sent again after timeout seconds, retries times. When no answer
+comes back the name is resolved by the system instead, and isn't cached.
+"""
+import socket
+import struct
+import random
+import time
+
+class DnsError(Exception): pass
+
+def readNameserver(path = '/etc/resolv.conf'):
+    """Returns the first nameserver listed in path, or None"""
+    try:
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    return fields[1]
+    except IOError:
+        pass
+    return None
+
+def buildQuery(name, ident):
+    """A recursive query for the A record of name"""
+    header = struct.pack('!HHHHHH', ident, 0x0100, 1, 0, 0, 0)
+    question = ''.join(chr(len(label)) + label
+                       for label in name.rstrip('.').split('.'))
+    return header + question + '\x00' + struct.pack('!HH', 1, 1)
+
+def skipName(data, pos):
+    """Returns the position following the (maybe compressed) name at pos"""
+    while True:
+        if pos >= len(data):
+            raise DnsError('truncated name')
+        length = ord(data[pos])
+        if length & 0xc0 == 0xc0:
+            return pos + 2
+        if length == 0:
+            return pos + 1
+        pos += 1 + length
+
+def parseResponse(data, ident):
+    """Returns the addresses in the answer to the query ident, and its TTL
+    (the smallest of the records, CNAMEs included)"""
+    if len(data) < 12:
+        raise DnsError('truncated header')
+    rid, flags, qdcount, ancount = struct.unpack('!HHHH', data[:8])
+    if rid != ident:
+        raise DnsError('answer to another query')
+    if not flags & 0x8000:
+        raise DnsError('not a response')
+    if flags & 0xf:
+        raise DnsError('error code %d' % (flags & 0xf))
+    pos = 12
+    for i in range(qdcount):
+        pos = skipName(data, pos) + 4
+    addresses = []
+    ttl = None
+    for i in range(ancount):
+        pos = skipName(data, pos)
+        if pos + 10 > len(data):
+            raise DnsError('truncated record')
+        rtype, rclass, rttl, rdlength = struct.unpack('!HHIH', data[pos:pos+10])
+        pos += 10
+        rdata = data[pos:pos+rdlength]
+        pos += rdlength
+        if rclass != 1:
+            continue
+        if rtype == 1 and rdlength == 4:
+            addresses.append(socket.inet_ntoa(rdata))
+        elif rtype != 5:
+            continue
+        ttl = rttl if ttl is None else min(ttl, rttl)
+    return addresses, ttl or 0
+
+
+class Resolver(object):
+    def __init__(self, nameserver = None, port = 53, timeout = 1.0,
+                 retries = 2, maxTTL = 300, clock = time.time):
+        if nameserver is None:
+            nameserver = readNameserver()
+        self.nameserver = nameserver
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.maxTTL = maxTTL
+        self.clock = clock
+        # name -> (address, expiry)
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, name):
+        """Returns the address of name, and True if it came from the cache"""
+        now = self.clock()
+        entry = self.cache.get(name)
+        if entry is not None:
+            if entry[1] > now:
+                self.hits += 1
+                return entry[0], True
+            del self.cache[name]
+        self.misses += 1
+        address, ttl = self.query(name)
+        ttl = min(ttl, self.maxTTL)
+        if ttl > 0:
+            self.cache[name] = (address, now + ttl)
+        return address, False
+
+    def forget(self, name):
+        """Drops the cached address of name, e.g. when it didn't answer"""
+        self.cache.pop(name, None)
+
+    def query(self, name):
+        """Returns the address of name and its TTL"""
+        if self.nameserver is not None:
+            try:
+                return self.ask(name)
+            except (socket.error, DnsError):
+                pass
+        return socket.gethostbyname(name), 0
+
+    def ask(self, name):
+        """Queries the nameserver, returns the first address and the TTL"""
+        ident = random.randrange(1 << 16)
+        query = buildQuery(name, ident)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(self.timeout)
+        try:
+            for attempt in range(self.retries + 1):
+                sock.sendto(query, (self.nameserver, self.port))
+                try:
+                    while True:
+                        data, peer = sock.recvfrom(4096)
+                        # ignore the late answers to earlier queries
+                        if data[:2] == query[:2]:
+                            break
+                except socket.timeout:
+                    continue
+                addresses, ttl = parseResponse(data, ident)
+                if not addresses:
+                    raise DnsError('no address for ' + name)
+                return addresses[0], ttl
+            raise DnsError('no answer from ' + self.nameserver)
+        finally:
+            sock.close()
@@ -0,0 +1,108 @@
+"""Unit test for resolver.py"""
+import socket
+import struct
+import threading
+import unittest
+from resolver import Resolver, DnsError, buildQuery, parseResponse
+
+def answer(query, records, rcode = 0):
+    """A response to query: records are (type, ttl, rdata), all for the
+    question name (compressed as a pointer to it)"""
+    ident = query[:2]
+    header = ident + struct.pack('!HHHHH', 0x8180 | rcode, 1, len(records), 0, 0)
+    body = query[12:]
+    for rtype, ttl, rdata in records:
+        body += '\xc0\x0c' + struct.pack('!HHIH', rtype, 1, ttl, len(rdata)) + rdata
+    return header + body
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class Parse(unittest.TestCase):
+    def testQuery(self):
+        """buildQuery should ask for the A record of the name"""
+        query = buildQuery('first.bogusvod.com', 7)
+        self.assertEqual(query[:2], '\x00\x07')
+        self.assertEqual(query[12:], '\x05first\x08bogusvod\x03com\x00\x00\x01\x00\x01')
+
+    def testAnswer(self):
+        """parseResponse should return the addresses and the smallest TTL"""
+        query = buildQuery('first.bogusvod.com', 7)
+        data = answer(query, [(5, 30, '\x03abc\xc0\x0c'),
+                              (1, 10, socket.inet_aton('10.0.0.2'))])
+        self.assertEqual(parseResponse(data, 7), (['10.0.0.2'], 10))
+
+    def testErrors(self):
+        """parseResponse should reject errors and answers to other queries"""
+        query = buildQuery('first.bogusvod.com', 7)
+        self.assertRaises(DnsError, parseResponse, answer(query, [], 3), 7)
+        self.assertRaises(DnsError, parseResponse, answer(query, []), 8)
+        self.assertRaises(DnsError, parseResponse, answer(query, [])[:10], 7)
+
+class Cache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.queries = 0
+        self.ttl = 5
+
+    def resolver(self, maxTTL = 300):
+        resolver = Resolver('127.0.0.1', maxTTL = maxTTL, clock = self.clock)
+        def query(name):
+            self.queries += 1
+            return '10.0.0.%d' % self.queries, self.ttl
+        resolver.query = query
+        return resolver
+
+    def testTTL(self):
+        """answers should be cached until their TTL expires"""
+        resolver = self.resolver()
+        self.assertEqual(resolver.resolve('a'), ('10.0.0.1', False))
+        self.clock.now += 4
+        self.assertEqual(resolver.resolve('a'), ('10.0.0.1', True))
+        self.clock.now += 2
+        self.assertEqual(resolver.resolve('a'), ('10.0.0.2', False))
+        self.assertEqual((resolver.hits, resolver.misses), (1, 2))
+
+    def testNoCache(self):
+        """a TTL or a maxTTL of 0 should not be cached"""
+        resolver = self.resolver(maxTTL = 0)
+        resolver.resolve('a')
+        self.assertEqual(resolver.resolve('a'), ('10.0.0.2', False))
+        self.ttl = 0
+        resolver = self.resolver()
+        resolver.resolve('a')
+        self.assertEqual(resolver.resolve('a'), ('10.0.0.4', False))
+
+    def testForget(self):
+        """forget should drop the cached answer"""
+        resolver = self.resolver()
+        resolver.resolve('a')
+        resolver.forget('a')
+        self.assertEqual(resolver.resolve('a'), ('10.0.0.2', False))
+
+class Query(unittest.TestCase):
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.thread = threading.Thread(target = self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.close()
+
+    def serve(self):
+        query, peer = self.server.recvfrom(512)
+        self.server.sendto(answer(query, [(1, 20, socket.inet_aton('10.0.0.9'))]), peer)
+
+    def testAsk(self):
+        """ask should send the query to the nameserver and parse its answer"""
+        resolver = Resolver('127.0.0.1', self.server.getsockname()[1], timeout = 2)
+        self.assertEqual(resolver.ask('first.bogusvod.com'), ('10.0.0.9', 20))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,328 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+swarmclient downloads a content from several P2P sources at once. Sources are
+gathered the way tcpclient finds one: an HTTP GET is sent to the VoD server,
+and the oracle answers with a redirect to a source, and the other sources it
+knows in an X-Sources header. Redirects are requested again until numSources
+sources are known or no new one shows up.
+The content is split in pieces of pieceSize bytes, which are fetched with
+Range requests, one connection per source, and written in place in
+fileName.part. A source that runs out of pieces takes over the second half of
+the piece that would take longest to complete, so that the slowest source
+doesn't hold up the end of the download.
+"""
+import httplib
+import socket
+import threading
+import time
+import os
+import sys
+from collections import deque
+from download import parseContentRange, formatRate, CHUNK_SIZE
+from download import IncompleteDownload, WrongContentRange
+
+class NoSourceFound(Exception): pass
+class WrongHttpResponse(Exception): pass
+
+class Piece(object):
+    """Bytes [pos, end) of the content, still to be written by owner"""
+    __slots__ = ('pos', 'end', 'owner')
+
+    def __init__(self, pos, end, owner = None):
+        self.pos = pos
+        self.end = end
+        self.owner = owner
+
+
+class Peer(object):
+    def __init__(self, location, port):
+        self.location = location
+        self.port = int(port)
+        self.conn = None
+        self.bytes = 0
+        # seconds spent waiting for and receiving pieces
+        self.elapsed = 0.0
+        self.pieces = 0
+        self.stolen = 0
+        self.failed = False
+
+    def __str__(self):
+        return '%s:%d' % (self.location, self.port)
+
+    def rate(self):
+        return self.bytes / self.elapsed if self.elapsed > 0 else 0
+
+    def connection(self):
+        if self.conn is None:
+            self.conn = httplib.HTTPConnection(self.location, self.port)
+        return self.conn
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class SwarmClient(object):
+    def __init__(self, targetPort, numSources = 4, pieceSize = 1 << 20,
+                 readSize = CHUNK_SIZE, maxRedirects = 8, progressInterval = 1.0):
+        self.targetPort = targetPort
+        self.numSources = numSources
+        self.pieceSize = pieceSize
+        self.readSize = readSize
+        # redirects requested at most to find numSources sources
+        self.maxRedirects = maxRedirects
+        self.progressInterval = progressInterval
+        self.baseDomain = 'bogusdomain.com'
+        self.lock = threading.Condition()
+
+    def parseSource(self, source):
+        source = source.strip()
+        sep = source.rfind(':')
+        if sep == -1:
+            # learned sources are listed without port
+            return source, self.targetPort
+        return source[:sep], int(source[sep+1:])
+
+    def findSources(self, fileName):
+        """Returns the (location, port) of up to numSources sources of fileName"""
+        sources = []
+        for i in range(self.maxRedirects):
+            conn = httplib.HTTPConnection(self.baseDomain, self.targetPort)
+            try:
+                conn.request("GET", fileName)
+                response = conn.getresponse()
+                if response.status != 307:
+                    break
+                found = [response.getheader('location')]
+                found += (response.getheader('x-sources') or '').split(',')
+            finally:
+                # the oracle answered in place of the server, don't reuse this
+                conn.close()
+            new = 0
+            for source in found:
+                if source.strip():
+                    source = self.parseSource(source)
+                    if source not in sources:
+                        sources.append(source)
+                        new += 1
+            if len(sources) >= self.numSources or new == 0:
+                break
+        if not sources:
+            raise NoSourceFound(fileName)
+        return sources[:self.numSources]
+
+    def contentSize(self, fileName, peers):
+        """Returns the size of fileName, as told by the first peer that
+        answers a HEAD request"""
+        for peer in peers:
+            try:
+                conn = peer.connection()
+                conn.request("HEAD", fileName)
+                response = conn.getresponse()
+                response.read()
+                if response.will_close:
+                    peer.close()
+                length = response.getheader('content-length')
+                if response.status == 200 and length is not None:
+                    return int(length)
+            except (httplib.HTTPException, socket.error):
+                peer.close()
+            peer.failed = True
+        raise NoSourceFound(fileName)
+
+    def requestContent(self, fileName):
+        start = time.time()
+        peers = [Peer(location, port) for location, port in self.findSources(fileName)]
+        print self.getTimeStamp(), 'Sources:', ', '.join(str(p) for p in peers)
+        self.size = self.contentSize(fileName, peers)
+        peers = [p for p in peers if not p.failed]
+        self.fileName = fileName
+        self.partName = fileName + '.part'
+        self.pending = deque(Piece(pos, min(pos + self.pieceSize, self.size))
+                             for pos in range(0, self.size, self.pieceSize))
+        self.active = []
+        self.received = 0
+        with open(self.partName, 'wb') as f:
+            f.truncate(self.size)
+        threads = []
+        for peer in peers:
+            thread = threading.Thread(target = self.fetch, args = (peer,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        last = time.time()
+        while any(t.is_alive() for t in threads):
+            threads[0].join(0.1)
+            if self.progressInterval is not None and time.time() - last >= self.progressInterval:
+                last = time.time()
+                self.report(peers, last - start)
+        if self.pending or self.active:
+            raise IncompleteDownload('%s: all the sources failed' % fileName)
+        os.rename(self.partName, fileName)
+        elapsed = time.time() - start
+        print self.getTimeStamp(), '%s: %d bytes in %.3fs, %s from %d sources' % (
+                fileName, self.size, elapsed, formatRate(self.size / elapsed),
+                len([p for p in peers if p.bytes]))
+        for peer in peers:
+            print self.getTimeStamp(), '  %s: %d bytes, %d pieces (%d stolen), %s%s' % (
+                    peer, peer.bytes, peer.pieces, peer.stolen,
+                    formatRate(peer.rate()), ' (failed)' if peer.failed else '')
+
+    def nextPiece(self, peer):
+        """Returns the next piece peer should fetch, or None once the download
+        is complete. Waits while the only pieces left are too small to be
+        split and a failing peer might still hand them back."""
+        with self.lock:
+            while True:
+                if self.pending:
+                    piece = self.pending.popleft()
+                    piece.owner = peer
+                    self.active.append(piece)
+                    return piece
+                if not self.active:
+                    return None
+                # take half of the piece that would be completed last
+                slowest = None
+                longest = 0
+                for piece in self.active:
+                    remaining = piece.end - piece.pos
+                    if remaining < 2 * self.readSize:
+                        continue
+                    rate = piece.owner.rate() or 1
+                    if remaining / float(rate) > longest:
+                        slowest = piece
+                        longest = remaining / float(rate)
+                if slowest is not None:
+                    middle = slowest.pos + (slowest.end - slowest.pos) / 2
+                    piece = Piece(middle, slowest.end, peer)
+                    slowest.end = middle
+                    self.active.append(piece)
+                    peer.stolen += 1
+                    return piece
+                self.lock.wait(0.5)
+
+    def fetch(self, peer):
+        f = open(self.partName, 'r+b')
+        try:
+            while True:
+                piece = self.nextPiece(peer)
+                if piece is None:
+                    return
+                try:
+                    self.fetchPiece(peer, piece, f)
+                except (httplib.HTTPException, socket.error, IncompleteDownload,
+                        WrongContentRange, WrongHttpResponse) as e:
+                    print self.getTimeStamp(), 'Source', peer, 'failed:', repr(e)
+                    peer.close()
+                    peer.failed = True
+                    with self.lock:
+                        self.active.remove(piece)
+                        if piece.pos < piece.end:
+                            piece.owner = None
+                            self.pending.appendleft(piece)
+                        self.lock.notify_all()
+                    return
+                with self.lock:
+                    self.active.remove(piece)
+                    peer.pieces += 1
+                    self.lock.notify_all()
+        finally:
+            f.close()
+
+    def fetchPiece(self, peer, piece, f):
+        start = time.time()
+        pos = piece.pos
+        end = piece.end
+        conn = peer.connection()
+        conn.request("GET", self.fileName,
+                     headers = {'Range': 'bytes=%d-%d' % (pos, end - 1)})
+        response = conn.getresponse()
+        if response.status != 206:
+            raise WrongHttpResponse(str(response.status) + ' ' + response.reason)
+        cr = parseContentRange(response.getheader('content-range'))
+        if cr != (pos, end - 1, self.size):
+            raise WrongContentRange(response.getheader('content-range'))
+        try:
+            while pos < end:
+                data = response.read(min(self.readSize, end - pos))
+                if not data:
+                    raise IncompleteDownload('%s: %d of %d bytes from %s' % (
+                            self.fileName, pos - piece.pos, end - piece.pos, peer))
+                with self.lock:
+                    # the end of the piece may have been taken by another peer
+                    n = max(0, min(len(data), piece.end - pos))
+                    piece.pos = pos + n
+                    self.received += n
+                if n:
+                    f.seek(pos)
+                    f.write(data[:n])
+                pos += len(data)
+                peer.bytes += len(data)
+                if pos < end and piece.pos >= piece.end:
+                    # the rest was stolen, drop the connection with it
+                    peer.close()
+                    break
+            else:
+                if response.will_close:
+                    peer.close()
+        finally:
+            peer.elapsed += time.time() - start
+
+    def report(self, peers, elapsed):
+        with self.lock:
+            received = self.received
+        rates = ', '.join('%s %s' % (p, formatRate(p.rate())) for p in peers
+                          if not p.failed)
+        print self.getTimeStamp(), '%s: %d of %d bytes (%.1f%%), %s [%s]' % (
+                self.fileName, received, self.size,
+                100.0 * received / self.size if self.size else 100.0,
+                formatRate(received / elapsed), rates)
+
+    def getTimeStamp(self):
+        now = time.time()
+        tt = time.localtime(now)
+        return "[%02d/%3s/%04d %02d:%02d:%02d:%04d]" % (
+                tt[2], self.monthname[tt[1]], tt[0], tt[3], tt[4], tt[5],
+                int((now - int(now)) * 1000))
+
+    monthname = [None,
+                 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+if __name__ == "__main__":
+    # first argument is the port to contact for the HTTP request
+    # second argument is the content to download
+    # third argument is the number of sources to download from
+    # fourth argument is the size of the pieces, in bytes
+    if len(sys.argv) > 4:
+        pieceSize = int(sys.argv[4])
+    else:
+        pieceSize = 1 << 20
+    if len(sys.argv) > 3:
+        numSources = int(sys.argv[3])
+    else:
+        numSources = 4
+    if len(sys.argv) > 2:
+        fileName = sys.argv[2]
+    else:
+        fileName = 'first.txt'
+    if len(sys.argv) > 1:
+        targetPort = int(sys.argv[1])
+    else:
+        targetPort = 9003
+    client = SwarmClient(targetPort, numSources, pieceSize)
+    client.requestContent(fileName)
@@ -0,0 +1,221 @@
+"""Unit test for swarmclient.py"""
+import os
+import re
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import BaseHTTPServer
+import SocketServer
+from collections import deque
+from StringIO import StringIO
+from swarmclient import SwarmClient, Peer, Piece, NoSourceFound
+from download import IncompleteDownload
+
+DATA = ''.join(chr(i % 251) for i in range(20000))
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass
+
+class SourceHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """serves DATA whatever the path, slowly (server.delay seconds every 500
+    bytes) or cut short after server.cut bytes of the body if asked to"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.send(False)
+
+    def do_GET(self):
+        self.send(True)
+
+    def send(self, body):
+        first, last = 0, len(DATA) - 1
+        header = self.headers.getheader('Range')
+        if header:
+            first, last = [int(n) for n in header.split('=')[1].split('-')]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (first, last, len(DATA)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(last - first + 1))
+        self.end_headers()
+        if not body:
+            return
+        self.server.requests += 1
+        for pos in range(first, last + 1, 500):
+            if self.server.cut is not None and self.server.sent >= self.server.cut:
+                self.close_connection = 1
+                return
+            block = DATA[pos:min(pos + 500, last + 1)]
+            self.wfile.write(block)
+            self.server.sent += len(block)
+            time.sleep(self.server.delay)
+
+    def log_message(self, format, *args):
+        pass
+
+class OracleHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """redirects to server.sources[0], listing the others in X-Sources"""
+    def do_GET(self):
+        self.server.requests += 1
+        sources = self.server.sources
+        if not sources:
+            self.send_error(404)
+            return
+        self.send_response(307)
+        self.send_header('Location', sources[0])
+        if len(sources) > 1:
+            self.send_header('X-Sources', ', '.join(sources[1:]))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def start(handler, **attrs):
+    server = Server(('127.0.0.1', 0), handler)
+    server.requests = 0
+    for name, value in attrs.items():
+        setattr(server, name, value)
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+class Swarm(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.dir, 'first.txt')
+        self.servers = []
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.dir)
+
+    def source(self, delay = 0, cut = None):
+        server = start(SourceHandler, delay = delay, cut = cut, sent = 0)
+        self.servers.append(server)
+        return server
+
+    def oracle(self, sources):
+        server = start(OracleHandler, sources = sources)
+        self.servers.append(server)
+        return server
+
+    def client(self, sources, **options):
+        oracle = self.oracle(['127.0.0.1:%d' % s.server_address[1] for s in sources])
+        client = SwarmClient(oracle.server_address[1], progressInterval = None,
+                             **options)
+        client.baseDomain = '127.0.0.1'
+        return client
+
+    def testFindSources(self):
+        """the Location and X-Sources of the redirects should give the sources"""
+        oracle = self.oracle(['127.0.0.1:9002', ' 10.0.0.5:9002 ,10.0.0.6', ''])
+        client = SwarmClient(oracle.server_address[1], numSources = 4)
+        client.baseDomain = '127.0.0.1'
+        self.assertEqual(client.findSources('/first.txt'),
+                         [('127.0.0.1', 9002), ('10.0.0.5', 9002),
+                          ('10.0.0.6', oracle.server_address[1])])
+        # asked again for more, until no new source showed up
+        self.assertEqual(oracle.requests, 2)
+        client.numSources = 2
+        self.assertEqual(len(client.findSources('/first.txt')), 2)
+        self.assertEqual(oracle.requests, 3)
+
+    def testNoSource(self):
+        """no redirect should mean no source"""
+        oracle = self.oracle([])
+        client = SwarmClient(oracle.server_address[1])
+        client.baseDomain = '127.0.0.1'
+        self.assertRaises(NoSourceFound, client.findSources, '/first.txt')
+
+    def testReassembly(self):
+        """pieces fetched from several sources should make up the content"""
+        sources = [self.source(), self.source()]
+        client = self.client(sources, pieceSize = 1000, readSize = 100)
+        client.requestContent(self.fileName)
+        self.assertEqual(open(self.fileName, 'rb').read(), DATA)
+        self.assertEqual(os.listdir(self.dir), ['first.txt'])
+        # both served some pieces (and the ends of split ones may overlap)
+        self.assertTrue(all(s.sent for s in sources))
+
+    def testSourceFailure(self):
+        """the pieces of a failed source should be fetched from the others"""
+        broken = self.source(cut = 1500)
+        sources = [broken, self.source()]
+        client = self.client(sources, pieceSize = 1000, readSize = 100)
+        client.requestContent(self.fileName)
+        self.assertEqual(open(self.fileName, 'rb').read(), DATA)
+        self.assertTrue('failed' in sys.stdout.getvalue())
+
+    def testAllSourcesFail(self):
+        """the download should fail when every source does"""
+        client = self.client([self.source(cut = 1500)], pieceSize = 1000,
+                             readSize = 100)
+        self.assertRaises(IncompleteDownload, client.requestContent, self.fileName)
+        self.assertFalse(os.path.exists(self.fileName))
+
+    def testTakeover(self):
+        """a fast source should take over the end of a slow source's piece"""
+        slow, fast = self.source(delay = 0.2), self.source()
+        client = self.client([slow, fast], pieceSize = 10000, readSize = 500)
+        client.requestContent(self.fileName)
+        self.assertEqual(open(self.fileName, 'rb').read(), DATA)
+        self.assertTrue(fast.sent > slow.sent)
+        stolen = re.findall(r'\((\d+) stolen\)', sys.stdout.getvalue())
+        self.assertTrue(int(stolen[1]) > 0)
+
+class NextPiece(unittest.TestCase):
+    def setUp(self):
+        self.client = SwarmClient(9003, pieceSize = 1000, readSize = 100)
+        self.client.pending = deque([Piece(0, 1000), Piece(1000, 1500)])
+        self.client.active = []
+        self.slow = Peer('10.0.0.1', 9002)
+        self.fast = Peer('10.0.0.2', 9002)
+
+    def testPending(self):
+        """pending pieces should be handed out first, in order"""
+        piece = self.client.nextPiece(self.slow)
+        self.assertEqual((piece.pos, piece.end, piece.owner), (0, 1000, self.slow))
+        self.assertEqual(self.client.active, [piece])
+
+    def testSplit(self):
+        """with nothing pending, the piece to complete last should be split"""
+        first = self.client.nextPiece(self.slow)
+        second = self.client.nextPiece(self.fast)
+        self.slow.bytes, self.slow.elapsed = 100, 1.0
+        self.fast.bytes, self.fast.elapsed = 10000, 1.0
+        piece = self.client.nextPiece(self.fast)
+        self.assertEqual((piece.pos, piece.end), (500, 1000))
+        self.assertEqual((first.pos, first.end), (0, 500))
+        self.assertEqual(self.fast.stolen, 1)
+        self.assertEqual((second.pos, second.end), (1000, 1500))
+
+    def testTooSmall(self):
+        """pieces too small to split should be left to their owner"""
+        self.client.pending.clear()
+        self.client.active = []
+        self.assertEqual(self.client.nextPiece(self.fast), None)
+        piece = Piece(0, 150, self.slow)
+        self.client.active.append(piece)
+        def finish():
+            time.sleep(0.2)
+            with self.client.lock:
+                self.client.active.remove(piece)
+                self.client.lock.notify_all()
+        threading.Thread(target = finish).start()
+        self.assertEqual(self.client.nextPiece(self.fast), None)
+
+if __name__ == '__main__':
+    unittest.main()
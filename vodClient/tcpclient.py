@@ -16,28 +16,50 @@
 tcpclient will attempt to request content through a normal HTTP GET request,
 which is going to be intercepted by the oracle in the controller. An HTTP
 redirect (code 307) will be sent with the IP address of a P2P source.
+Connections to the sources are kept alive and reused, and redirects are cached
+for each content for redirectTTL seconds, so that repeated requests go straight
+to the last source. Contents are streamed to disk, and interrupted downloads
+are resumed (see download.py).
 """
 import httplib
+import socket
+import time
 import SimpleHTTPServer
 import SocketServer
 import threading
 import sys
+import os
 import datetime
+from download import Download, CHUNK_SIZE
 
 class IndexOutOfRange(Exception): pass
 class WrongHttpResponse(Exception): pass
 
 class TcpClient:
-    def __init__(self, listeningPort, targetPort, numRequests):
+    def __init__(self, listeningPort, targetPort, numRequests, redirectTTL = 30,
+                 chunkSize = CHUNK_SIZE, preallocate = False, serve = True,
+                 verbose = True, directory = '.'):
         self.listeningPort = listeningPort
         self.targetPort = targetPort
         self.numRequests = numRequests
+        self.chunkSize = chunkSize
+        self.preallocate = preallocate
+        self.verbose = verbose
+        # where downloaded contents are written
+        self.directory = directory
+        # content -> (location, port, expiry time) of the last redirect
+        self.redirectTTL = redirectTTL
+        self.redirects = {}
+        # (location, port) -> idle keep-alive HTTPConnection
+        self.pool = {}
         self.catalog = ['first','second']
         self.cached = []
         self.baseDomain = 'bogusdomain.com'
-        self.thread = threading.Thread(target=self.webserver)
-        self.thread.setDaemon(True)
-        self.thread.start()
+        # serve the downloaded contents to other peers
+        if serve:
+            self.thread = threading.Thread(target=self.webserver)
+            self.thread.setDaemon(True)
+            self.thread.start()
         self.monthname = [None,
                  'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
                  'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
@@ -48,29 +70,101 @@ class TcpClient:
         httpd.serve_forever()
         
     def requestContent(self, fileName):
+        """Downloads fileName, and returns the time spent on redirects (None if
+        the content was requested directly from a cached source), the time
+        spent downloading it from the source, and its size."""
+        redirectTime = None
         downloaded = False
         location = self.baseDomain
         port = self.targetPort
+        fromCache = False
+        cached = self.redirects.get(fileName)
+        if cached is not None and cached[2] > time.time():
+            location, port = cached[0], cached[1]
+            fromCache = True
+            self.log('Using cached redirect to', location + ':' + str(port))
+        download = Download(os.path.join(self.directory, fileName),
+                            self.chunkSize, self.preallocate,
+                            progressInterval = 1.0 if self.verbose else None,
+                            stamp = self.getTimeStamp,
+                            out = sys.stdout if self.verbose else None)
         while not downloaded:
-            conn = httplib.HTTPConnection(location, int(port))
-            conn.request("GET", fileName)
-            print self.getTimeStamp(), 'Sent connection request to ' + location+':'+str(port)
-            response = conn.getresponse()
+            sent = time.time()
+            try:
+                conn, response = self.sendRequest(location, port, fileName,
+                                                  download.headers())
+            except (httplib.HTTPException, socket.error):
+                if not fromCache:
+                    raise
+                # the cached source went away, ask the oracle again
+                self.log('Cached source', location + ':' + str(port), 'failed')
+                self.redirects.pop(fileName, None)
+                location = self.baseDomain
+                port = self.targetPort
+                fromCache = False
+                continue
             if response.status == 307:
                 newlocation = response.getheader('location')
-            	sep = newlocation.rfind(':')
-            	location = newlocation[:sep]
-            	port = newlocation[sep+1:]
-            	print self.getTimeStamp(), 'Received http redirect to', location + ':' + port
-            elif response.status == 200:
-                downloaded = True
-                print self.getTimeStamp(), 'Received http 200 OK'
+                # the oracle answered in place of the server, don't reuse this
+                conn.close()
+                sep = newlocation.rfind(':')
+                location = newlocation[:sep]
+                port = newlocation[sep+1:]
+                redirectTime = (redirectTime or 0) + time.time() - sent
+                if self.redirectTTL > 0:
+                    self.redirects[fileName] = (location, port,
+                                                time.time() + self.redirectTTL)
+                self.log('Received http redirect to', location + ':' + port)
+            elif response.status in (200, 206, 416):
+                self.log('Received http', response.status, response.reason)
+                try:
+                    downloaded = download.save(response)
+                except:
+                    conn.close()
+                    raise
+                self.release(location, port, conn, response)
+            elif fromCache:
+                # the cached source doesn't have the content anymore
+                response.read()
+                self.release(location, port, conn, response)
+                self.redirects.pop(fileName, None)
+                location = self.baseDomain
+                port = self.targetPort
+                fromCache = False
             else:
                 raise WrongHttpResponse(str(response.status) + ' ' + response.reason)
-        with open(fileName, 'wb') as out:
-            out.write(response.read())                
-            print self.getTimeStamp(), fileName, 'written succesfully'
-            # self.cached.append(self.catalog[contentIndex])
+        self.log(fileName, 'written succesfully')
+        return redirectTime, time.time() - sent, download.size
+
+    def sendRequest(self, location, port, fileName, headers = {}):
+        """Sends a GET for fileName, on a pooled connection if there is one.
+        Returns the connection and the response."""
+        key = (location, int(port))
+        conn = self.pool.pop(key, None)
+        if conn is not None:
+            try:
+                conn.request("GET", fileName, headers = headers)
+                self.log('Sent request on open connection to ' + location+':'+str(port))
+                return conn, conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                # closed by the server while idle
+                conn.close()
+        conn = httplib.HTTPConnection(location, int(port))
+        conn.request("GET", fileName, headers = headers)
+        self.log('Sent connection request to ' + location+':'+str(port))
+        return conn, conn.getresponse()
+
+    def release(self, location, port, conn, response):
+        """Puts conn back in the pool, once response has been read, unless the
+        server is closing it"""
+        if response.will_close:
+            conn.close()
+        else:
+            self.pool[(location, int(port))] = conn
+
+    def log(self, *args):
+        if self.verbose:
+            print self.getTimeStamp(), ' '.join(str(a) for a in args)
 
     def interactiveShell(self):
     	running = True
@@ -107,6 +201,11 @@ if __name__ == "__main__":
     # second argument is the port to contact for the HTTP request
     # third argument is the number of consecutive requests to send for each content
     # (for the delay measurements across multiple requests)
+    # fourth argument is how long redirects are cached, in seconds (0 to disable)
+    if len(sys.argv) > 4:
+        redirectTTL = float(sys.argv[4])
+    else:
+        redirectTTL = 30
     if len(sys.argv) > 3:
         numRequests = int(sys.argv[3])
     else:
@@ -119,7 +218,7 @@ if __name__ == "__main__":
         listeningPort = int(sys.argv[1])
     else:
         listeningPort = 9001
-    client = TcpClient(listeningPort, targetPort, numRequests)
+    client = TcpClient(listeningPort, targetPort, numRequests, redirectTTL)
     for i in range(numRequests):
         print 'Request', i+1, 'of', numRequests
         client.requestContent("first.txt")
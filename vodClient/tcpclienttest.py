@@ -0,0 +1,130 @@
+"""Unit test for tcpclient.py"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import BaseHTTPServer
+from tcpclient import TcpClient
+from swarmclienttest import DATA, OracleHandler, start
+
+class SourceHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """serves DATA whatever the path on persistent connections, counting
+    them. Answers 404 if server.missing, and drops each connection after its
+    response (as if it had been idle too long) if server.closeIdle"""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.server.missing:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(DATA)))
+        self.end_headers()
+        self.wfile.write(DATA)
+        if self.server.closeIdle:
+            # without a Connection: close header
+            self.close_connection = 1
+
+    def log_message(self, format, *args):
+        pass
+
+def address(server):
+    return '127.0.0.1:%d' % server.server_address[1]
+
+class Client(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.dir)
+
+    def source(self, closeIdle = False):
+        server = start(SourceHandler, connections = 0, missing = False,
+                       closeIdle = closeIdle)
+        self.servers.append(server)
+        return server
+
+    def client(self, source, redirectTTL = 30):
+        self.oracle = start(OracleHandler, sources = [address(source)])
+        self.servers.append(self.oracle)
+        client = TcpClient(0, self.oracle.server_address[1], 1, redirectTTL,
+                           serve = False, verbose = False, directory = self.dir)
+        client.baseDomain = '127.0.0.1'
+        return client
+
+    def fetch(self, client, fileName):
+        redirectTime = client.requestContent(fileName)[0]
+        self.assertEqual(open(os.path.join(self.dir, fileName), 'rb').read(), DATA)
+        return redirectTime
+
+    def testPooled(self):
+        """requests to the same source should reuse its connection"""
+        source = self.source()
+        client = self.client(source)
+        self.fetch(client, 'a.txt')
+        self.fetch(client, 'b.txt')
+        self.assertEqual((source.connections, source.requests), (1, 2))
+        self.assertEqual(self.oracle.requests, 2)
+
+    def testCachedRedirect(self):
+        """a content requested again should go straight to its last source"""
+        source = self.source()
+        client = self.client(source)
+        self.assertNotEqual(self.fetch(client, 'a.txt'), None)
+        self.assertEqual(self.fetch(client, 'a.txt'), None)
+        self.assertEqual((self.oracle.requests, source.requests), (1, 2))
+
+    def testIdleClosed(self):
+        """a pooled connection closed by the server should be replaced"""
+        source = self.source(closeIdle = True)
+        client = self.client(source)
+        self.fetch(client, 'a.txt')
+        time.sleep(0.1)
+        self.fetch(client, 'b.txt')
+        self.assertEqual((source.connections, source.requests), (2, 2))
+
+    def testTTL(self):
+        """a cached redirect should expire after redirectTTL seconds"""
+        client = self.client(self.source(), redirectTTL = 0.2)
+        self.fetch(client, 'a.txt')
+        self.fetch(client, 'a.txt')
+        self.assertEqual(self.oracle.requests, 1)
+        time.sleep(0.3)
+        self.assertNotEqual(self.fetch(client, 'a.txt'), None)
+        self.assertEqual(self.oracle.requests, 2)
+
+    def testCachedSourceDown(self):
+        """the oracle should be asked again when the cached source is gone"""
+        gone, other = self.source(closeIdle = True), self.source()
+        client = self.client(gone)
+        self.fetch(client, 'a.txt')
+        self.servers.remove(gone)
+        gone.shutdown()
+        gone.server_close()
+        self.oracle.sources[:] = [address(other)]
+        self.assertNotEqual(self.fetch(client, 'a.txt'), None)
+        self.assertEqual((self.oracle.requests, other.requests), (2, 1))
+
+    def testCachedSourceMissing(self):
+        """the oracle should be asked again when the cached source lost the content"""
+        stale, other = self.source(), self.source()
+        client = self.client(stale)
+        self.fetch(client, 'a.txt')
+        stale.missing = True
+        self.oracle.sources[:] = [address(other)]
+        self.assertNotEqual(self.fetch(client, 'a.txt'), None)
+        self.assertEqual((stale.requests, other.requests), (2, 1))
+        self.assertEqual(self.oracle.requests, 2)
+
+if __name__ == '__main__':
+    unittest.main()
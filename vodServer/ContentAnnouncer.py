@@ -0,0 +1,166 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Announces the files served by MsHTTPServer to the oracle
+The directory tree is rescanned every interval seconds; changes are sent as
+deltas, a heartbeat is sent when nothing changed and a full snapshot is sent
+every full_every intervals, so that the oracle can recover from lost
+datagrams. See oracle/announce.py for the message format.
+Files being downloaded (name.part, see vodClient/download.py) aren't
+announced as contents; with a chunk_size (the oracle's) the chunks already
+written are announced instead, as MsHTTPServer serves ranges of them.
+"""
+
+__all__ = ["ContentAnnouncer"]
+
+import os
+import json
+import socket
+import threading
+import time
+from ContentCache import partial_size, decodable
+
+# keep each datagram below the usual path MTU
+MAX_DATAGRAM = 1400
+
+class ContentAnnouncer(threading.Thread):
+    def __init__(self, oracle, port, root = None, interval = 5, full_every = 12,
+                 chunk_size = None):
+        """oracle is the host:port address of the oracle's announce listener,
+        port the one we are serving HTTP requests on"""
+        threading.Thread.__init__(self)
+        self.daemon = True
+        host, sep, oraclePort = oracle.rpartition(':')
+        self.oracle = (host, int(oraclePort))
+        self.port = port
+        self.root = root or os.getcwd()
+        self.interval = interval
+        self.full_every = full_every
+        self.seq = 0
+        self.contents = set()
+        self.chunkSize = chunk_size
+        # name -> hex bitmap of the chunks announced of the partial files
+        self.chunks = {}
+        # chunks to send with the next message, if any
+        self.pendingChunks = None
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def scan(self):
+        """returns the set of URL paths (relative to root) of the files served"""
+        return self.scanAll()[0]
+
+    def scanAll(self):
+        """returns the set of URL paths of the files served, and a dict
+        mapping those of the files being downloaded to the number of bytes
+        written"""
+        contents = set()
+        partials = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames
+                           if not d.startswith('.') and decodable(d)]
+            rel = os.path.relpath(dirpath, self.root)
+            for name in filenames:
+                if name.startswith('.') or name.endswith('.part.info'):
+                    continue
+                if not decodable(name):
+                    # can't be sent in JSON, nor requested as UTF-8 by clients
+                    continue
+                path = os.path.join(dirpath, name)
+                if rel != os.curdir:
+                    name = os.path.join(rel, name)
+                name = name.replace(os.sep, '/')
+                if name.endswith('.part'):
+                    written = partial_size(path[:-len('.part')])
+                    if written:
+                        partials[name[:-len('.part')]] = written
+                    continue
+                contents.add(name)
+        return contents, partials
+
+    def chunkMaps(self, partials):
+        """returns the hex bitmaps of the chunks entirely written of the
+        partial files, '0' for those announced before and now gone"""
+        chunks = dict.fromkeys(self.chunks, '0')
+        for name, written in partials.items():
+            count = written // self.chunkSize
+            if count:
+                chunks[name] = '%x' % ((1 << count) - 1)
+        return chunks
+
+    def run(self):
+        beats = 0
+        while True:
+            current, partials = self.scanAll()
+            if self.chunkSize:
+                chunks = self.chunkMaps(partials)
+                if chunks != self.chunks or beats % self.full_every == 0:
+                    self.pendingChunks = chunks
+                self.chunks = dict((name, bitmap) for name, bitmap
+                                   in chunks.items() if bitmap != '0')
+            if beats % self.full_every == 0:
+                self.sendSnapshot(current)
+            else:
+                self.sendDelta(current - self.contents, self.contents - current)
+            self.contents = current
+            beats += 1
+            time.sleep(self.interval)
+
+    def sendSnapshot(self, contents):
+        self.seq += 1
+        parts = self._batches(sorted(contents)) or [[]]
+        for i, batch in enumerate(parts):
+            self._send({'full': True, 'part': i, 'parts': len(parts),
+                        'add': batch})
+
+    def sendDelta(self, added, removed):
+        if not added and not removed:
+            # heartbeat, with the seq of the last delta: the oracle checks
+            # it to notice lost ones
+            self._send({})
+            return
+        for batch in self._batches(sorted(added)):
+            self.seq += 1
+            self._send({'add': batch})
+        for batch in self._batches(sorted(removed)):
+            self.seq += 1
+            self._send({'remove': batch})
+
+    def _batches(self, names):
+        """splits names in lists that fit in a datagram with the headers"""
+        batches = []
+        batch = []
+        size = 100
+        for name in names:
+            size += len(json.dumps(name)) + 2
+            if batch and size > MAX_DATAGRAM:
+                batches.append(batch)
+                batch = []
+                size = 100 + len(json.dumps(name)) + 2
+            batch.append(name)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _send(self, msg):
+        msg['port'] = self.port
+        msg['seq'] = self.seq
+        msg['interval'] = self.interval
+        if self.pendingChunks:
+            msg['chunks'] = self.pendingChunks
+            self.pendingChunks = None
+        try:
+            self.sock.sendto(json.dumps(msg), self.oracle)
+        except socket.error:
+            # the oracle will expire us and pick up our next snapshot
+            pass
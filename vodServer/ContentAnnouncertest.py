@@ -0,0 +1,42 @@
+"""Unit test for ContentAnnouncer.py"""
+import os
+import json
+import shutil
+import socket
+import tempfile
+import unittest
+from ContentAnnouncer import ContentAnnouncer
+
+class Scan(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'sub'))
+        os.mkdir(os.path.join(self.root, 'bad\xfe'))
+        for name in ('a.txt', 'caf\xc3\xa9.txt', 'bad\xff.txt', '.hidden',
+                     os.path.join('sub', 'b.txt'),
+                     os.path.join('bad\xfe', 'c.txt')):
+            open(os.path.join(self.root, name), 'w').close()
+        self.oracle = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.oracle.bind(('127.0.0.1', 0))
+        self.oracle.settimeout(2)
+        self.announcer = ContentAnnouncer('127.0.0.1:%d' % self.oracle.getsockname()[1],
+                                          9002, self.root)
+
+    def tearDown(self):
+        self.oracle.close()
+        shutil.rmtree(self.root)
+
+    def testScan(self):
+        """files not UTF-8 encoded should be skipped, like hidden ones"""
+        self.assertEqual(self.announcer.scan(),
+                         set(['a.txt', 'caf\xc3\xa9.txt', 'sub/b.txt']))
+
+    def testSnapshot(self):
+        """a snapshot should carry the UTF-8 names"""
+        self.announcer.sendSnapshot(self.announcer.scan())
+        msg = json.loads(self.oracle.recv(65535))
+        self.assertEqual(msg['add'], [u'a.txt', u'caf\xe9.txt', u'sub/b.txt'])
+        self.assertEqual((msg['port'], msg['full']), (9002, True))
+
+if __name__ == '__main__':
+    unittest.main()
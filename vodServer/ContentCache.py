@@ -0,0 +1,329 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Metadata index and memory cache of the files served by MsHTTPServer
+ContentIndex maps URL paths to the size, MIME type and ETag of the files
+under the served root, so that requests don't have to translate and stat
+paths. The tree is walked again when the mtime of one of its directories
+changes, which is checked at most every check_interval seconds.
+ContentCache keeps the data of the most recently requested files in memory,
+within a byte budget; a cached file is stat()ed again at most every
+check_interval seconds, to notice files modified in place.
+ListingCache keeps rendered directory listings until the directory or one
+of its entries changes.
+"""
+
+__all__ = ["ContentIndex", "ContentCache", "CachedBody", "ListingCache",
+           "StreamedBody", "make_etag", "partial_size"]
+
+import os
+import json
+import posixpath
+import urllib
+import threading
+import time
+from collections import OrderedDict
+
+def make_etag(size, mtime):
+    return '"%x-%x"' % (int(mtime), size)
+
+def url_key(path):
+    """Normalizes the path of a URL the way translate_path() does"""
+    path = path.split('?', 1)[0].split('#', 1)[0]
+    path = posixpath.normpath(urllib.unquote(path))
+    words = [w for w in path.split('/') if w and w not in (os.curdir, os.pardir)]
+    return '/'.join(words)
+
+def partial_size(path):
+    """Returns how many bytes at the start of path.part are written, for a
+    file being downloaded to path (see vodClient/download.py), or None if
+    there is no such download"""
+    try:
+        with open(path + '.part.info') as f:
+            info = json.load(f)
+        written = info.get('offset')
+        if written is None:
+            # not preallocated: written in order, up to its size
+            written = os.path.getsize(path + '.part')
+        return int(written)
+    except (IOError, OSError, ValueError, TypeError, AttributeError):
+        return None
+
+def decodable(name):
+    """Whether name is UTF-8 encoded, i.e. can be sent in JSON"""
+    try:
+        name.decode('utf-8')
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+class Entry(object):
+    __slots__ = ('key', 'path', 'size', 'mtime', 'ctype', 'etag')
+
+    def __init__(self, key, path, size, mtime, ctype):
+        self.key = key
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.ctype = ctype
+        self.etag = make_etag(size, mtime)
+
+
+class ContentIndex(object):
+    def __init__(self, root, extensions_map, check_interval = 2):
+        self.root = root
+        self.extensions_map = extensions_map
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.dirs = {}
+        self.checked = 0
+        self.refresh()
+
+    def guess_type(self, path):
+        base, ext = posixpath.splitext(path)
+        for e in (ext, ext.lower()):
+            if e in self.extensions_map:
+                return self.extensions_map[e]
+        return self.extensions_map['']
+
+    def lookup(self, path):
+        """Returns the Entry of the file served for the URL path, or None if
+        it's not a file we know of (e.g. a directory without index)"""
+        self._check()
+        return self.entries.get(url_key(path))
+
+    def files(self):
+        """Returns the Entry of every file served, once. They are stat()ed
+        again, so that files appended to or rewritten in place (which
+        doesn't change the mtime of their directory) are up to date."""
+        self._check()
+        files = []
+        for key, entry in self.entries.items():
+            if key != entry.key:
+                # a directory served as its index file
+                continue
+            try:
+                st = os.stat(entry.path)
+            except OSError:
+                continue
+            if make_etag(st.st_size, st.st_mtime) != entry.etag:
+                entry = self.update(entry, st.st_size, st.st_mtime)
+            files.append(entry)
+        return files
+
+    def _check(self):
+        if time.time() - self.checked > self.check_interval:
+            with self.lock:
+                if time.time() - self.checked > self.check_interval:
+                    if self._changed():
+                        self.refresh()
+                    self.checked = time.time()
+
+    def update(self, entry, size, mtime):
+        """Replaces entry after the file was found to be modified in place"""
+        fresh = Entry(entry.key, entry.path, size, mtime, entry.ctype)
+        with self.lock:
+            for key, e in self.entries.items():
+                if e is entry:
+                    self.entries[key] = fresh
+        return fresh
+
+    def _changed(self):
+        for path, mtime in self.dirs.iteritems():
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def refresh(self):
+        entries = {}
+        dirs = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            try:
+                dirs[dirpath] = os.stat(dirpath).st_mtime
+            except OSError:
+                continue
+            rel = os.path.relpath(dirpath, self.root)
+            prefix = '' if rel == os.curdir else rel.replace(os.sep, '/') + '/'
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                key = prefix + name
+                entries[key] = Entry(key, path, st.st_size, st.st_mtime,
+                                     self.guess_type(path))
+            for index in "index.html", "index.htm":
+                if prefix + index in entries:
+                    entries[prefix.rstrip('/')] = entries[prefix + index]
+                    break
+        self.entries = entries
+        self.dirs = dirs
+        self.checked = time.time()
+
+
+class CachedBody(object):
+    """The data of a cached file, served in place of the file object"""
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def close(self):
+        pass
+
+
+class ContentCache(object):
+    """LRU cache of file data, keyed by ETag, within budget bytes. Files
+    larger than max_file bytes are never cached."""
+
+    def __init__(self, budget, max_file = None, check_interval = 2):
+        self.budget = budget
+        self.check_interval = check_interval
+        self.max_file = max_file if max_file is not None else budget / 4
+        self.used = 0
+        self.lock = threading.Lock()
+        self.files = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, entry):
+        key = (entry.path, entry.etag)
+        now = time.time()
+        with self.lock:
+            cached = self.files.pop(key, None)
+            if cached is None:
+                self.misses += 1
+                return None
+            data, checked = cached
+            if now - checked > self.check_interval:
+                try:
+                    st = os.stat(entry.path)
+                except OSError:
+                    st = None
+                if st is None or make_etag(st.st_size, st.st_mtime) != entry.etag:
+                    self.used -= len(data)
+                    self.misses += 1
+                    return None
+                checked = now
+            self.files[key] = (data, checked)
+            self.hits += 1
+        return CachedBody(data)
+
+    def put(self, entry, f):
+        """Reads the open file f for entry into the cache if it fits. Returns
+        a CachedBody on success, None otherwise"""
+        if entry.size > self.max_file or entry.size > self.budget:
+            return None
+        data = f.read()
+        if len(data) != entry.size:
+            # modified while we were reading it
+            return None
+        key = (entry.path, entry.etag)
+        with self.lock:
+            if key not in self.files:
+                while self.files and self.used + len(data) > self.budget:
+                    k, (old, checked) = self.files.popitem(last = False)
+                    self.used -= len(old)
+                self.files[key] = (data, time.time())
+                self.used += len(data)
+        return CachedBody(data)
+
+
+class StreamedBody(object):
+    """A response body made of a list of strings, written one at a time"""
+    __slots__ = ('chunks',)
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __len__(self):
+        return sum(len(c) for c in self.chunks)
+
+    def close(self):
+        pass
+
+
+class ListingCache(object):
+    """Caches directory listings, rendered in chunks of chunk_entries
+    entries, until the mtime of the directory changes, or the size or mtime
+    of one of its entries does (checked at most every check_interval
+    seconds: files written in place don't change their directory). At most
+    max_dirs listings are kept."""
+
+    def __init__(self, chunk_entries = 256, max_dirs = 1024,
+                 check_interval = 2):
+        self.chunk_entries = chunk_entries
+        self.max_dirs = max_dirs
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.listings = OrderedDict()
+
+    def get(self, path, fmt, render):
+        """Returns the rendered chunks of the listing of path in format fmt.
+        render(entries) is called with a slice of (name, isdir, islink, size)
+        sorted case-insensitively, and its position (0 for the first) to
+        render a chunk. Raises os.error if path can't be listed."""
+        mtime = os.stat(path).st_mtime
+        key = (path, fmt)
+        now = time.time()
+        with self.lock:
+            cached = self.listings.pop(key, None)
+            if cached is not None and cached[0] != mtime:
+                cached = None
+            if cached is not None:
+                self.listings[key] = cached
+                if now - cached[2] <= self.check_interval:
+                    return cached[3]
+        entries, mtimes = self._scan(path)
+        if cached is not None and cached[1] == mtimes:
+            # same entries, sizes and mtimes: still valid
+            chunks = cached[3]
+        else:
+            n = self.chunk_entries
+            chunks = [render(entries[i:i + n], i)
+                      for i in range(0, len(entries), n)]
+        with self.lock:
+            self.listings[key] = (mtime, mtimes, now, chunks)
+            while len(self.listings) > self.max_dirs:
+                self.listings.popitem(last = False)
+        return chunks
+
+    def _scan(self, path):
+        """Returns the (name, isdir, islink, size) of the entries of path,
+        and their (name, size, mtime) to tell when they change"""
+        names = os.listdir(path)
+        names.sort(key = str.lower)
+        entries = []
+        mtimes = []
+        for name in names:
+            fullname = os.path.join(path, name)
+            try:
+                st = os.stat(fullname)
+                isdir = os.path.isdir(fullname)
+                size = 0 if isdir else st.st_size
+                mtime = st.st_mtime
+            except OSError:
+                # dangling symlink
+                isdir = False
+                size = 0
+                mtime = None
+            entries.append((name, isdir, os.path.islink(fullname), size))
+            mtimes.append((name, size, mtime))
+        return entries, mtimes
@@ -0,0 +1,151 @@
+"""Unit test for ContentCache.py"""
+import os
+import shutil
+import tempfile
+import unittest
+from ContentCache import ContentIndex, ContentCache, ListingCache, Entry, url_key
+
+EXTENSIONS = {'': 'application/octet-stream', '.html': 'text/html',
+              '.txt': 'text/plain'}
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+class Index(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'sub'))
+        write(os.path.join(self.root, 'a.txt'), 'a' * 10)
+        write(os.path.join(self.root, 'sub', 'index.html'), '<html/>')
+        self.index = ContentIndex(self.root, EXTENSIONS, check_interval = 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testLookup(self):
+        """files should be found by URL path, with their size and type"""
+        entry = self.index.lookup('/a.txt?x=1')
+        self.assertEqual((entry.size, entry.ctype), (10, 'text/plain'))
+        self.assertEqual(self.index.lookup('/sub/../a.txt'), entry)
+        self.assertEqual(self.index.lookup('/missing'), None)
+
+    def testDirectoryIndex(self):
+        """a directory with an index.html should be served as that file"""
+        self.assertEqual(self.index.lookup('/sub/').path,
+                         os.path.join(self.root, 'sub', 'index.html'))
+        self.assertEqual(self.index.lookup('/'), None)
+
+    def testRefresh(self):
+        """files added to a directory should be found once its mtime changes"""
+        write(os.path.join(self.root, 'sub', 'b.txt'), 'b')
+        # some filesystems only keep the mtime to the second
+        os.utime(os.path.join(self.root, 'sub'), (0, 0))
+        self.assertEqual(self.index.lookup('/sub/b.txt').size, 1)
+
+    def testUpdate(self):
+        """update should replace an entry modified in place"""
+        entry = self.index.lookup('/a.txt')
+        fresh = self.index.update(entry, 20, entry.mtime + 1)
+        self.assertEqual(self.index.lookup('/a.txt'), fresh)
+        self.assertNotEqual(fresh.etag, entry.etag)
+
+    def testFiles(self):
+        """files should list each file once, with its current size"""
+        with open(os.path.join(self.root, 'a.txt'), 'ab') as f:
+            f.write('a' * 5)
+        sizes = dict((e.key, e.size) for e in self.index.files())
+        self.assertEqual(sizes, {'a.txt': 15, 'sub/index.html': 7})
+        self.assertEqual(self.index.lookup('/a.txt').size, 15)
+
+class Listing(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        write(os.path.join(self.root, 'a.txt'), 'a' * 10)
+        self.listings = ListingCache(check_interval = 0)
+        self.renders = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def render(self, entries, position):
+        self.renders += 1
+        return ','.join('%s=%d' % (name, size) for name, isdir, islink, size in entries)
+
+    def testCached(self):
+        """an unchanged directory should not be rendered again"""
+        self.assertEqual(self.listings.get(self.root, 'txt', self.render), ['a.txt=10'])
+        self.assertEqual(self.listings.get(self.root, 'txt', self.render), ['a.txt=10'])
+        self.assertEqual(self.renders, 1)
+
+    def testModifiedInPlace(self):
+        """a file written in place should show its new size"""
+        self.listings.get(self.root, 'txt', self.render)
+        with open(os.path.join(self.root, 'a.txt'), 'ab') as f:
+            f.write('a' * 5)
+        self.assertEqual(self.listings.get(self.root, 'txt', self.render), ['a.txt=15'])
+
+class Cache(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = ContentCache(100, max_file = 60, check_interval = 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def entry(self, name, size):
+        path = os.path.join(self.root, name)
+        write(path, 'x' * size)
+        st = os.stat(path)
+        return Entry(name, path, st.st_size, st.st_mtime, 'text/plain')
+
+    def put(self, entry):
+        with open(entry.path, 'rb') as f:
+            return self.cache.put(entry, f)
+
+    def testPutGet(self):
+        """a file put in the cache should be served from memory"""
+        entry = self.entry('a', 50)
+        self.assertEqual(self.cache.get(entry), None)
+        self.assertEqual(self.put(entry).data, 'x' * 50)
+        self.assertEqual(self.cache.get(entry).data, 'x' * 50)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def testTooLarge(self):
+        """files above max_file bytes should never be cached"""
+        self.assertEqual(self.put(self.entry('a', 61)), None)
+        self.assertEqual(self.cache.used, 0)
+
+    def testEviction(self):
+        """the least recently used files should make room for new ones"""
+        a, b, c = self.entry('a', 40), self.entry('b', 40), self.entry('c', 40)
+        self.put(a)
+        self.put(b)
+        self.cache.get(a)
+        self.put(c)
+        self.assertEqual(self.cache.get(b), None)
+        self.assertNotEqual(self.cache.get(a), None)
+        self.assertEqual(self.cache.used, 80)
+
+    def testModified(self):
+        """a file modified in place should no longer be served from the cache"""
+        entry = self.entry('a', 50)
+        self.put(entry)
+        write(entry.path, 'y' * 55)
+        self.assertEqual(self.cache.get(entry), None)
+        self.assertEqual(self.cache.used, 0)
+
+    def testShortRead(self):
+        """a file that changed size since it was indexed should not be cached"""
+        entry = self.entry('a', 50)
+        write(entry.path, 'y' * 10)
+        self.assertEqual(self.put(entry), None)
+
+class UrlKey(unittest.TestCase):
+    def testNormalize(self):
+        """url_key should drop the query, dot segments and escapes"""
+        self.assertEqual(url_key('/a/./b/../c%20d?q#f'), 'a/c d')
+        self.assertEqual(url_key('/../../etc'), 'etc')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,7 +8,7 @@ and HEAD requests in a fairly straightforward manner.
 
 __version__ = "0.6"
 
-__all__ = ["SimpleMsHTTPRequestHandler"]
+__all__ = ["SimpleMsHTTPRequestHandler", "PooledHTTPServer"]
 
 import os
 import posixpath
@@ -19,8 +19,89 @@ import shutil
 import mimetypes
 from StringIO import StringIO
 import MsTimestampServer
+from ContentAnnouncer import ContentAnnouncer
+from Prefetcher import Prefetcher
+from ContentCache import ContentIndex, ContentCache, CachedBody, make_etag
+from ContentCache import ListingCache, StreamedBody, partial_size, decodable
 import sys
 import SocketServer
+import socket
+import threading
+import Queue
+import mmap
+import stat
+import errno
+import select
+import email.utils
+import random
+import json
+import time
+
+# os.sendfile only exists from Python 3.3; without it regular files are sent
+# from an mmap of the file, which still avoids copying them through Python
+# strings block by block
+_sendfile = getattr(os, 'sendfile', None)
+
+# how often an idle persistent connection checks whether other connections
+# are waiting for its worker
+IDLE_CHECK = 0.1
+
+def parse_range_header(header, size):
+    """Parse the value of a Range header for a resource of size bytes.
+
+    Return value is None if the header is not a valid byte range
+    request (and should then be ignored), an empty list if none of
+    the ranges can be satisfied (416), or otherwise the sorted list of
+    (first, last) byte positions to send, with overlapping or adjacent
+    ranges merged.
+
+    """
+    unit, sep, specs = header.partition('=')
+    if not sep or unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    valid = False
+    for spec in specs.split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+        valid = True
+        first, sep, last = spec.partition('-')
+        first = first.strip()
+        last = last.strip()
+        if not sep or not (first.isdigit() or last.isdigit()):
+            return None
+        if not first:
+            # suffix range: the last N bytes
+            if not last.isdigit():
+                return None
+            n = int(last)
+            if n > 0 and size > 0:
+                ranges.append((max(0, size - n), size - 1))
+            continue
+        if not first.isdigit() or (last and not last.isdigit()):
+            return None
+        first = int(first)
+        if last:
+            last = int(last)
+            if last < first:
+                return None
+        else:
+            last = size - 1
+        if first < size:
+            ranges.append((first, min(last, size - 1)))
+    if not valid:
+        # no range at all (e.g. "bytes=" or "bytes=,")
+        return None
+    ranges.sort()
+    merged = []
+    for first, last in ranges:
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
 
 class SimpleMsHTTPRequestHandler(MsTimestampServer.MsHTTPRequestHandler):
 
@@ -38,12 +119,60 @@ class SimpleMsHTTPRequestHandler(MsTimestampServer.MsHTTPRequestHandler):
 
     server_version = "SimpleHTTP/" + __version__
 
+    def setup(self):
+        """Switch to persistent HTTP/1.1 connections if the server has a
+        keep-alive timeout (a connection idle for longer is closed)."""
+        keepalive = getattr(self.server, 'keepalive_timeout', None)
+        if keepalive:
+            self.protocol_version = "HTTP/1.1"
+            self.timeout = keepalive
+        MsTimestampServer.MsHTTPRequestHandler.setup(self)
+
+    def handle(self):
+        """Handle the requests of a connection until it is closed."""
+        self.close_connection = 1
+        self.handle_one_request()
+        while not self.close_connection and self.wait_request():
+            self.handle_one_request()
+
+    def wait_request(self):
+        """Wait for the next request of a persistent connection. Return
+        False if the connection should be closed instead: it stayed idle
+        for the keep-alive timeout, or other connections are waiting for
+        a worker (an idle client mustn't hold one)."""
+        # the start of a pipelined request may be buffered already
+        buffered = getattr(self.rfile, '_rbuf', None)
+        if self.timeout is None or (buffered is not None and buffered.tell()):
+            return True
+        saturated = getattr(self.server, 'saturated', None)
+        deadline = time.time() + self.timeout
+        while True:
+            if saturated is not None and saturated():
+                return False
+            left = deadline - time.time()
+            if left <= 0:
+                return False
+            try:
+                ready = select.select([self.connection], [], [],
+                                      min(left, IDLE_CHECK))[0]
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    return False
+                continue
+            if ready:
+                return True
+
     def do_GET(self):
         """Serve a GET request."""
         f = self.send_head()
         if f:
-            self.copyfile(f, self.wfile)
-            f.close()
+            try:
+                if self.ranges is None:
+                    self.copyfile(f, self.wfile)
+                else:
+                    self.copyranges(f, self.wfile)
+            finally:
+                f.close()
 
     def do_HEAD(self):
         """Serve a HEAD request."""
@@ -51,6 +180,35 @@ class SimpleMsHTTPRequestHandler(MsTimestampServer.MsHTTPRequestHandler):
         if f:
             f.close()
 
+    def do_POST(self):
+        """Serve a POST request: only prefetch orders, to /_prefetch."""
+        if self.path != '/_prefetch':
+            self.send_error(405, "Only /_prefetch accepts POST")
+            return
+        prefetcher = getattr(self.server, 'prefetcher', None)
+        if prefetcher is None:
+            self.send_error(404, "Prefetching is disabled")
+            return
+        if not prefetcher.allows(self.client_address[0]):
+            self.send_error(403, "Not allowed to order prefetches")
+            return
+        try:
+            length = int(self.headers.getheader('content-length', 0))
+            order = json.loads(self.rfile.read(length))
+            content = order['content'].encode('utf-8')
+            url = str(order['url'])
+            rate = order.get('rate')
+            rate = int(rate) if rate else None
+        except (ValueError, TypeError, KeyError, AttributeError):
+            self.send_error(400, "Malformed prefetch order")
+            return
+        code, message = prefetcher.submit(content, url, rate)
+        f = self.send_json({'content': content, 'status': message}, code)
+        try:
+            self.copyfile(f, self.wfile)
+        finally:
+            f.close()
+
     def send_head(self):
         """Common code for GET and HEAD commands.
 
@@ -61,7 +219,26 @@ class SimpleMsHTTPRequestHandler(MsTimestampServer.MsHTTPRequestHandler):
         and must be closed by the caller under all circumstances), or
         None, in which case the caller has nothing further to do.
 
+        If a satisfiable Range was requested, self.ranges is set to
+        the list of (first, last, part header) to send, where the part
+        header is only used for multipart/byteranges responses.
+
+        If the server has a content index, known files are served
+        from its metadata (and cache) without touching the path.
+
         """
+        self.ranges = None
+        if self.path == '/_stats':
+            return self.send_stats()
+        if self.path == '/_catalog':
+            return self.send_catalog()
+        if self.path == '/_prefetch':
+            return self.send_prefetch_status()
+        index = getattr(self.server, 'content_index', None)
+        if index is not None:
+            entry = index.lookup(self.path)
+            if entry is not None:
+                return self.send_entry(index, entry)
         path = self.translate_path(self.path)
         f = None
         if os.path.isdir(path):
@@ -73,20 +250,175 @@ class SimpleMsHTTPRequestHandler(MsTimestampServer.MsHTTPRequestHandler):
             else:
                 return self.list_directory(path)
         ctype = self.guess_type(path)
-        if ctype.startswith('text/'):
-            mode = 'r'
-        else:
-            mode = 'rb'
         try:
-            f = open(path, mode)
+            # binary mode for text files too, so that Content-Length matches
+            f = open(path, 'rb')
         except IOError:
+            return self.send_partial(path, ctype)
+        fs = os.fstat(f.fileno())
+        return self.send_body_head(f, fs.st_size, fs.st_mtime, ctype,
+                                   make_etag(fs.st_size, fs.st_mtime))
+
+    def send_partial(self, path, ctype):
+        """send_head() for a file missing from path: if it is being
+        downloaded here, a request for a single byte range already
+        written (as the oracle redirects to partial sources) gets a 206
+        with an unknown complete length. Anything else is not found."""
+        header = self.headers.getheader('Range')
+        held = partial_size(path) if header else None
+        ranges = None
+        if held:
+            # with one byte more than held, the ranges reaching past what
+            # is written (open and suffix ones included) end on that byte
+            ranges = parse_range_header(header, held + 1)
+        if not ranges or len(ranges) > 1 or ranges[0][1] >= held:
             self.send_error(404, "File not found")
             return None
-        self.send_response(200)
+        try:
+            f = open(path + '.part', 'rb')
+        except IOError:
+            self.send_error(404, "File not found")
+            return None
+        first, last = ranges[0]
+        self.send_response(206)
         self.send_header("Content-type", ctype)
+        self.send_header("Content-Range", "bytes %d-%d/*" % (first, last))
+        self.send_header("Content-Length", str(last - first + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_busy()
+        self.end_headers()
+        self.ranges = [(first, last, None)]
+        return f
+
+    def send_entry(self, index, entry):
+        """send_head() for a file of the content index: the data comes
+        from the server's content cache if it's there, from the file
+        otherwise (and is then added to the cache, if the whole body is
+        sent: a HEAD, range or conditional request doesn't need the data
+        in memory)."""
+        cache = getattr(self.server, 'content_cache', None)
+        body = None
+        if cache is not None:
+            body = cache.get(entry)
+        if body is None:
+            try:
+                f = open(entry.path, 'rb')
+            except IOError:
+                self.send_error(404, "File not found")
+                return None
+            fs = os.fstat(f.fileno())
+            if make_etag(fs.st_size, fs.st_mtime) != entry.etag:
+                # modified in place, the directory mtime didn't change
+                entry = index.update(entry, fs.st_size, fs.st_mtime)
+            if (cache is not None and self.command == 'GET' and
+                    not self.headers.getheader('Range') and
+                    not self.none_match(entry.etag)):
+                body = cache.put(entry, f)
+            if body is None:
+                f.seek(0)
+                body = f
+            else:
+                f.close()
+        return self.send_body_head(body, entry.size, entry.mtime,
+                                   entry.ctype, entry.etag)
+
+    def send_body_head(self, f, size, mtime, ctype, etag):
+        """Send the headers for the body f of size bytes, handling
+        conditional and range requests. Returns f, or None (after
+        closing it) if no body has to be sent."""
+        if self.none_match(etag):
+            f.close()
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_busy()
+            self.end_headers()
+            return None
+        ranges = None
+        header = self.headers.getheader('Range')
+        if header and self.if_range(etag, mtime):
+            ranges = parse_range_header(header, size)
+        if ranges == []:
+            f.close()
+            self.send_response(416)
+            self.send_header("Content-Range", "bytes */%d" % size)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        if not ranges:
+            self.send_response(200)
+            self.send_header("Content-type", ctype)
+            length = size
+        elif len(ranges) == 1:
+            first, last = ranges[0]
+            self.send_response(206)
+            self.send_header("Content-type", ctype)
+            self.send_header("Content-Range",
+                             "bytes %d-%d/%d" % (first, last, size))
+            self.ranges = [(first, last, None)]
+            length = last - first + 1
+        else:
+            boundary = "%032x" % random.getrandbits(128)
+            self.send_response(206)
+            self.send_header("Content-type",
+                             "multipart/byteranges; boundary=" + boundary)
+            self.ranges = []
+            length = 0
+            for first, last in ranges:
+                part = ("\r\n--%s\r\nContent-type: %s\r\n"
+                        "Content-Range: bytes %d-%d/%d\r\n\r\n" %
+                        (boundary, ctype, first, last, size))
+                self.ranges.append((first, last, part))
+                length += len(part) + last - first + 1
+            self.multipart_end = "\r\n--%s--\r\n" % boundary
+            length += len(self.multipart_end)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", self.date_time_string(mtime))
+        self.send_busy()
         self.end_headers()
         return f
 
+    def none_match(self, etag):
+        """Return True if If-None-Match lists etag (the client already
+        has the current version of the file)."""
+        condition = self.headers.getheader('If-None-Match')
+        if not condition:
+            return False
+        for tag in condition.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag == '*' or tag == etag:
+                return True
+        return False
+
+    def if_range(self, etag, mtime):
+        """Return True if the Range header applies, i.e. there is no
+        If-Range header or it matches the current version of the file
+        (a strong ETag, or the exact Last-Modified date)."""
+        condition = self.headers.getheader('If-Range')
+        if not condition:
+            return True
+        condition = condition.strip()
+        if condition.startswith('"') or condition.startswith('W/'):
+            return condition == etag
+        date = email.utils.parsedate_tz(condition)
+        if date is None:
+            return False
+        return email.utils.mktime_tz(date) == int(mtime)
+
+    def copyranges(self, source, outputfile):
+        """Send the byte ranges in self.ranges of the regular file
+        SOURCE, as set up by send_head()."""
+        for first, last, part in self.ranges:
+            if part is not None:
+                outputfile.write(part)
+            outputfile.flush()
+            self.sendfile(source, first, last - first + 1)
+        if len(self.ranges) > 1:
+            outputfile.write(self.multipart_end)
+
     def list_directory(self, path):
         """Helper to produce a directory listing (absent index.html).
 
@@ -94,34 +426,112 @@ class SimpleMsHTTPRequestHandler(MsTimestampServer.MsHTTPRequestHandler):
         error).  In either case, the headers are sent, making the
         interface the same as for send_head().
 
+        The listing is HTML, or a JSON array of name, size, type and
+        dir for each entry if the query string has format=json. It is
+        rendered through the server's listing cache, if it has one,
+        and written to the client in chunks.
+
         """
+        fmt = 'html'
+        query = self.path.partition('?')[2]
+        if 'format=json' in query.split('&'):
+            fmt = 'json'
+        listings = getattr(self.server, 'listing_cache', None)
+        if listings is None:
+            listings = ListingCache(max_dirs = 0)
+        if fmt == 'json':
+            render = self.render_json_entries
+        else:
+            render = self.render_html_entries
         try:
-            list = os.listdir(path)
+            chunks = listings.get(path, fmt, render)
         except os.error:
             self.send_error(404, "No permission to list directory")
             return None
-        list.sort(lambda a, b: cmp(a.lower(), b.lower()))
-        f = StringIO()
-        f.write("<title>Directory listing for %s</title>\n" % self.path)
-        f.write("<h2>Directory listing for %s</h2>\n" % self.path)
-        f.write("<hr>\n<ul>\n")
-        for name in list:
-            fullname = os.path.join(path, name)
+        if fmt == 'json':
+            # a chunk can be empty when none of its names could be sent
+            parts = ["["]
+            for chunk in chunks:
+                if chunk:
+                    if len(parts) > 1:
+                        parts.append(",\n")
+                    parts.append(chunk)
+            body = StreamedBody(parts + ["]\n"])
+            ctype = "application/json"
+        else:
+            title = cgi.escape(urllib.unquote(self.path.partition('?')[0]))
+            body = StreamedBody(
+                ["<title>Directory listing for %s</title>\n" % title +
+                 "<h2>Directory listing for %s</h2>\n" % title +
+                 "<hr>\n<ul>\n"] + chunks + ["</ul>\n<hr>\n"])
+            ctype = "text/html"
+        self.send_response(200)
+        self.send_header("Content-type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_busy()
+        self.end_headers()
+        return body
+
+    def render_html_entries(self, entries, position):
+        lines = []
+        for name, isdir, islink, size in entries:
             displayname = linkname = name = cgi.escape(name)
             # Append / for directories or @ for symbolic links
-            if os.path.isdir(fullname):
+            if isdir:
                 displayname = name + "/"
                 linkname = name + "/"
-            if os.path.islink(fullname):
+            if islink:
                 displayname = name + "@"
                 # Note: a link to a directory displays with @ and links with /
-            f.write('<li><a href="%s">%s</a>\n' % (linkname, displayname))
-        f.write("</ul>\n<hr>\n")
-        f.seek(0)
-        self.send_response(200)
-        self.send_header("Content-type", "text/html")
+            lines.append('<li><a href="%s">%s</a>\n' % (linkname, displayname))
+        return ''.join(lines)
+
+    def render_json_entries(self, entries, position):
+        items = []
+        for name, isdir, islink, size in entries:
+            if not decodable(name):
+                # can't be sent in JSON, like ContentAnnouncer skips it
+                continue
+            items.append(json.dumps({'name': name, 'size': size, 'dir': isdir,
+                                     'type': '' if isdir else self.guess_type(name)},
+                                    sort_keys = True))
+        return ',\n'.join(items)
+
+    def send_catalog(self):
+        """Answers with a JSON object mapping the URL path of every file
+        served to its size, e.g. for the oracle's flow statistics learner."""
+        index = getattr(self.server, 'content_index', None)
+        if index is None:
+            index = ContentIndex(os.getcwd(), self.extensions_map)
+        catalog = dict((e.key, e.size) for e in index.files()
+                       if decodable(e.key))
+        return self.send_json(catalog)
+
+    def send_prefetch_status(self):
+        """Answers with the state of the prefetch orders, see Prefetcher."""
+        prefetcher = getattr(self.server, 'prefetcher', None)
+        if prefetcher is None:
+            self.send_error(404, "Prefetching is disabled")
+            return None
+        return self.send_json(prefetcher.status())
+
+    def send_json(self, obj, code = 200):
+        """Sends the headers of a JSON response, returns its body as a file
+        object, like send_head()."""
+        body = json.dumps(obj, sort_keys = True)
+        self.send_response(code)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_busy()
         self.end_headers()
-        return f
+        return StringIO(body)
+
+    def send_busy(self):
+        """Ask the client to close a persistent connection when other clients
+        are waiting for a worker."""
+        saturated = getattr(self.server, 'saturated', None)
+        if saturated is not None and saturated():
+            self.send_header("Connection", "close")
 
     def translate_path(self, path):
         """Translate a /-separated PATH to the local filename syntax.
@@ -131,6 +541,9 @@ class SimpleMsHTTPRequestHandler(MsTimestampServer.MsHTTPRequestHandler):
         probably be diagnosed.)
 
         """
+        # abandon query parameters
+        path = path.split('?', 1)[0]
+        path = path.split('#', 1)[0]
         path = posixpath.normpath(urllib.unquote(path))
         words = path.split('/')
         words = filter(None, words)
@@ -150,13 +563,70 @@ class SimpleMsHTTPRequestHandler(MsTimestampServer.MsHTTPRequestHandler):
         argument is a file object open for writing (or
         anything with a write() method).
 
-        The only reason for overriding this would be to change
-        the block size or perhaps to replace newlines by CRLF
-        -- note however that this the default server uses this
-        to copy binary data as well.
+        Regular files are sent straight from the file to the socket
+        with sendfile(), streamed bodies (e.g. directory listings) one
+        chunk at a time; anything else is copied with shutil.copyfileobj.
 
         """
-        shutil.copyfileobj(source, outputfile)
+        if isinstance(source, CachedBody):
+            self.sendfile(source, 0, len(source.data))
+            return
+        if isinstance(source, StreamedBody):
+            for chunk in source.chunks:
+                outputfile.write(chunk)
+            return
+        try:
+            st = os.fstat(source.fileno())
+        except (AttributeError, IOError, OSError):
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
+            shutil.copyfileobj(source, outputfile)
+            return
+        outputfile.flush()
+        self.sendfile(source, 0, st.st_size)
+
+    def sendfile(self, f, offset, count):
+        """Send count bytes of the regular file f, starting at offset, to
+        the client without copying them through Python buffers."""
+        if count <= 0:
+            return
+        sock = self.connection
+        if isinstance(f, CachedBody):
+            self.sendbuffer(buffer(f.data, offset, count))
+            return
+        if _sendfile is None:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.sendbuffer(buffer(m, offset, count))
+            finally:
+                m.close()
+            return
+        # with a timeout the socket is non-blocking at the OS level
+        timeout = sock.gettimeout()
+        while count > 0:
+            try:
+                sent = _sendfile(sock.fileno(), f.fileno(), offset, count)
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+                if not select.select([], [sock], [], timeout)[1]:
+                    raise socket.timeout("timed out")
+                continue
+            if sent == 0:
+                break
+            self.count_sent(sent)
+            offset += sent
+            count -= sent
+
+    def sendbuffer(self, data):
+        """Like socket.sendall(data), counting the bytes as they are sent
+        for the statistics."""
+        sock = self.connection
+        sent = 0
+        while sent < len(data):
+            n = sock.send(buffer(data, sent))
+            self.count_sent(n)
+            sent += n
 
     def guess_type(self, path):
         """Guess the type of a file.
@@ -191,19 +661,148 @@ class SimpleMsHTTPRequestHandler(MsTimestampServer.MsHTTPRequestHandler):
         })
 
 
+class PooledHTTPServer(SocketServer.TCPServer):
+
+    """TCPServer serving connections from a fixed pool of worker threads.
+
+    Accepted connections wait in a queue for a free worker; when more than
+    max_conn connections are active or waiting, new ones are answered with a
+    503 and closed. Persistent connections are closed after keepalive_timeout
+    seconds of inactivity, or as soon as other connections are waiting: after
+    the current request, or at once if they are idle.
+
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, server_address, RequestHandlerClass, workers = 8,
+                 max_conn = 64, keepalive_timeout = 15):
+        SocketServer.TCPServer.__init__(self, server_address, RequestHandlerClass)
+        self.keepalive_timeout = keepalive_timeout
+        self.pending = Queue.Queue(max(1, max_conn - workers))
+        self.workers = []
+        for i in range(workers):
+            t = threading.Thread(target = self._worker)
+            t.daemon = True
+            t.start()
+            self.workers.append(t)
+
+    def saturated(self):
+        return not self.pending.empty()
+
+    def process_request(self, request, client_address):
+        try:
+            self.pending.put_nowait((request, client_address))
+        except Queue.Full:
+            self.reject(request)
+
+    def reject(self, request):
+        try:
+            request.sendall("HTTP/1.1 503 Service Unavailable\r\n"
+                            "Retry-After: 1\r\nContent-Length: 0\r\n"
+                            "Connection: close\r\n\r\n")
+        except socket.error:
+            pass
+        self.shutdown_request(request)
+
+    def _worker(self):
+        while True:
+            request, client_address = self.pending.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            self.shutdown_request(request)
+
+
 def test(HandlerClass = SimpleMsHTTPRequestHandler,
          ServerClass = BaseHTTPServer.HTTPServer):
     BaseHTTPServer.test(HandlerClass, ServerClass)
 
-def run(listeningPort):
+def run(listeningPort, announce = None, workers = 8, max_conn = 64,
+        keepalive_timeout = 15, cache_size = 256 << 20, prefetch_disk = 0,
+        prefetch_rate = 0, chunk_size = None):
+    """Serves the current directory on listeningPort. If announce is the
+    host:port address of an oracle, the files served are announced to it.
+    With workers = 0 requests are served one at a time over HTTP/1.0.
+    Files are looked up in a content index and the most requested ones are
+    kept in memory, up to cache_size bytes (0 disables both).
+    Request statistics are available at /_stats, and the size of every
+    file served at /_catalog.
+    With prefetch_disk > 0 the oracle (the announce host) can order up to
+    prefetch_disk bytes of contents to be copied here, downloaded at
+    prefetch_rate bytes per second at most (see Prefetcher).
+    Ranges of the files being downloaded here can be served before they
+    are complete; with the chunk_size of the oracle, the chunks already
+    written are announced to it."""
     handler = SimpleMsHTTPRequestHandler
-    httpd = SocketServer.TCPServer(("", listeningPort), handler)
+    if workers > 0:
+        httpd = PooledHTTPServer(("", listeningPort), handler, workers,
+                                 max_conn, keepalive_timeout)
+    else:
+        httpd = SocketServer.TCPServer(("", listeningPort), handler)
+    if cache_size > 0:
+        httpd.content_index = ContentIndex(os.getcwd(), handler.extensions_map)
+        httpd.content_cache = ContentCache(cache_size)
+    httpd.listing_cache = ListingCache()
+    httpd.stats = MsTimestampServer.ServerStats()
+    httpd.access_log = MsTimestampServer.BufferedLog()
+    if prefetch_disk > 0:
+        allowed = [announce.rpartition(':')[0]] if announce else []
+        httpd.prefetcher = Prefetcher(os.getcwd(), prefetch_disk,
+                                      prefetch_rate, allowed)
+        httpd.prefetcher.start()
+    if announce is not None:
+        ContentAnnouncer(announce, listeningPort,
+                         chunk_size = chunk_size).start()
+        print("Announcing contents to " + announce)
     print("Listening for HTTP requests on port " + str(listeningPort) + "...")
-    httpd.serve_forever()
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.access_log.close()
 
 if __name__ == '__main__':
+    # first argument is the listening port
+    # second (optional) argument is the host:port of the oracle announce listener,
+    # or - not to announce
+    # third (optional) argument is the number of worker threads (0 to serve one
+    # request at a time)
+    # fourth (optional) argument is the maximum number of connections
+    # fifth (optional) argument is the disk budget for prefetched contents, in
+    # MB (0 to refuse prefetch orders)
+    # sixth (optional) argument is the prefetch download rate limit, in KB/s
+    # seventh (optional) argument is the oracle's chunk_size, to announce the
+    # chunks of the files being downloaded
     if len(sys.argv) > 1:
         listeningPort = int(sys.argv[1])
     else:
         listeningPort = 9002
-    run(listeningPort)
+    if len(sys.argv) > 2 and sys.argv[2] != '-':
+        announce = sys.argv[2]
+    else:
+        announce = None
+    if len(sys.argv) > 3:
+        workers = int(sys.argv[3])
+    else:
+        workers = 8
+    if len(sys.argv) > 4:
+        max_conn = int(sys.argv[4])
+    else:
+        max_conn = 64
+    if len(sys.argv) > 5:
+        prefetch_disk = int(sys.argv[5]) << 20
+    else:
+        prefetch_disk = 0
+    if len(sys.argv) > 6:
+        prefetch_rate = int(sys.argv[6]) << 10
+    else:
+        prefetch_rate = 0
+    if len(sys.argv) > 7:
+        chunk_size = int(sys.argv[7])
+    else:
+        chunk_size = None
+    run(listeningPort, announce, workers, max_conn,
+        prefetch_disk = prefetch_disk, prefetch_rate = prefetch_rate,
+        chunk_size = chunk_size)
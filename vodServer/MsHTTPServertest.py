@@ -0,0 +1,237 @@
+"""Unit test for MsHTTPServer.py"""
+import os
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import httplib
+import BaseHTTPServer
+from MsHTTPServer import parse_range_header, SimpleMsHTTPRequestHandler
+from MsHTTPServer import PooledHTTPServer
+from ContentAnnouncer import ContentAnnouncer
+from ContentCache import url_key, ContentIndex, ContentCache, ListingCache
+
+class ParseRangeHeader(unittest.TestCase):
+    def testSingleRange(self):
+        """a closed range should be returned as is"""
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), [(0, 99)])
+
+    def testOpenRange(self):
+        """an open range should end at the last byte"""
+        self.assertEqual(parse_range_header('bytes=900-', 1000), [(900, 999)])
+
+    def testSuffixRange(self):
+        """a suffix range should select the last N bytes, at most the whole file"""
+        self.assertEqual(parse_range_header('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=-5000', 1000), [(0, 999)])
+
+    def testClampLast(self):
+        """a range past the end should be truncated to the file size"""
+        self.assertEqual(parse_range_header('bytes=500-5000', 1000), [(500, 999)])
+
+    def testMultipleRanges(self):
+        """ranges should be sorted, and overlapping or adjacent ones merged"""
+        ranges = parse_range_header('bytes=500-599, 0-9,10-19, 550-650', 1000)
+        self.assertEqual(ranges, [(0, 19), (500, 650)])
+
+    def testUnsatisfiable(self):
+        """ranges starting past the end should give an empty list (416)"""
+        self.assertEqual(parse_range_header('bytes=1000-1100', 1000), [])
+        self.assertEqual(parse_range_header('bytes=-0', 1000), [])
+
+    def testInvalid(self):
+        """malformed headers should be ignored (None)"""
+        self.assertEqual(parse_range_header('items=0-1', 1000), None)
+        self.assertEqual(parse_range_header('bytes=10-5', 1000), None)
+        self.assertEqual(parse_range_header('bytes=a-b', 1000), None)
+        self.assertEqual(parse_range_header('bytes=-', 1000), None)
+
+    def testEmpty(self):
+        """a header without any range should be ignored (None), not a 416"""
+        self.assertEqual(parse_range_header('bytes=', 1000), None)
+        self.assertEqual(parse_range_header('bytes= , ,', 1000), None)
+
+class RootHandler(SimpleMsHTTPRequestHandler):
+    """serves the files of server.root"""
+    def translate_path(self, path):
+        return os.path.join(self.server.root, *url_key(path).split('/'))
+
+    def log_message(self, format, *args):
+        pass
+
+class PartialFiles(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        # a download in progress, as vodClient/download.py leaves it
+        with open(os.path.join(self.root, 'a.bin.part'), 'wb') as f:
+            f.write(''.join(chr(i % 256) for i in range(2500)))
+        with open(os.path.join(self.root, 'a.bin.part.info'), 'w') as f:
+            json.dump({'etag': '"x"', 'offset': None}, f)
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), RootHandler)
+        self.server.root = self.root
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+
+    def get(self, headers = {}):
+        conn = httplib.HTTPConnection('127.0.0.1', self.server.server_address[1])
+        try:
+            conn.request('GET', '/a.bin', headers = headers)
+            response = conn.getresponse()
+            return response.status, response.getheader('content-range'), response.read()
+        finally:
+            conn.close()
+
+    def testAnnouncedRange(self):
+        """a range of the chunks announced should be served from the partial file"""
+        announcer = ContentAnnouncer('127.0.0.1:9', 9002, self.root,
+                                     chunk_size = 1000)
+        contents, partials = announcer.scanAll()
+        self.assertEqual(contents, set())
+        self.assertEqual(announcer.chunkMaps(partials), {'a.bin': '3'})
+        status, cr, body = self.get({'Range': 'bytes=1000-1999'})
+        self.assertEqual((status, cr), (206, 'bytes 1000-1999/*'))
+        self.assertEqual(body, ''.join(chr(i % 256) for i in range(1000, 2000)))
+
+    def testNotHeld(self):
+        """plain GETs, and ranges not written yet, should not be found"""
+        self.assertEqual(self.get()[0], 404)
+        self.assertEqual(self.get({'Range': 'bytes=2000-2999'})[0], 404)
+        self.assertEqual(self.get({'Range': 'bytes=2000-'})[0], 404)
+        self.assertEqual(self.get({'Range': 'bytes=0-9,20-29'})[0], 404)
+
+    def testPreallocated(self):
+        """only the bytes recorded as written should be served from a preallocated file"""
+        with open(os.path.join(self.root, 'a.bin.part.info'), 'w') as f:
+            json.dump({'etag': '"x"', 'offset': 500}, f)
+        self.assertEqual(self.get({'Range': 'bytes=0-499'})[0], 206)
+        self.assertEqual(self.get({'Range': 'bytes=0-500'})[0], 404)
+
+class KeepAlive(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        with open(os.path.join(self.root, 'a.txt'), 'wb') as f:
+            f.write('x' * 100)
+        self.server = PooledHTTPServer(('127.0.0.1', 0), RootHandler,
+                                       workers = 1, keepalive_timeout = 15)
+        self.server.root = self.root
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+
+    def get(self, conn):
+        conn.request('GET', '/a.txt')
+        response = conn.getresponse()
+        response.read()
+        return response.status
+
+    def testIdleReleased(self):
+        """an idle persistent connection should give its worker up to a waiting one"""
+        port = self.server.server_address[1]
+        idle = httplib.HTTPConnection('127.0.0.1', port, timeout = 5)
+        waiting = httplib.HTTPConnection('127.0.0.1', port, timeout = 5)
+        try:
+            self.assertEqual(self.get(idle), 200)
+            start = time.time()
+            self.assertEqual(self.get(waiting), 200)
+            self.assertTrue(time.time() - start < 2)
+        finally:
+            idle.close()
+            waiting.close()
+
+class CacheFill(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        with open(os.path.join(self.root, 'a.txt'), 'wb') as f:
+            f.write('x' * 1000)
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), RootHandler)
+        self.server.root = self.root
+        self.server.content_index = ContentIndex(self.root,
+                                                 RootHandler.extensions_map)
+        self.server.content_cache = ContentCache(1 << 20)
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+
+    def request(self, method, headers = {}):
+        conn = httplib.HTTPConnection('127.0.0.1', self.server.server_address[1])
+        try:
+            conn.request(method, '/a.txt', headers = headers)
+            response = conn.getresponse()
+            return response.status, len(response.read())
+        finally:
+            conn.close()
+
+    def testFullGetOnly(self):
+        """only a GET of the whole file should read it into the cache"""
+        self.assertEqual(self.request('HEAD'), (200, 0))
+        self.assertEqual(self.request('GET', {'Range': 'bytes=0-9'}), (206, 10))
+        self.assertEqual(self.server.content_cache.used, 0)
+        self.assertEqual(self.request('GET'), (200, 1000))
+        self.assertEqual(self.server.content_cache.used, 1000)
+        self.assertEqual(self.request('GET', {'Range': 'bytes=0-9'}), (206, 10))
+
+    def testEmptyRange(self):
+        """a Range header without any range should get the whole file"""
+        self.assertEqual(self.request('GET', {'Range': 'bytes='}), (200, 1000))
+
+class JsonNames(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for name in ('a.txt', 'bad\xff.txt', 'caf\xc3\xa9.txt'):
+            with open(os.path.join(self.root, name), 'wb') as f:
+                f.write('x' * 10)
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), RootHandler)
+        self.server.root = self.root
+        self.server.content_index = ContentIndex(self.root,
+                                                 RootHandler.extensions_map)
+        # one entry per chunk, so that the skipped name leaves an empty one
+        self.server.listing_cache = ListingCache(chunk_entries = 1)
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+
+    def get(self, path):
+        conn = httplib.HTTPConnection('127.0.0.1', self.server.server_address[1])
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            conn.close()
+
+    def testCatalog(self):
+        """names not UTF-8 encoded should be left out of the catalog"""
+        self.assertEqual(self.get('/_catalog'),
+                         (200, {u'a.txt': 10, u'caf\xe9.txt': 10}))
+
+    def testListing(self):
+        """names not UTF-8 encoded should be left out of JSON listings"""
+        status, entries = self.get('/?format=json')
+        self.assertEqual(status, 200)
+        self.assertEqual([e['name'] for e in entries], [u'a.txt', u'caf\xe9.txt'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,20 +14,278 @@
 
 """ Override of BaseHTTPRequestHandler
 Prints milliseconds in log messages
+If the server has a ServerStats object (server.stats), each request records
+its time to first byte, total time and the bytes of the body actually sent,
+and the number of concurrent connections; if it has a BufferedLog
+(server.access_log), log lines are written through it rather than one by one
+to stderr.
 """
 
-__all__ = ["MsHTTPRequestHandler"]
+__all__ = ["MsHTTPRequestHandler", "ServerStats", "BufferedLog"]
 
-import datetime
+import time
+import sys
+import json
+import threading
 import BaseHTTPServer
+from StringIO import StringIO
+
+class Histogram(object):
+    """Fixed-memory histogram: 8 linear buckets per power of two, so that
+    percentiles are within 12.5%. Values are clamped to [0, 2**48)."""
+
+    SUB_BITS = 3
+    SUB = 1 << SUB_BITS
+
+    def __init__(self):
+        self.counts = [0] * (48 * self.SUB)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        value = min(max(int(value), 0), (1 << 48) - 1)
+        if value < self.SUB:
+            index = value
+        else:
+            exp = value.bit_length() - 1
+            index = ((exp - self.SUB_BITS) * self.SUB +
+                     (value >> (exp - self.SUB_BITS)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        rank = max(1, int(round(q * self.count)))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                if index < self.SUB:
+                    return index
+                shift, sub = divmod(index, self.SUB)
+                return min((sub + self.SUB) << (shift - 1), self.max)
+        return self.max
+
+    def summary(self):
+        if self.count == 0:
+            return {'count': 0}
+        return {'count': self.count, 'mean': self.total / self.count,
+                'p50': self.percentile(0.5), 'p90': self.percentile(0.9),
+                'p99': self.percentile(0.99), 'max': self.max}
+
+
+class ServerStats(object):
+    """Per-request timing and throughput statistics of a server"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.connections = 0
+        self.peak_connections = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.status = {}
+        self.ttfb = Histogram()          # microseconds
+        self.transfer = Histogram()      # microseconds
+        self.size = Histogram()          # bytes
+        self.concurrency = Histogram()   # connections open at request start
+
+    def connection_opened(self):
+        with self.lock:
+            self.connections += 1
+            if self.connections > self.peak_connections:
+                self.peak_connections = self.connections
+
+    def connection_closed(self):
+        with self.lock:
+            self.connections -= 1
+
+    def request_done(self, status, ttfb, total, nbytes):
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += nbytes
+            self.status[status] = self.status.get(status, 0) + 1
+            self.ttfb.record(ttfb * 1000000)
+            self.transfer.record(total * 1000000)
+            self.size.record(nbytes)
+            self.concurrency.record(self.connections)
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = time.time() - self.started
+            return {'uptime': elapsed,
+                    'connections': self.connections,
+                    'peak_connections': self.peak_connections,
+                    'requests': self.requests,
+                    'bytes_sent': self.bytes_sent,
+                    'throughput_Bps': self.bytes_sent / elapsed if elapsed else 0,
+                    'status': dict((str(k), v) for k, v in self.status.items()),
+                    'ttfb_us': self.ttfb.summary(),
+                    'transfer_us': self.transfer.summary(),
+                    'response_bytes': self.size.summary(),
+                    'concurrency': self.concurrency.summary()}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), sort_keys = True)
+
+
+class BufferedLog(object):
+    """Collects log lines and writes them in batches, when buffer lines are
+    pending or the oldest one is older than delay seconds (checked on every
+    write, and every delay seconds by a background thread)"""
+
+    def __init__(self, out = sys.stderr, buffer = 64, delay = 1.0):
+        self.out = out
+        self.buffer = buffer
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.lines = []
+        self.oldest = 0
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target = self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while not self.closed.wait(self.delay):
+            with self.lock:
+                if self.lines and time.time() - self.oldest >= self.delay:
+                    self._flush()
+
+    def write(self, line):
+        with self.lock:
+            if not self.lines:
+                self.oldest = time.time()
+            self.lines.append(line)
+            if (len(self.lines) >= self.buffer or
+                    time.time() - self.oldest >= self.delay):
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        """writes the pending lines and stops the background thread"""
+        self.closed.set()
+        self.thread.join()
+        self.flush()
+
+    def _flush(self):
+        if self.lines:
+            self.out.write(''.join(self.lines))
+            self.out.flush()
+            self.lines = []
+
+
+class CountingWriter(object):
+    """Wraps the output file of a connection, counting the bytes written"""
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.count += len(data)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
 
 class MsHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # second and formatted prefix of the last log timestamp
+    _stamp = (None, None)
+
     def log_date_time_string(self):
         """Return the current time formatted for logging, with additional ms."""
-        now = datetime.datetime.now()
-        # year, month, day, hh, mm, ss, x, y, z = time.localtime(now)
-        tt = now.timetuple()
-        ms = now.microsecond / 1000
-        s = "%02d/%3s/%04d %02d:%02d:%02d:%04d" % (
-                tt[2], self.monthname[tt[1]], tt[0], tt[3], tt[4], tt[5], ms)
-        return s
+        now = time.time()
+        second = int(now)
+        cached, prefix = MsHTTPRequestHandler._stamp
+        if cached != second:
+            tt = time.localtime(second)
+            prefix = "%02d/%3s/%04d %02d:%02d:%02d" % (
+                    tt[2], self.monthname[tt[1]], tt[0], tt[3], tt[4], tt[5])
+            MsHTTPRequestHandler._stamp = (second, prefix)
+        return "%s:%04d" % (prefix, int((now - second) * 1000))
+
+    def log_message(self, format, *args):
+        access_log = getattr(self.server, 'access_log', None)
+        if access_log is None:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+            return
+        access_log.write("%s - - [%s] %s\n" % (self.client_address[0],
+                         self.log_date_time_string(), format % args))
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.stats = getattr(self.server, 'stats', None)
+        if self.stats is not None:
+            self.stats.connection_opened()
+            self.wfile = CountingWriter(self.wfile)
+
+    def finish(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        finally:
+            if self.stats is not None:
+                self.stats.connection_closed()
+
+    def handle_one_request(self):
+        if self.stats is None:
+            return BaseHTTPServer.BaseHTTPRequestHandler.handle_one_request(self)
+        self.request_start = None
+        self.first_byte = None
+        self.response_status = None
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.handle_one_request(self)
+        finally:
+            # also when the client went away in the middle of the body
+            if (self.request_start is not None and
+                    self.response_status is not None):
+                now = time.time()
+                first_byte = self.first_byte or now
+                sent = self.wfile.count if self.first_byte is not None else 0
+                self.stats.request_done(self.response_status,
+                                        first_byte - self.request_start,
+                                        now - self.request_start, sent)
+
+    def parse_request(self):
+        if self.stats is not None:
+            self.request_start = time.time()
+        return BaseHTTPServer.BaseHTTPRequestHandler.parse_request(self)
+
+    def send_response(self, code, message = None):
+        if self.stats is not None:
+            self.response_status = code
+        BaseHTTPServer.BaseHTTPRequestHandler.send_response(self, code, message)
+
+    def end_headers(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.end_headers(self)
+        if self.stats is not None:
+            self.first_byte = time.time()
+            # from now on, the body
+            self.wfile.count = 0
+
+    def count_sent(self, nbytes):
+        """Records nbytes of the body sent straight to the socket, rather
+        than through wfile."""
+        if self.stats is not None:
+            self.wfile.count += nbytes
+
+    def send_stats(self):
+        """Answers with the server statistics as JSON. Returns the body as
+        a file object, like send_head()."""
+        if self.stats is None:
+            self.send_error(404, "Statistics are disabled")
+            return None
+        body = self.stats.to_json()
+        self.send_response(200)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        return StringIO(body)
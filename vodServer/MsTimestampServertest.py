@@ -0,0 +1,111 @@
+"""Unit test for MsTimestampServer.py"""
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import httplib
+import BaseHTTPServer
+from StringIO import StringIO
+from MsTimestampServer import BufferedLog, ServerStats, Histogram
+from MsHTTPServertest import RootHandler
+
+class Histograms(unittest.TestCase):
+    def testPercentiles(self):
+        """percentiles should be within 12.5% of the values recorded"""
+        h = Histogram()
+        for value in range(1, 1001):
+            h.record(value)
+        summary = h.summary()
+        self.assertEqual((summary['count'], summary['max']), (1000, 1000))
+        for q, key in (0.5, 'p50'), (0.9, 'p90'), (0.99, 'p99'):
+            self.assertTrue(0.875 * q * 1000 <= summary[key] <= q * 1000, key)
+        self.assertEqual(Histogram().summary(), {'count': 0})
+
+class Log(unittest.TestCase):
+    def testTimer(self):
+        """pending lines should be written after delay, even without more writes"""
+        out = StringIO()
+        log = BufferedLog(out, buffer = 64, delay = 0.05)
+        log.write('a\n')
+        self.assertEqual(out.getvalue(), '')
+        time.sleep(0.3)
+        self.assertEqual(out.getvalue(), 'a\n')
+        log.close()
+
+    def testBuffer(self):
+        """lines should be written once buffer of them are pending"""
+        out = StringIO()
+        log = BufferedLog(out, buffer = 2, delay = 60)
+        log.write('a\n')
+        log.write('b\n')
+        self.assertEqual(out.getvalue(), 'a\nb\n')
+        log.close()
+
+class QuietServer(BaseHTTPServer.HTTPServer):
+    def handle_error(self, request, client_address):
+        pass
+
+class BytesSent(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        with open(os.path.join(self.root, 'a.txt'), 'wb') as f:
+            f.write('x' * 100000)
+        self.server = QuietServer(('127.0.0.1', 0), RootHandler)
+        self.server.root = self.root
+        self.server.stats = ServerStats()
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+
+    def request(self, method, headers = {}):
+        conn = httplib.HTTPConnection('127.0.0.1', self.server.server_address[1])
+        try:
+            conn.request(method, '/a.txt', headers = headers)
+            conn.getresponse().read()
+        finally:
+            conn.close()
+        # the stats are recorded once the response is sent
+        time.sleep(0.1)
+        return self.server.stats.snapshot()['bytes_sent']
+
+    def testBody(self):
+        """only the bytes of the bodies sent should count"""
+        self.assertEqual(self.request('GET'), 100000)
+        self.assertEqual(self.request('HEAD'), 100000)
+        self.assertEqual(self.request('GET', {'Range': 'bytes=0-99'}), 100100)
+        self.assertEqual(self.server.stats.snapshot()['requests'], 3)
+
+    def testAborted(self):
+        """an aborted transfer should only count the bytes sent"""
+        self.server.root = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(self.server.root, 'a.txt'), 'wb') as f:
+                f.write('x' * (64 << 20))
+            sock = socket.create_connection(self.server.server_address)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            sock.sendall('GET /a.txt HTTP/1.0\r\n\r\n')
+            received = 0
+            while received < 65536:
+                received += len(sock.recv(65536))
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                            '\x01\x00\x00\x00\x00\x00\x00\x00')
+            sock.close()
+            for i in range(50):
+                if self.server.stats.snapshot()['requests']:
+                    break
+                time.sleep(0.1)
+            sent = self.server.stats.snapshot()['bytes_sent']
+            self.assertTrue(0 < sent < 64 << 20)
+        finally:
+            shutil.rmtree(self.server.root)
+
+if __name__ == '__main__':
+    unittest.main()
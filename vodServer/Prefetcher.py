@@ -0,0 +1,165 @@
+# Copyright 2014 Emanuele Di Pascale
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Copies the contents the oracle asks MsHTTPServer to prefetch
+The oracle (see oracle/prefetch.py) POSTs orders to /_prefetch:
+
+  {"content": "movies/a.mp4", "url": "http://10.0.0.2:9002/movies/a.mp4",
+   "rate": 500000}
+
+and the content is downloaded from url, at rate bytes per second at most,
+into a hidden file renamed in place once complete: from then on it is served
+(and announced by the ContentAnnouncer) like any other file. Orders are
+served one at a time. Prefetched files take at most disk bytes in total, and
+at most rate bytes per second (0 for no limit) are downloaded, whatever the
+orders ask for. Only the addresses in allowed may give orders.
+GET /_prefetch returns the state of the orders, for the oracle to learn
+which copies completed.
+"""
+
+__all__ = ["Prefetcher"]
+
+import os
+import socket
+import threading
+import time
+import urllib2
+import Queue
+from collections import deque
+from ContentCache import url_key
+
+BLOCK_SIZE = 64 << 10
+
+class PrefetchError(Exception): pass
+
+class Prefetcher(threading.Thread):
+    def __init__(self, root = None, disk = 1 << 30, rate = 0, allowed = (),
+                 max_queue = 16, timeout = 30):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.root = root or os.getcwd()
+        self.disk = disk
+        self.rate = rate
+        self.allowed = set(allowed) | set(['127.0.0.1'])
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.queue = Queue.Queue(max_queue)
+        # contents queued or being downloaded
+        self.pending = set()
+        self.active = None
+        # bytes of the files prefetched so far
+        self.used = 0
+        self.done = deque(maxlen = 256)
+        self.failed = deque(maxlen = 256)
+
+    def allows(self, address):
+        return address in self.allowed
+
+    def path(self, content):
+        """the file in which content is stored, or None for a bad name"""
+        key = url_key(content)
+        if not key:
+            return None
+        return os.path.join(self.root, *key.split('/'))
+
+    def submit(self, content, url, rate = None):
+        """queues an order, returns an HTTP status code and a message"""
+        path = self.path(content)
+        if path is None or not url.startswith('http://'):
+            return 400, 'bad order'
+        if os.path.exists(path):
+            return 409, 'already held'
+        with self.lock:
+            if content in self.pending:
+                return 409, 'already queued'
+            if self.used >= self.disk:
+                return 507, 'disk budget exhausted'
+            try:
+                self.queue.put_nowait((content, url, rate))
+            except Queue.Full:
+                return 503, 'too many orders'
+            self.pending.add(content)
+            # the outcome of an earlier order isn't this one's
+            for results in self.done, self.failed:
+                if content in results:
+                    results.remove(content)
+        return 202, 'queued'
+
+    def status(self):
+        with self.lock:
+            return {'active': self.active,
+                    'queued': sorted(self.pending - set([self.active])),
+                    'done': list(self.done),
+                    'failed': list(self.failed),
+                    'used': self.used, 'disk': self.disk}
+
+    def run(self):
+        while True:
+            content, url, rate = self.queue.get()
+            with self.lock:
+                self.active = content
+            try:
+                size = self.fetch(content, url, rate)
+            except (PrefetchError, urllib2.URLError, socket.error, IOError,
+                    OSError) as e:
+                print("Prefetch of %s from %s failed: %s" % (content, url, e))
+                with self.lock:
+                    self.failed.append(content)
+            else:
+                with self.lock:
+                    self.used += size
+                    self.done.append(content)
+            finally:
+                with self.lock:
+                    self.active = None
+                    self.pending.discard(content)
+
+    def fetch(self, content, url, rate = None):
+        """downloads content from url, returns its size"""
+        limit = self.rate
+        if rate:
+            limit = min(limit, rate) if limit else rate
+        path = self.path(content)
+        directory, name = os.path.split(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = os.path.join(directory, '.' + name + '.part')
+        response = urllib2.urlopen(url, timeout = self.timeout)
+        try:
+            length = response.info().getheader('content-length')
+            if length is not None and self.used + int(length) > self.disk:
+                raise PrefetchError('%s bytes over the disk budget' % length)
+            size = 0
+            start = time.time()
+            with open(tmp, 'wb') as f:
+                while True:
+                    data = response.read(BLOCK_SIZE)
+                    if not data:
+                        break
+                    f.write(data)
+                    size += len(data)
+                    if self.used + size > self.disk:
+                        raise PrefetchError('over the disk budget')
+                    if limit:
+                        ahead = float(size) / limit - (time.time() - start)
+                        if ahead > 0:
+                            time.sleep(ahead)
+            if length is not None and size != int(length):
+                raise PrefetchError('got %d of %s bytes' % (size, length))
+            os.rename(tmp, path)
+            return size
+        finally:
+            response.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
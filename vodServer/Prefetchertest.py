@@ -0,0 +1,77 @@
+"""Unit test for Prefetcher.py"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import BaseHTTPServer
+import SimpleHTTPServer
+from Prefetcher import Prefetcher, PrefetchError
+
+class OriginHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """serves the files of server.root"""
+    def translate_path(self, path):
+        return os.path.join(self.server.root, path.lstrip('/'))
+
+    def log_message(self, format, *args):
+        pass
+
+class Orders(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        open(os.path.join(self.root, 'held.txt'), 'w').close()
+        self.prefetcher = Prefetcher(self.root, disk = 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testSubmit(self):
+        """orders should be queued once, unless the content is held"""
+        self.assertEqual(self.prefetcher.submit('a.txt', 'http://h/a.txt')[0], 202)
+        self.assertEqual(self.prefetcher.submit('a.txt', 'http://h/a.txt')[0], 409)
+        self.assertEqual(self.prefetcher.submit('held.txt', 'http://h/held.txt')[0], 409)
+        self.assertEqual(self.prefetcher.status()['queued'], ['a.txt'])
+
+    def testBadOrders(self):
+        """orders for no file or from another scheme should be refused"""
+        self.assertEqual(self.prefetcher.submit('../', 'http://h/a')[0], 400)
+        self.assertEqual(self.prefetcher.submit('a.txt', 'file:///etc/passwd')[0], 400)
+
+    def testDiskBudget(self):
+        """no order should be taken once the disk budget is used"""
+        self.prefetcher.used = 1000
+        self.assertEqual(self.prefetcher.submit('a.txt', 'http://h/a.txt')[0], 507)
+
+class Fetch(unittest.TestCase):
+    def setUp(self):
+        self.origin = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        with open(os.path.join(self.origin, 'a.txt'), 'wb') as f:
+            f.write('x' * 5000)
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), OriginHandler)
+        self.server.root = self.origin
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/a.txt' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.origin)
+        shutil.rmtree(self.root)
+
+    def testFetch(self):
+        """fetch should copy the content in place, and nothing else"""
+        prefetcher = Prefetcher(self.root)
+        self.assertEqual(prefetcher.fetch('sub/b.txt', self.url), 5000)
+        self.assertEqual(os.listdir(os.path.join(self.root, 'sub')), ['b.txt'])
+
+    def testOverBudget(self):
+        """fetch should give up a content larger than the disk budget"""
+        prefetcher = Prefetcher(self.root, disk = 4000)
+        self.assertRaises(PrefetchError, prefetcher.fetch, 'b.txt', self.url)
+        self.assertEqual(os.listdir(self.root), [])
+
+if __name__ == '__main__':
+    unittest.main()